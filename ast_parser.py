@@ -1,88 +1,329 @@
+import os
 import ast
+import builtins
 import inspect
+import hashlib
+import textwrap
+from collections import namedtuple
 
-def traverse(node, arg, indent=0):
-    if isinstance(node, (ast.arguments, ast.Load, ast.Store, ast.Name, ast.Pass, ast.Break, ast.Continue)):
-        return []
-   
+# Node types whose children are never searched for parameter usages
+SKIPPED = (ast.arguments, ast.Load, ast.Store, ast.Name, ast.Pass, ast.Break, ast.Continue)
+# Nodes that use a parameter without operating on it
+SANITIZED = (ast.FunctionDef, ast.ClassDef, ast.Module, ast.Return)
+
+# One node that uses a parameter directly: its type, the operator names it applies,
+# the called function name and the constant it assigns, if any
+Operation = namedtuple('Operation', ['type', 'op', 'ops', 'func', 'value'])
+# Top level function found in a source file: its parameters as (name, annotation source
+# or inspect.Parameter.empty), the usages of each parameter and the digest of its source
+FunctionInfo = namedtuple('FunctionInfo', ['name', 'parameters', 'usages', 'digest', 'pure'])
+
+# Builtins whose result only depends on their arguments and that change nothing
+PURE_BUILTINS = {'abs', 'all', 'any', 'bin', 'bool', 'chr', 'dict', 'divmod', 'enumerate', 'filter', 'float', 'format',
+                 'frozenset', 'hex', 'int', 'isinstance', 'len', 'list', 'map', 'max', 'min', 'oct', 'ord', 'pow',
+                 'range', 'repr', 'reversed', 'round', 'set', 'sorted', 'str', 'sum', 'tuple', 'zip'}
+# Standard modules made of pure functions and constants
+PURE_MODULES = {'math', 'operator', 'string'}
+# Methods that change the object they are called on
+MUTATING_METHODS = {'append', 'extend', 'insert', 'remove', 'pop', 'clear', 'update', 'add', 'discard', 'sort',
+                    'reverse', 'setdefault', 'popitem', 'write', 'writelines', 'send', 'close'}
+# Statements and expressions a pure function never contains
+IMPURE_NODES = (ast.Global, ast.Nonlocal, ast.Import, ast.ImportFrom, ast.Yield, ast.YieldFrom, ast.Await)
+
+# Analysis of the parsed source files: path -> (modification time, functions), only the last
+# version of a file is kept and the least recently used files go first
+_file_cache = {}
+MAX_CACHED_FILES = 10000
+
+
+def traverse(node, args):
+    # Iterative depth first search returning (node, parameter) for every node with
+    # a parameter as direct child, in the order the recursive walk used to find them
     content = []
+    if isinstance(node, SKIPPED):
+        return content
 
-    children = ast.iter_child_nodes(node)
-    if children:
-        for child in children:
-            if isinstance(child, ast.Name) and child.id == arg:
-                content.append(node)
-            else:
-                content += traverse(child, arg, indent + 2)
+    stack = [ast.iter_child_nodes(node)]
+    parents = [node]
+    while stack:
+        for child in stack[-1]:
+            if isinstance(child, ast.Name) and child.id in args:
+                content.append((parents[-1], child.id))
+            elif not isinstance(child, SKIPPED):
+                stack.append(ast.iter_child_nodes(child))
+                parents.append(child)
+                break
+        else:
+            stack.pop()
+            parents.pop()
 
     return content
 
 
-def func_parser(func, arg):
-    source = inspect.getsource(func)
-    tree = ast.parse(source)
+def to_operation(node):
+    op = type(node.op).__name__ if hasattr(node, 'op') else None
+    ops = tuple(type(item).__name__ for item in getattr(node, 'ops', []))
 
-    content = traverse(tree.body[0], arg)
+    func = None
+    if isinstance(node, ast.Call):
+        if isinstance(node.func, ast.Name):
+            func = node.func.id
+        elif isinstance(node.func, ast.Attribute):
+            func = node.func.attr
 
-    return content
-    
-    
-            
-def sanitize(content):
-    temp = []
-    for node in content:
-        if not isinstance(node, (ast.FunctionDef, ast.ClassDef, ast.Module, ast.Return)):
-            temp.append(node)
-    content.clear()
+    value = None
+    if isinstance(node, ast.Assign) and isinstance(node.value, ast.Constant):
+        value = node.value.value
 
-    return temp
-            
+    return Operation(type(node).__name__, op, ops, func, value)
 
 
+def parameters(function_node):
+    arguments = function_node.args
+    params = arguments.posonlyargs + arguments.args
+    if arguments.vararg:
+        params.append(arguments.vararg)
+    params += arguments.kwonlyargs
+    if arguments.kwarg:
+        params.append(arguments.kwarg)
+    return params
 
 
-def analyze(func):
-    # source = inspect.getsource(func)
-    # annotations = func.__annotations__
-    
-    args = list(inspect.signature(func).parameters.keys())
+def annotation(param):
+    if param.annotation is None:
+        return inspect.Parameter.empty
+    return ast.unparse(param.annotation)
+
+
+def analyze_node(function_node, args=None):
+    # Single walk of the function body building the usages of all parameters at once
+    if args is None:
+        args = [param.arg for param in parameters(function_node)]
+    result = {arg: [] for arg in args}
+    for node, arg in traverse(function_node, set(args)):
+        if not isinstance(node, SANITIZED):
+            result[arg].append(to_operation(node))
+    return result
+
+
+def defined_names(node):
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [node.name]
+    if isinstance(node, ast.Assign):
+        return [target.id for target in node.targets if isinstance(target, ast.Name)]
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return [node.target.id]
+    return []
+
+
+def segment(lines, node):
+    # source lines of a top level statement, decorators included
+    start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+    return ''.join(lines[start - 1:node.end_lineno])
+
+
+def digests(source, tree):
+    # The digest of a function covers its own source, the top level definitions it refers to
+    # (transitively) and every top level statement that is not a definition, such as imports,
+    # so editing a helper also invalidates the functions calling it
+    lines = source.splitlines(keepends=True)
+    definitions = {}
+    context = hashlib.sha256()
+    for node in tree.body:
+        names = defined_names(node)
+        for name in names:
+            definitions.setdefault(name, []).append(node)
+        if not names:
+            context.update(segment(lines, node).encode())
 
     result = {}
-    for arg in args:
-        content = func_parser(func, arg)
-        content = sanitize(content)
-        temp = []
-        for node in content:
-            sub_content = {}
-            for k, v in node.__dict__.items():
-                if k not in ["lineno", "col_offset", "end_lineno", "end_col_offset"]:
-                    # sub_content[k] = [type(v).__name__, v]
-                    # if type(v).__name__ == 'list' iterate over them and capture the type of every item inside
-                    if type(v).__name__ == 'list':
-                        sub_content[k] = []
-                        for item in v:
-                            sub_content[k].append([type(item).__name__, item])
-                    else:
-                        sub_content[k] = [type(v).__name__, v]
-
-            sub_content['type'] = type(node).__name__
-            temp.append(sub_content)
-        result[arg] = temp
+    for node in tree.body:
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            continue
+        reached = {id(node): node}
+        stack = [node]
+        while stack:
+            for child in ast.walk(stack.pop()):
+                if isinstance(child, ast.Name):
+                    for definition in definitions.get(child.id, []):
+                        if id(definition) not in reached:
+                            reached[id(definition)] = definition
+                            stack.append(definition)
 
+        sha = context.copy()
+        for definition in sorted(reached.values(), key=lambda definition: definition.lineno):
+            sha.update(segment(lines, definition).encode())
+        result[node.name] = sha.hexdigest()
     return result
 
 
+def root_name(node):
+    # x for x.a.b, x[0].c or x.f().g
+    while isinstance(node, (ast.Attribute, ast.Subscript, ast.Call)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def local_names(function_node):
+    names = set()
+    for child in ast.walk(function_node):
+        if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+            names.add(child.id)
+        elif isinstance(child, ast.arg):
+            names.add(child.arg)
+        elif isinstance(child, ast.ExceptHandler) and child.name:
+            names.add(child.name)
+    return names
+
+
+def is_pure(function_node, constants, modules, pure_functions):
+    # Conservative: the outcome may only depend on the arguments, the function reads nothing
+    # but its locals, literal constants, pure builtins and modules, and the pure functions of its
+    # module, and it changes nothing outside of its locals
+    if isinstance(function_node, ast.AsyncFunctionDef) or function_node.decorator_list:
+        return False
+    params = {param.arg for param in parameters(function_node)}
+    local = local_names(function_node)
+    for child in ast.walk(function_node):
+        if isinstance(child, IMPURE_NODES):
+            return False
+        if isinstance(child, ast.Attribute) and not isinstance(child.ctx, ast.Load):
+            return False
+        if isinstance(child, ast.Subscript) and not isinstance(child.ctx, ast.Load):
+            root = root_name(child)
+            if root is None or root not in local or root in params:
+                return False
+        if isinstance(child, ast.Call) and isinstance(child.func, ast.Attribute) and child.func.attr in MUTATING_METHODS:
+            return False
+        if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Load) and child.id not in local:
+            if child.id in constants or child.id in modules or child.id in pure_functions:
+                continue
+            if child.id in PURE_BUILTINS:
+                continue
+            # raising a builtin exception
+            if isinstance(getattr(builtins, child.id, None), type) and issubclass(getattr(builtins, child.id), BaseException):
+                continue
+            return False
+    return True
+
+
+def is_immutable(value):
+    if value is None or type(value) in (bool, int, float, complex, str, bytes):
+        return True
+    if type(value) in (tuple, frozenset):
+        return all(is_immutable(item) for item in value)
+    return False
+
+
+def pure_functions(tree):
+    # Top level functions found pure, the ones calling each other are pure together
+    constants = {}
+    modules = set()
+    rebound = set()
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.update(alias.asname or alias.name for alias in node.names if alias.name in PURE_MODULES)
+        for name in defined_names(node):
+            # only names bound to an immutable literal are constants, a class has state of its own
+            # and the functions are checked below
+            immutable = False
+            if isinstance(node, (ast.Assign, ast.AnnAssign)):
+                try:
+                    immutable = node.value is not None and is_immutable(ast.literal_eval(node.value))
+                except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+                    pass
+            if immutable:
+                constants[name] = constants.get(name, 0) + 1
+            elif not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                rebound.add(name)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Global):
+            rebound.update(node.names)
+    # a constant assigned once and never declared global anywhere
+    constants = {name for name, assignments in constants.items() if assignments == 1 and name not in rebound}
+
+    functions = {node.name: node for node in tree.body if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    constants -= set(functions)
+    pure = set(functions)
+    changed = True
+    while changed:
+        changed = False
+        for name in sorted(pure):
+            if not is_pure(functions[name], constants, modules, pure):
+                pure.discard(name)
+                changed = True
+    return pure
+
+
+def is_testable(node):
+    # Tests are generated for the plain functions of a module, coroutines and dunder functions
+    # are left out, the same way the import-based discovery does
+    return isinstance(node, ast.FunctionDef) and not node.name.startswith('__')
+
+
+def inspect_source(source):
+    tree = ast.parse(source)
+    function_digests = digests(source, tree)
+    pure = pure_functions(tree)
+    functions = {}
+    for node in tree.body:
+        if is_testable(node):
+            signature = [(param.arg, annotation(param)) for param in parameters(node)]
+            functions[node.name] = FunctionInfo(node.name, signature, analyze_node(node), function_digests[node.name], node.name in pure)
+    return functions
+
+
+def inspect_file(path):
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    entry = _file_cache.pop(path, None)
+    if entry is None or entry[0] != mtime:
+        with open(path) as source_file:
+            entry = (mtime, inspect_source(source_file.read()))
+    _file_cache[path] = entry
+    while len(_file_cache) > MAX_CACHED_FILES:
+        del _file_cache[next(iter(_file_cache))]
+    return entry[1]
+
+
+def analyze_source(source):
+    return {name: info.usages for name, info in inspect_source(source).items()}
+
+
+def analyze_file(path):
+    return {name: info.usages for name, info in inspect_file(path).items()}
+
+
+def analyze(func):
+    # Top level functions come from the analysis of their whole file, parsed only once
+    try:
+        path = inspect.getsourcefile(func)
+    except TypeError:
+        path = None
+    if path and os.path.isfile(path) and func.__qualname__ == func.__name__:
+        functions = inspect_file(path)
+        if func.__name__ in functions:
+            return functions[func.__name__].usages
+
+    tree = ast.parse(textwrap.dedent(inspect.getsource(func)))
+    node = tree.body[0]
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        return analyze_node(node)
+    return analyze_node(node, list(inspect.signature(func).parameters.keys()))
+
+
 def process_result(result):
     temp = {}
     for k, v in result.items():
         temp[k] = []
         for item in v:
-            if 'func' in item.keys() and item['type'] == 'Call':
-                temp[k].append(item['func'][1].id)
-            elif 'op' in item.keys():
-                temp[k].append(item['op'][0])
-            elif 'ops' in item.keys():
+            if item.type == 'Call':
+                if item.func is not None:
+                    temp[k].append(item.func)
+            elif item.op is not None:
+                temp[k].append(item.op)
+            elif item.ops:
                 # it's a list of operations, so we need to extract the names
-                temp[k] += [op[0] for op in item['ops']]
-    
+                temp[k] += list(item.ops)
+
     return temp
@@ -0,0 +1,167 @@
+import csv
+import time
+
+import utils as ut
+import prediction_cache as pc
+# numpy is imported by the functions that train or run the model, TensorFlow is never needed
+
+MODEL_FILE = 'bag_of_ops.npz'
+
+# Softmax regression over the set of words of an op sequence
+EPOCHS = 30
+BATCH_SIZE = 4096
+LEARNING_RATE = 0.05
+L2 = 1e-4
+
+
+def words(ops_funcs):
+    # Same words the Keras Tokenizer of the LSTM backend finds in the op sequence
+    return pc.normalize(ops_funcs).split()
+
+
+def features(texts, word_index):
+    # One row per op sequence with a 1 for every known word it contains
+    import numpy as np
+
+    matrix = np.zeros((len(texts), len(word_index)), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in words(text):
+            column = word_index.get(word)
+            if column is not None:
+                matrix[row, column] = 1.0
+    return matrix
+
+
+def token_features(tokens, size):
+    # Same matrix from rows of padded word ids (1-based, 0 is the padding)
+    import numpy as np
+
+    matrix = np.zeros((len(tokens), size + 1), dtype=np.float32)
+    matrix[np.arange(len(tokens))[:, None], tokens] = 1.0
+    return matrix[:, 1:]
+
+
+def load_rows():
+    # Padded word ids, labels, words and classes of the sampled dataset, or of random_samples.csv
+    import numpy as np
+    import sampler as sm
+    import classifier as cl
+
+    if sm.has_dataset():
+        tokens, labels, vocab = sm.load_dataset()
+        vocabulary = sorted(vocab['word_index'], key=vocab['word_index'].get)
+        return tokens, labels, vocabulary, vocab['classes']
+
+    with open('random_samples.csv', newline='') as samples_file:
+        rows = list(csv.DictReader(samples_file))
+    classes = sorted({row['datatype'] for row in rows})
+    word_index = {}
+    sequences = []
+    for row in rows:
+        sequences.append([word_index.setdefault(word, len(word_index) + 1) for word in words(row['ops_funcs'])])
+    tokens = np.zeros((len(rows), cl.MAX_SEQUENCE_LENGTH), dtype=np.int32)
+    for idx, sequence in enumerate(sequences):
+        sequence = sequence[-cl.MAX_SEQUENCE_LENGTH:]
+        tokens[idx, len(tokens[idx]) - len(sequence):] = sequence
+    labels = np.array([classes.index(row['datatype']) for row in rows], dtype=np.int32)
+    return tokens, labels, sorted(word_index, key=word_index.get), classes
+
+
+def softmax(logits):
+    import numpy as np
+
+    logits = logits - logits.max(axis=1, keepdims=True)
+    exponentials = np.exp(logits)
+    return exponentials / exponentials.sum(axis=1, keepdims=True)
+
+
+def train(model_file=MODEL_FILE, epochs=EPOCHS, seed=0):
+    # Mini-batch gradient descent with Adam, the rows are read one batch at a time so the
+    # dataset can stay memory-mapped
+    import numpy as np
+    import classifier as cl
+
+    start = time.time()
+    tokens, labels, vocabulary, classes = load_rows()
+    train_rows, test_rows = cl.split_indices(len(labels))
+    rng = np.random.default_rng(seed)
+
+    weights = np.zeros((len(vocabulary), len(classes)), dtype=np.float32)
+    bias = np.zeros(len(classes), dtype=np.float32)
+    moments = [np.zeros_like(weights), np.zeros_like(bias)]
+    velocities = [np.zeros_like(weights), np.zeros_like(bias)]
+    step = 0
+    for epoch in range(epochs):
+        order = rng.permutation(train_rows)
+        for batch_start in range(0, len(order), BATCH_SIZE):
+            # sorted rows read the mapped file sequentially
+            rows = np.sort(order[batch_start:batch_start + BATCH_SIZE])
+            x = token_features(np.asarray(tokens[rows]), len(vocabulary))
+            y = np.asarray(labels[rows])
+
+            probabilities = softmax(x @ weights + bias)
+            probabilities[np.arange(len(y)), y] -= 1.0
+            gradients = [x.T @ probabilities / len(y) + L2 * weights, probabilities.mean(axis=0)]
+
+            step += 1
+            for parameter, gradient, moment, velocity in zip((weights, bias), gradients, moments, velocities):
+                moment *= 0.9
+                moment += 0.1 * gradient
+                velocity *= 0.999
+                velocity += 0.001 * gradient ** 2
+                parameter -= LEARNING_RATE * (moment / (1 - 0.9 ** step)) / (np.sqrt(velocity / (1 - 0.999 ** step)) + 1e-8)
+
+    accuracy = evaluate(weights, bias, tokens, labels, test_rows, len(vocabulary))
+    ut.print_info(f'[TEST] Accuracy: {accuracy * 100:.2f}%')
+
+    np.savez(model_file, weights=weights, bias=bias, vocabulary=np.array(vocabulary), classes=np.array(classes))
+    ut.print_info(f'Training time: {time.time() - start:.2f} seconds')
+    return accuracy
+
+
+def evaluate(weights, bias, tokens, labels, rows, size):
+    import numpy as np
+
+    correct = 0
+    for batch_start in range(0, len(rows), BATCH_SIZE):
+        batch = np.sort(rows[batch_start:batch_start + BATCH_SIZE])
+        x = token_features(np.asarray(tokens[batch]), size)
+        correct += int(((x @ weights + bias).argmax(axis=1) == np.asarray(labels[batch])).sum())
+    return correct / max(1, len(rows))
+
+
+# Classifier backend answering from the trained softmax regression, loads in milliseconds
+class BagOfOpsBackend:
+    def __init__(self, model_file=MODEL_FILE):
+        self.model_file = model_file
+        self.artifacts = (model_file,)
+        self.weights = None
+        self.bias = None
+        self.word_index = None
+        self.classes = None
+
+    @property
+    def is_open(self):
+        return self.weights is not None
+
+    def open(self):
+        import numpy as np
+
+        if not self.is_open:
+            with np.load(self.model_file) as model:
+                self.weights = model['weights']
+                self.bias = model['bias']
+                self.word_index = {word: idx for idx, word in enumerate(model['vocabulary'].tolist())}
+                self.classes = model['classes'].tolist()
+        return self
+
+    def close(self):
+        self.weights = None
+        self.bias = None
+        self.word_index = None
+        self.classes = None
+
+    def predict_labels(self, new_data, batch_size=None):
+        self.open()
+        scores = features(new_data, self.word_index) @ self.weights + self.bias
+        return [self.classes[idx] for idx in scores.argmax(axis=1)]
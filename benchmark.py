@@ -0,0 +1,417 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import subprocess
+import argparse
+import statistics
+
+import constants as c
+import utils as ut
+
+
+def print_timings(label, timings):
+    # microseconds for anything faster than a millisecond
+    scale, unit = (1000, 'ms') if statistics.mean(timings) >= 1e-3 else (1e6, 'us')
+    scaled = [t * scale for t in timings]
+    ut.print_info('{}: mean {:.2f} {unit} | median {:.2f} {unit} | min {:.2f} {unit} | max {:.2f} {unit} ({} runs)'.format(
+        label, statistics.mean(scaled), statistics.median(scaled), min(scaled), max(scaled), len(scaled), unit=unit))
+
+
+def bench_predict(repeat=20, model_name="classifier.h5"):
+    import classifier as cl
+
+    sample = [str(['Add', 'Mult', 'Lt'])]
+
+    # Before: the model, tokenizer and label encoder are loaded for every prediction
+    cold = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with cl.ClassifierSession(model_name, cache_path=None) as session:
+            session.predict(sample)
+        cold.append(time.perf_counter() - start)
+
+    # After: a single warm session is reused by every prediction
+    with cl.ClassifierSession(model_name, cache_path=None) as session:
+        session.predict(sample)
+        warm = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            session.predict(sample)
+            warm.append(time.perf_counter() - start)
+
+    # Warm session answering from the prediction cache
+    with tempfile.TemporaryDirectory() as cache_dir:
+        with cl.ClassifierSession(model_name, cache_path=os.path.join(cache_dir, 'predictions.sqlite')) as session:
+            session.predict(sample)
+            cached = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                session.predict(sample)
+                cached.append(time.perf_counter() - start)
+
+    ut.print_header(header_text='Per-prediction latency')
+    print_timings('Reload per prediction', cold)
+    print_timings('Warm session', warm)
+    print_timings('Warm session, cache hit', cached)
+    ut.print_info('Speedup: {:.1f}x'.format(statistics.mean(cold) / statistics.mean(warm)))
+    ut.print_separator(c.DoubleHorizontalLine)
+
+
+def fresh_solver_check(generator, value, constraints, value_type):
+    # How candidates used to be checked: a new solver asserting every constraint for each value
+    from z3 import Solver, sat
+    solver = Solver()
+    solver.add(constraints)
+    solver.add(generator.create_z3_value(value, value_type))
+    return solver.check() == sat
+
+
+def bench_constraints(repeat=200):
+    from z3 import Int, Real, Or
+    import random_generator as rg
+
+    x, y = Int('x'), Int('y')
+    xr, yr = Real('x'), Real('y')
+    constraint_sets = {
+        'int: x < y': (int, [x < y]),
+        'int: 0 <= x <= 10': (int, [x >= 0, x <= 10]),
+        'int: Or(x + y <= MAX, x - y >= MIN)': (int, [Or(x + y <= rg.MAX_INT, x - y >= rg.MIN_INT)]),
+        'float: x != 0, x < 0.5': (float, [xr != 0, xr < 0.5]),
+    }
+
+    ut.print_header(header_text='Per-value cost of constrained generation')
+    for label, (value_type, constraints) in constraint_sets.items():
+        # Before: a fresh solver decides every random candidate
+        sampler = rg.RandomGenerator(mode='sample')
+        z3_check = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fresh_solver_check(sampler, sampler.draw_candidates(value_type, 1).tolist()[0], constraints, value_type)
+            z3_check.append(time.perf_counter() - start)
+
+        # After: values come out of a numpy predicate compiled once
+        generator = rg.RandomGenerator(mode='sample')
+        generator.generate(value_type, constraints, kind='meet')
+        compiled = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            generator.generate(value_type, constraints, kind='meet')
+            compiled.append(time.perf_counter() - start)
+
+        ut.print_info(label)
+        print_timings('  z3 check per candidate', z3_check)
+        print_timings('  compiled predicate per value', compiled)
+    ut.print_separator(c.DoubleHorizontalLine)
+
+
+def bench_tuples(count=10, repeat=20):
+    from z3 import Int, String, Length
+    import random_generator as rg
+
+    x, s = Int('x'), String('s')
+    signature = [('x', int), ('y', float), ('s', str), ('b', bool)]
+    assignments = {
+        'x meets x > 10 (compiled), y, s, b free': ('sample', 'x', x > 10),
+        's meets Length(s) > 3 (solver), x, y, b free': ('solver', 's', Length(s) > 3),
+    }
+
+    ut.print_header(header_text='Input tuples of a 4-parameter signature ({} per call)'.format(count))
+    for label, (mode, name, constraint) in assignments.items():
+        # Before: one generate call per parameter of every tuple, the free ones with constraints=[]
+        generator = rg.RandomGenerator(mode=mode)
+        per_value = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(count):
+                [generator.generate(data_type, constraint if parameter == name else [], kind='meet') for parameter, data_type in signature]
+            per_value.append(time.perf_counter() - start)
+
+        # After: the whole batch in one call
+        generator = rg.RandomGenerator(mode=mode)
+        bulk = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            generator.generate_many(signature, {name: constraint}, count)
+            bulk.append(time.perf_counter() - start)
+
+        ut.print_info(label)
+        print_timings('  generate per value', per_value)
+        print_timings('  generate_many', bulk)
+        ut.print_info('  speedup: {:.1f}x'.format(statistics.mean(per_value) / statistics.mean(bulk)))
+    ut.print_separator(c.DoubleHorizontalLine)
+
+
+def bench_formats(cases=10000, repeat=5):
+    import random
+    import file_generator as fg
+
+    rows = []
+    for idx in range(cases):
+        a, b = random.randint(-1000, 1000), random.randint(-1000, 1000)
+        case = {'constraint': 'a > b' if a > b else 'Not(a > b)', 'name': 'idx{}_a0_constr0'.format(idx), 'inputs': [a, b]}
+        rows.append((case, ('ok', a + b)))
+
+    ut.print_header(header_text='Generated test formats ({} cases)'.format(cases))
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, 'target.py'), 'w') as target:
+            target.write('def add(a, b):\n    return a + b\n')
+
+        for output_format in ('functions', 'parametrize'):
+            path = os.path.join(work_dir, 'test_{}.py'.format(output_format))
+            with open(path, 'w') as f:
+                fg.header_writer(f, 'target')
+                if output_format == 'functions':
+                    for case, outcome in rows:
+                        fg.case_writer(f, [('a', int), ('b', int)], 'target', 'add', case, outcome)
+                else:
+                    fg.table_writer(f, 'target', 'add', [case for case, _ in rows], [outcome for _, outcome in rows])
+            with open(path) as f:
+                source = f.read()
+
+            compile_times = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                compile(source, path, 'exec')
+                compile_times.append(time.perf_counter() - start)
+
+            start = time.perf_counter()
+            completed = subprocess.run([sys.executable, '-m', 'pytest', '--collect-only', '-q', '-p', 'no:cacheprovider', path],
+                                       cwd=work_dir, capture_output=True, text=True)
+            collect_time = time.perf_counter() - start
+            if completed.returncode != 0:
+                raise RuntimeError(completed.stdout + completed.stderr)
+
+            ut.print_info(output_format)
+            ut.print_info('  size: {:.1f} KB'.format(len(source.encode()) / 1024))
+            print_timings('  compile', compile_times)
+            ut.print_info('  pytest --collect-only: {:.2f} s'.format(collect_time))
+    ut.print_separator(c.DoubleHorizontalLine)
+
+
+def bench_pipeline(functions=20, delay=0.002, tests=10, repeat=3):
+    import contextlib
+    import file_generator as fg
+    import executor as ex
+
+    ut.print_header(header_text='Pipelined module generation ({} functions)'.format(functions))
+    with tempfile.TemporaryDirectory() as src:
+        # every oracle call waits for delay seconds, as a target doing I/O would
+        with open(os.path.join(src, 'target.py'), 'w') as target:
+            target.write('import time\n')
+            for idx in range(functions):
+                target.write('\ndef f{}(x: int, y: int):\n'.format(idx))
+                target.write('    time.sleep({})\n'.format(delay))
+                target.write('    if x > y + {}:\n        return x - y\n    return y - x\n'.format(idx))
+        dst = os.path.join(src, 'tests')
+        os.makedirs(dst)
+
+        def run(pipeline):
+            settings = {'files': ['target'], 'folders': [], 'number_of_tests_per_function': tests, 'pipeline': pipeline}
+            with open(os.path.join(src, 'settings.json'), 'w') as settings_file:
+                json.dump(settings, settings_file)
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                plans = fg.module_analyzer(src, 'target')
+                fg.datatype_predictor([plans])
+                start = time.perf_counter()
+                fg.module_writer(src, dst, 'target', plans, seed=0)
+                elapsed = time.perf_counter() - start
+            with open(os.path.join(dst, 'test_target.py')) as test_file:
+                return elapsed, test_file.read()
+
+        # starts the oracle workers and fills the constraint caches
+        run(False)
+        outputs = {}
+        for pipeline, label in ((False, 'sequential'), (True, 'pipelined')):
+            runs = [run(pipeline) for _ in range(repeat)]
+            print_timings('  ' + label, [elapsed for elapsed, _ in runs])
+            outputs[pipeline] = runs[-1][1]
+        ex.close_executor()
+
+    ut.print_info('Identical output: {}'.format(outputs[False] == outputs[True]))
+    ut.print_separator(c.DoubleHorizontalLine)
+
+
+def bench_solver(repeat=300):
+    from z3 import Int, Real, String, Bool, Or, Length
+    import random_generator as rg
+
+    x, y = Int('x'), Int('y')
+    xr, yr = Real('x'), Real('y')
+    xs, ys = String('x'), String('y')
+    xb, yb = Bool('x'), Bool('y')
+    constraint_sets = {
+        'int: Or(x + y <= MAX, x - y >= MIN), x < y': (int, [Or(x + y <= rg.MAX_INT, x - y >= rg.MIN_INT), x < y]),
+        'float: y != 0, x >= y': (float, [yr != 0, xr >= yr]),
+        'str: x != y, Length(x) > 3': (str, [xs != ys, Length(xs) > 3]),
+        'bool: Or(x, y), x != y': (bool, [Or(xb, yb), xb != yb]),
+    }
+
+    ut.print_header(header_text='Per-candidate solver check')
+    for label, (value_type, constraints) in constraint_sets.items():
+        generator = rg.RandomGenerator(mode='sample')
+        draw = {int: lambda: generator.draw_candidates(int, 1).tolist()[0],
+                float: lambda: generator.draw_candidates(float, 1).tolist()[0],
+                str: lambda: ''.join(rg.choice(generator.chars) for _ in range(rg.randint(rg.MIN_STR_LEN, rg.MAX_STR_LEN))),
+                bool: lambda: rg.choice([True, False])}[value_type]
+        values = [draw() for _ in range(repeat)]
+
+        # Before: a fresh solver per candidate
+        fresh = []
+        for value in values:
+            start = time.perf_counter()
+            fresh_solver_check(generator, value, constraints, value_type)
+            fresh.append(time.perf_counter() - start)
+
+        # After: the solver of the constraint set checks the candidate as an assumption
+        generator.satisfies_constraints(values[0], constraints, value_type)
+        reused = []
+        for value in values:
+            start = time.perf_counter()
+            generator.satisfies_constraints(value, constraints, value_type)
+            reused.append(time.perf_counter() - start)
+
+        ut.print_info(label)
+        print_timings('  fresh solver', fresh)
+        print_timings('  reused solver', reused)
+        ut.print_info('  speedup: {:.1f}x'.format(statistics.mean(fresh) / statistics.mean(reused)))
+    ut.print_separator(c.DoubleHorizontalLine)
+
+
+def bench_backends(rows=2000, batch=64, repeat=20):
+    import numpy as np
+    import classifier as cl
+    import bag_of_ops as bob
+
+    # Test rows of the sampled dataset, written back as op word sequences both backends tokenize
+    tokens, labels, vocabulary, classes = bob.load_rows()
+    _, test_rows = cl.split_indices(len(labels))
+    test_rows = np.sort(test_rows[:rows])
+    texts = [' '.join(vocabulary[idx - 1] for idx in row if idx) for row in np.asarray(tokens[test_rows])]
+    expected = [classes[label] for label in np.asarray(labels[test_rows])]
+
+    ut.print_header(header_text='Classifier backends')
+    # the bag of ops backend goes first to show it does not need TensorFlow
+    for backend in reversed(cl.BACKENDS):
+        session = cl.ClassifierSession(cache_path=None, backend=backend)
+        start = time.perf_counter()
+        session.open()
+        load_time = time.perf_counter() - start
+
+        predicted = session.predict_labels(texts)
+        accuracy = sum(label == truth for label, truth in zip(predicted, expected)) / len(expected)
+
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            session.predict_labels(texts[:batch])
+            timings.append(time.perf_counter() - start)
+
+        ut.print_info(backend)
+        ut.print_info('  load: {:.2f} s, TensorFlow imported: {}'.format(load_time, 'tensorflow' in sys.modules))
+        ut.print_info('  accuracy on {} test rows: {:.2f}%'.format(len(expected), accuracy * 100))
+        print_timings('  batch of {}'.format(batch), timings)
+        session.close()
+    ut.print_separator(c.DoubleHorizontalLine)
+
+
+# Modules each entry point may not load at import time
+HEAVY_MODULES = ('tensorflow', 'keras', 'pandas', 'sklearn', 'z3', 'numpy')
+IMPORT_TARGETS = {
+    'main': HEAVY_MODULES,
+    'classifier': ('tensorflow', 'keras', 'pandas', 'sklearn'),
+    'file_generator': ('tensorflow', 'keras', 'pandas', 'sklearn'),
+}
+
+
+def import_time(module_name):
+    # Cumulative import times in microseconds reported by python -X importtime
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import {}'.format(module_name)],
+                               capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr)
+
+    timings = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+def bench_importtime(max_ms=None):
+    ut.print_header(header_text='Import time of the entry points')
+    failed = False
+    for module_name, forbidden in IMPORT_TARGETS.items():
+        timings = import_time(module_name)
+        total_ms = timings[module_name] / 1000
+        loaded = sorted({name.split('.')[0] for name in timings} & set(forbidden))
+
+        ut.print_info('{}: {:.1f} ms'.format(module_name, total_ms))
+        if loaded:
+            ut.print_info('  [FAIL] loads {} at import time'.format(', '.join(loaded)))
+            failed = True
+        if max_ms is not None and total_ms > max_ms:
+            ut.print_info('  [FAIL] above the budget of {:.1f} ms'.format(max_ms))
+            failed = True
+    ut.print_separator(c.DoubleHorizontalLine)
+    return not failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    predict_parser = subparsers.add_parser('predict', help='Per-prediction latency of predict_datatype')
+    predict_parser.add_argument('--repeat', type=int, default=20, help='Number of predictions to time')
+    predict_parser.add_argument('--model', default='classifier.h5', help='Trained model file')
+
+    constraints_parser = subparsers.add_parser('constraints', help='Per-value cost of constrained value generation')
+    constraints_parser.add_argument('--repeat', type=int, default=200, help='Number of values to time')
+
+    importtime_parser = subparsers.add_parser('importtime', help='Import time of the entry points, fails when a heavy stack is loaded eagerly')
+    importtime_parser.add_argument('--max-ms', type=float, help='Fail when an entry point takes longer than this to import')
+
+    backends_parser = subparsers.add_parser('backends', help='Accuracy and latency of the classifier backends side by side')
+    backends_parser.add_argument('--rows', type=int, default=2000, help='Number of test rows classified')
+    backends_parser.add_argument('--batch', type=int, default=64, help='Op sequences per timed prediction')
+    backends_parser.add_argument('--repeat', type=int, default=20, help='Number of predictions to time')
+
+    pipeline_parser = subparsers.add_parser('pipeline', help='Module generation with and without the pipelined stages')
+    pipeline_parser.add_argument('--functions', type=int, default=20, help='Number of functions in the generated module')
+    pipeline_parser.add_argument('--delay', type=float, default=0.002, help='Seconds every oracle call waits for')
+    pipeline_parser.add_argument('--tests', type=int, default=10, help='number_of_tests_per_function')
+    pipeline_parser.add_argument('--repeat', type=int, default=3, help='Number of generations to time per mode')
+
+    solver_parser = subparsers.add_parser('solver', help='Per-candidate solver check for int, float, str and bool constraints')
+    solver_parser.add_argument('--repeat', type=int, default=300, help='Number of candidates to check')
+
+    tuples_parser = subparsers.add_parser('tuples', help='Whole input tuples from generate_many against one generate call per value')
+    tuples_parser.add_argument('--count', type=int, default=10, help='Tuples generated per call')
+    tuples_parser.add_argument('--repeat', type=int, default=20, help='Number of calls to time')
+
+    formats_parser = subparsers.add_parser('formats', help='Size, compile and collection time of the generated test formats')
+    formats_parser.add_argument('--cases', type=int, default=10000, help='Number of generated test cases')
+    formats_parser.add_argument('--repeat', type=int, default=5, help='Number of compilations to time')
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'predict':
+        bench_predict(args.repeat, args.model)
+    elif args.benchmark == 'constraints':
+        bench_constraints(args.repeat)
+    elif args.benchmark == 'backends':
+        bench_backends(args.rows, args.batch, args.repeat)
+    elif args.benchmark == 'pipeline':
+        bench_pipeline(args.functions, args.delay, args.tests, args.repeat)
+    elif args.benchmark == 'solver':
+        bench_solver(args.repeat)
+    elif args.benchmark == 'tuples':
+        bench_tuples(args.count, args.repeat)
+    elif args.benchmark == 'formats':
+        bench_formats(args.cases, args.repeat)
+    elif args.benchmark == 'importtime':
+        if not bench_importtime(args.max_ms):
+            sys.exit(1)
@@ -1,19 +1,12 @@
 import os
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 import utils as ut
+import prediction_cache as pc
 
 import time
 import pickle
-import pandas as pd
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import LabelEncoder
-from tensorflow.keras.models import Sequential, load_model
-from tensorflow.keras.layers import Embedding, LSTM, Dense, Bidirectional, Dropout
-from tensorflow.keras.optimizers import Adam
-from tensorflow.keras.preprocessing.text import Tokenizer
-from tensorflow.keras.preprocessing.sequence import pad_sequences
-from tensorflow.keras.callbacks import EarlyStopping
-import tensorflow as tf
+# TensorFlow, Keras, pandas and scikit-learn are imported by the functions that use them,
+# importing this module (or answering predictions from the cache) does not load them
 
 # Hyperparameters
 MAX_SEQUENCE_LENGTH = 128
@@ -25,6 +18,15 @@ BATCH_SIZE = 256
 TEST_SIZE = 0.3
 LEARNING_RATE = 0.01
 DROPOUT_RATE = 0.2
+SPLIT_SEED = 42
+
+# Input pipeline: rows read per parallel call, shuffle buffer and the sequence lengths
+# separating the buckets of similar length sequences
+READ_CHUNK = 1024
+SHUFFLE_BUFFER = 10000
+BUCKET_BOUNDARIES = [4, 8, 16, 32, 64]
+# Stripped sequences of the memory-mapped dataset are cached to files next to it, prefix of each split
+CACHE_FILE = 'rows_{}.tfcache'
 
 def load_tokenizer(tokenizer_file_path='tokenizer.pkl'):
     with open(tokenizer_file_path, 'rb') as tokenizer_file:
@@ -37,6 +39,15 @@ def load_label_encoder(label_encoder_file_path='label_encoder.pkl'):
     return label_encoder
 
 def load_data():
+    import sampler as sm
+    if sm.has_dataset():
+        return load_dataset()
+
+    import pandas as pd
+    from sklearn.preprocessing import LabelEncoder
+    from tensorflow.keras.preprocessing.text import Tokenizer
+    from tensorflow.keras.preprocessing.sequence import pad_sequences
+
     # Load CSV data
     df = pd.read_csv("random_samples.csv")
 
@@ -50,15 +61,92 @@ def load_data():
     sequences = tokenizer.texts_to_sequences(df['ops_funcs'])
     padded_sequences = pad_sequences(sequences, maxlen=MAX_SEQUENCE_LENGTH)
 
-    return df, tokenizer, padded_sequences, label_encoder
+    return df['datatype_encoded'].values, tokenizer, padded_sequences, label_encoder
 
-def build_model(df, tokenizer, padded_sequences, label_encoder, learning_rate=LEARNING_RATE):
-    # Split data into training and testing sets
-    X_train, X_test, y_train, y_test = train_test_split(padded_sequences, df['datatype_encoded'], test_size=TEST_SIZE, random_state=42)
+def load_dataset():
+    # Pre-tokenized dataset written by the sampler, the tokenizer and label encoder are rebuilt
+    # from its vocabulary instead of being fitted on the text
+    import numpy as np
+    import sampler as sm
+    from sklearn.preprocessing import LabelEncoder
+    from tensorflow.keras.preprocessing.text import Tokenizer
+
+    padded_sequences, labels, vocab = sm.load_dataset()
+    if padded_sequences.shape[1] != MAX_SEQUENCE_LENGTH:
+        raise ValueError('The dataset was written for sequences of {} words, not {}'.format(padded_sequences.shape[1], MAX_SEQUENCE_LENGTH))
 
-    # Build LSTM model with bidirectional layers
+    tokenizer = Tokenizer()
+    tokenizer.word_index = vocab['word_index']
+    tokenizer.index_word = {index: word for word, index in vocab['word_index'].items()}
+
+    label_encoder = LabelEncoder()
+    label_encoder.classes_ = np.array(vocab['classes'])
+
+    return labels, tokenizer, padded_sequences, label_encoder
+
+def split_indices(size, test_size=TEST_SIZE, seed=SPLIT_SEED):
+    # Deterministic shuffled split of the row numbers into training and test rows
+    import numpy as np
+
+    permutation = np.random.default_rng(seed).permutation(size)
+    test_rows = int(round(size * test_size))
+    return permutation[test_rows:], permutation[:test_rows]
+
+
+def cache_path(split):
+    # Cache files of a split of the sampler's dataset, the ones of an earlier training are removed
+    # since tf.data would read them back instead of the current rows
+    import glob
+    import sampler as sm
+
+    path = os.path.join(sm.DATASET_DIR, CACHE_FILE.format(split))
+    for cache_file in glob.glob(path + '*'):
+        os.remove(cache_file)
+    return path
+
+
+def make_dataset(padded_sequences, labels, indices, training=False, seed=SPLIT_SEED, cache_file=''):
+    # Streams the rows of the (possibly memory-mapped) arrays: chunks of rows are read in parallel,
+    # the padding is stripped, the short sequences are cached and shuffled, then batched with
+    # sequences of similar length and padded at the end only up to the longest one of their batch.
+    # The cache is kept in memory, or in cache_file so a dataset larger than memory is only read
+    # and stripped once
+    import numpy as np
+    import tensorflow as tf
+
+    def read_rows(rows):
+        return np.asarray(padded_sequences[np.sort(rows)], dtype=np.int32), np.asarray(labels[np.sort(rows)], dtype=np.int32)
+
+    def parse(rows):
+        sequences, row_labels = tf.numpy_function(read_rows, [rows], (tf.int32, tf.int32))
+        sequences.set_shape([None, padded_sequences.shape[1]])
+        row_labels.set_shape([None])
+        return sequences, row_labels
+
+    def strip_padding(sequence, label):
+        return tf.boolean_mask(sequence, sequence > 0), label
+
+    dataset = tf.data.Dataset.from_tensor_slices(np.asarray(indices, dtype=np.int64))
+    dataset = dataset.batch(READ_CHUNK).map(parse, num_parallel_calls=tf.data.AUTOTUNE).unbatch()
+    dataset = dataset.map(strip_padding, num_parallel_calls=tf.data.AUTOTUNE).cache(cache_file)
+    if training:
+        dataset = dataset.shuffle(SHUFFLE_BUFFER, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.bucket_by_sequence_length(lambda sequence, label: tf.shape(sequence)[0], BUCKET_BOUNDARIES,
+                                                [BATCH_SIZE] * (len(BUCKET_BOUNDARIES) + 1))
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+
+def build_model(vocabulary_size, number_of_classes, learning_rate=LEARNING_RATE):
+    import tensorflow as tf
+    from tensorflow.keras.models import Sequential
+    from tensorflow.keras.layers import Input, Embedding, LSTM, Dense, Bidirectional, Dropout
+    from tensorflow.keras.optimizers import Adam
+
+    # Build LSTM model with bidirectional layers, sequences of any length are accepted and the
+    # padding is masked, so the batches only need to be padded to their longest sequence
     model = Sequential()
-    model.add(Embedding(input_dim=len(tokenizer.word_index) + 1, output_dim=EMBEDDING_DIM, input_length=padded_sequences.shape[1]))
+    model.add(Input(shape=(None,), dtype='int32'))
+    model.add(Embedding(input_dim=vocabulary_size, output_dim=EMBEDDING_DIM, mask_zero=True))
 
     model.add(Bidirectional(LSTM(units=LSTM_UNITS, return_sequences=True)))
     model.add(Dropout(rate=DROPOUT_RATE))
@@ -69,7 +157,7 @@ def build_model(df, tokenizer, padded_sequences, label_encoder, learning_rate=LE
     model.add(Bidirectional(LSTM(units=LSTM_UNITS//4)))
     model.add(Dropout(rate=DROPOUT_RATE))
     
-    model.add(Dense(units=len(label_encoder.classes_), activation='softmax'))
+    model.add(Dense(units=number_of_classes, activation='softmax'))
 
 
     # Compile the model
@@ -79,16 +167,18 @@ def build_model(df, tokenizer, padded_sequences, label_encoder, learning_rate=LE
     # Print model architecture
     tf.keras.utils.plot_model(model, to_file='lstm_model.png', show_shapes=True, dpi=64)
 
-    return model, X_train, y_train, X_test, y_test
+    return model
 
 
-def fit_model(model, X_train, y_train, X_test, y_test):
+def fit_model(model, train_dataset, test_dataset):
+    from tensorflow.keras.callbacks import EarlyStopping
+
     # Train the model
     early_stopping = EarlyStopping(monitor='val_loss', patience=3, restore_best_weights=True)
-    model.fit(X_train, y_train, epochs=EPOCHS, batch_size=BATCH_SIZE, validation_data=(X_test, y_test), callbacks=[early_stopping])
+    model.fit(train_dataset, epochs=EPOCHS, validation_data=test_dataset, callbacks=[early_stopping])
 
     # Evaluate the model
-    loss, accuracy = model.evaluate(X_test, y_test)
+    loss, accuracy = model.evaluate(test_dataset)
     ut.print_info(f'[TEST] Accuracy: {accuracy * 100:.2f}%')
 
     return loss, accuracy
@@ -96,8 +186,11 @@ def fit_model(model, X_train, y_train, X_test, y_test):
 
 def train():
     start = time.time()
+    # The artifacts are about to be rewritten, drop the resident copies
+    close_session()
+
     # Load data
-    df, tokenizer, padded_sequences, label_encoder = load_data()
+    labels, tokenizer, padded_sequences, label_encoder = load_data()
 
     # Save tokenizer
     with open('tokenizer.pkl', 'wb') as tokenizer_file:
@@ -107,14 +200,26 @@ def train():
     with open('label_encoder.pkl', 'wb') as label_encoder_file:
         pickle.dump(label_encoder, label_encoder_file)
 
+    # Split data into training and testing sets
+    train_rows, test_rows = split_indices(len(labels))
+    # the rows of the sampler's dataset are memory-mapped and may not fit in memory, the ones
+    # read from the CSV file already are
+    import sampler as sm
+    memory_mapped = sm.has_dataset()
+    train_dataset = make_dataset(padded_sequences, labels, train_rows, training=True, cache_file=cache_path('train') if memory_mapped else '')
+    test_dataset = make_dataset(padded_sequences, labels, test_rows, cache_file=cache_path('test') if memory_mapped else '')
+
     # Build model
-    model, X_train, y_train, X_test, y_test = build_model(df, tokenizer, padded_sequences, label_encoder)
+    model = build_model(len(tokenizer.word_index) + 1, len(label_encoder.classes_))
 
     # Train and evaluate model
-    loss, accuracy = fit_model(model, X_train, y_train, X_test, y_test)
+    loss, accuracy = fit_model(model, train_dataset, test_dataset)
 
     # Save model to h5 file
     model.save('classifier.h5')
+
+    # Predictions cached for the previous model are no longer valid
+    pc.invalidate()
     
     end = time.time()
 
@@ -124,26 +229,162 @@ def train():
     return loss, accuracy
 
 
-def predict_datatype(new_data, model_name="classifier.h5"):
-    # Load model
-    model = load_model(model_name)
-    
-    tokenizer = load_tokenizer() 
-    label_encoder = load_label_encoder() 
-
-    # Tokenize and pad the new data
-    new_data_sequences = tokenizer.texts_to_sequences(new_data)
-    padded_new_data = pad_sequences(new_data_sequences, maxlen=MAX_SEQUENCE_LENGTH)  # Adjust maxlen based on your training data
+# Classifier backend running the trained Keras model on the tokenized op sequences
+class KerasBackend:
+    def __init__(self, model_name="classifier.h5", tokenizer_file_path='tokenizer.pkl', label_encoder_file_path='label_encoder.pkl'):
+        self.model_name = model_name
+        self.tokenizer_file_path = tokenizer_file_path
+        self.label_encoder_file_path = label_encoder_file_path
+        self.artifacts = (model_name, tokenizer_file_path, label_encoder_file_path)
+        self.model = None
+        self.tokenizer = None
+        self.label_encoder = None
+
+    @property
+    def is_open(self):
+        return self.model is not None
+
+    def open(self):
+        if not self.is_open:
+            from tensorflow.keras.models import load_model
+            self.model = load_model(self.model_name)
+            self.tokenizer = load_tokenizer(self.tokenizer_file_path)
+            self.label_encoder = load_label_encoder(self.label_encoder_file_path)
+        return self
+
+    def close(self):
+        if self.is_open:
+            self.model = None
+            self.tokenizer = None
+            self.label_encoder = None
+            import tensorflow as tf
+            tf.keras.backend.clear_session()
+
+    def predict_labels(self, new_data, batch_size=BATCH_SIZE):
+        from tensorflow.keras.preprocessing.sequence import pad_sequences
+
+        self.open()
+
+        # Tokenize and pad the new data
+        new_data_sequences = self.tokenizer.texts_to_sequences(new_data)
+        # models trained on bucketed batches mask the padding and take any length, padded at the
+        # end as in training; older ones expect exactly MAX_SEQUENCE_LENGTH words padded at the front
+        maxlen = self.model.input_shape[1]
+        padding = 'pre'
+        if maxlen is None:
+            maxlen = min(MAX_SEQUENCE_LENGTH, max(1, max(len(sequence) for sequence in new_data_sequences)))
+            padding = 'post'
+        padded_new_data = pad_sequences(new_data_sequences, maxlen=maxlen, padding=padding)
+
+        # Make predictions
+        predictions = self.model.predict(padded_new_data, batch_size=batch_size)
+
+        # Decode predictions to class labels
+        decoded_predictions = self.label_encoder.inverse_transform(predictions.argmax(axis=1))
+
+        return [str(prediction) for prediction in decoded_predictions]
+
+
+# 'lstm' is the Keras model trained by train(), 'bag_of_ops' the NumPy softmax regression
+# trained by bag_of_ops.train(), which answers without importing TensorFlow
+BACKENDS = ('lstm', 'bag_of_ops')
+
+
+def make_backend(backend='lstm', model_name=None):
+    if backend == 'lstm':
+        return KerasBackend(model_name or "classifier.h5")
+    if backend == 'bag_of_ops':
+        import bag_of_ops as bob
+        return bob.BagOfOpsBackend(model_name or bob.MODEL_FILE)
+    raise ValueError('Unknown classifier backend: {}'.format(backend))
+
+
+# Keeps a classifier backend resident between predictions and answers known op sequences from the cache
+class ClassifierSession:
+    def __init__(self, model_name=None, cache_path=pc.CACHE_FILE, backend='lstm'):
+        self.backend_name = backend
+        self.backend = make_backend(backend, model_name)
+        self.model_name = model_name
+        self.opened_hash = None
+
+        # the cache key covers the artifacts of the backend answering
+        self.cache = None
+        if cache_path is not None:
+            self.cache = pc.PredictionCache(cache_path, artifacts=self.backend.artifacts)
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def is_open(self):
+        return self.backend.is_open
+
+    @property
+    def is_stale(self):
+        # the artifacts were rewritten, e.g. by --train, since the backend was loaded
+        return self.opened_hash is not None and pc.artifacts_hash(self.backend.artifacts) != self.opened_hash
+
+    def open(self):
+        if not self.backend.is_open:
+            self.backend.open()
+            self.opened_hash = pc.artifacts_hash(self.backend.artifacts)
+        return self
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        self.backend.close()
+        self.opened_hash = None
+
+    def predict(self, new_data, batch_size=BATCH_SIZE):
+        if not new_data:
+            return []
+
+        if self.cache is None:
+            labels = self.predict_labels(new_data, batch_size)
+            return list(zip(new_data, labels))
+
+        # Only the op sequences never seen by this model go through it
+        keys = [pc.normalize(ops_funcs) for ops_funcs in new_data]
+        cached = self.cache.get_many(keys)
+        missing = {}
+        for key, ops_funcs in zip(keys, new_data):
+            if key not in cached:
+                missing.setdefault(key, ops_funcs)
+
+        if missing:
+            labels = self.predict_labels(list(missing.values()), batch_size)
+            predicted = dict(zip(missing.keys(), labels))
+            self.cache.put_many(predicted)
+            cached.update(predicted)
+
+        return [(ops_funcs, cached[key]) for key, ops_funcs in zip(keys, new_data)]
+
+    def predict_labels(self, new_data, batch_size=BATCH_SIZE):
+        self.open()
+        return self.backend.predict_labels(new_data, batch_size)
+
+
+# Process-wide session shared by every module and function that needs a prediction
+_session = None
+
+def get_session(model_name=None, backend='lstm'):
+    global _session
+    if _session is not None and ((_session.model_name, _session.backend_name) != (model_name, backend) or _session.is_stale):
+        close_session()
+    if _session is None:
+        _session = ClassifierSession(model_name, backend=backend)
+    return _session
 
-    # Make predictions
-    predictions = model.predict(padded_new_data)
-
-    # Decode predictions to class labels
-    decoded_predictions = label_encoder.inverse_transform(predictions.argmax(axis=1))
-
-    predictions = []
-    
-    for ops_funcs, prediction in zip(new_data, decoded_predictions):
-        predictions.append((ops_funcs, prediction))
-    
-    return predictions
\ No newline at end of file
+def close_session():
+    global _session
+    if _session is not None:
+        _session.close()
+        _session = None
+
+
+def predict_datatype(new_data, model_name=None, batch_size=BATCH_SIZE, backend='lstm'):
+    return get_session(model_name, backend).predict(new_data, batch_size=batch_size)
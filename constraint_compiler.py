@@ -0,0 +1,118 @@
+import numpy as np
+from z3 import *
+from z3.z3util import get_vars
+
+COMPARISONS = {
+    Z3_OP_EQ: np.equal,
+    Z3_OP_LT: np.less,
+    Z3_OP_LE: np.less_equal,
+    Z3_OP_GT: np.greater,
+    Z3_OP_GE: np.greater_equal,
+}
+
+ARITHMETIC = {
+    Z3_OP_ADD: np.add,
+    Z3_OP_SUB: np.subtract,
+    Z3_OP_MUL: np.multiply,
+}
+
+
+class UnsupportedExpression(Exception):
+    pass
+
+
+def project(constraints, x):
+    # Existentially eliminate every variable but x, a value of x satisfies the
+    # constraints when some assignment of the other variables does
+    formula = And(constraints)
+    others = [var for var in get_vars(formula) if not var.eq(x)]
+    if not others:
+        return formula
+
+    goal = Goal()
+    goal.add(Exists(others, formula))
+    projected = Tactic('qe')(goal).as_expr()
+    if any(not var.eq(x) for var in get_vars(projected)):
+        raise UnsupportedExpression('Could not eliminate the other variables')
+    return projected
+
+
+def lower(expr):
+    # Returns a function of {variable name: numpy array} evaluating expr element-wise
+    if is_quantifier(expr):
+        raise UnsupportedExpression('Quantifiers are not supported')
+
+    if is_true(expr):
+        return lambda values: True
+    if is_false(expr):
+        return lambda values: False
+    if is_int_value(expr):
+        constant = expr.as_long()
+        return lambda values: constant
+    if is_rational_value(expr):
+        constant = float(expr.as_fraction())
+        return lambda values: constant
+    if is_const(expr) and expr.decl().kind() == Z3_OP_UNINTERPRETED:
+        if not (is_int(expr) or is_real(expr) or is_bool(expr)):
+            raise UnsupportedExpression('Unsupported sort: {}'.format(expr.sort()))
+        name = expr.decl().name()
+        return lambda values: values[name]
+
+    kind = expr.decl().kind()
+    args = [lower(arg) for arg in expr.children()]
+
+    if kind in COMPARISONS:
+        operation = COMPARISONS[kind]
+        left, right = args
+        return lambda values: operation(left(values), right(values))
+    if kind == Z3_OP_DISTINCT:
+        if len(args) != 2:
+            raise UnsupportedExpression('Distinct over more than two terms is not supported')
+        left, right = args
+        return lambda values: np.not_equal(left(values), right(values))
+    if kind in ARITHMETIC:
+        operation = ARITHMETIC[kind]
+        def arithmetic(values):
+            result = args[0](values)
+            for arg in args[1:]:
+                result = operation(result, arg(values))
+            return result
+        return arithmetic
+    if kind == Z3_OP_UMINUS:
+        operand = args[0]
+        return lambda values: np.negative(operand(values))
+    if kind == Z3_OP_TO_REAL:
+        return args[0]
+    if kind == Z3_OP_AND:
+        def conjunction(values):
+            result = True
+            for arg in args:
+                result = np.logical_and(result, arg(values))
+            return result
+        return conjunction
+    if kind == Z3_OP_OR:
+        def disjunction(values):
+            result = False
+            for arg in args:
+                result = np.logical_or(result, arg(values))
+            return result
+        return disjunction
+    if kind == Z3_OP_NOT:
+        operand = args[0]
+        return lambda values: np.logical_not(operand(values))
+
+    raise UnsupportedExpression('Unsupported operation: {}'.format(expr.decl().name()))
+
+
+def compile_constraints(constraints, x):
+    # Predicate over a numpy array of candidate values of x, None when the constraints
+    # fall outside the supported subset and z3 has to decide them
+    try:
+        satisfies = lower(project(constraints, x))
+    except (UnsupportedExpression, Z3Exception):
+        return None
+
+    name = x.decl().name()
+    def predicate(candidates):
+        return np.broadcast_to(satisfies({name: candidates}), candidates.shape)
+    return predicate
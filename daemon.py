@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import signal
+import socket
+import traceback
+import contextlib
+import socketserver
+
+import utils as ut
+
+# Unix socket of the generation server, relative paths are resolved from the folder holding
+# the classifier artifacts, where main.py is run
+SOCKET_FILE = '.allforone.sock'
+
+# Every message is one JSON object per line. The client sends {'command': ..., ...}, the server
+# answers with any number of {'log': text} and a final {'exit_code': code}
+
+
+def send(wfile, message):
+    wfile.write((json.dumps(message) + '\n').encode())
+    wfile.flush()
+
+
+# Text stream forwarding what a request prints to its client, output is dropped once the client is gone
+class ClientStream:
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        if text and self.wfile is not None:
+            try:
+                send(self.wfile, {'log': text})
+            except OSError:
+                self.wfile = None
+        return len(text)
+
+    def flush(self):
+        pass
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        command = request.get('command')
+
+        if command == 'ping':
+            send(self.wfile, {'exit_code': 0, 'pid': os.getpid()})
+        elif command == 'stop':
+            self.server.stopping = True
+            send(self.wfile, {'exit_code': 0})
+        elif command in self.server.handlers:
+            stream = ClientStream(self.wfile)
+            with contextlib.redirect_stdout(stream):
+                try:
+                    exit_code = self.server.handlers[command](request) or 0
+                except SystemExit as e:
+                    # e.g. settings.json missing from the source folder
+                    exit_code = e.code if isinstance(e.code, int) else 1
+                except Exception:
+                    print(traceback.format_exc(), end='')
+                    exit_code = 1
+            if stream.wfile is not None:
+                send(self.wfile, {'exit_code': exit_code})
+        else:
+            send(self.wfile, {'log': 'Unknown command: {}\n'.format(command), 'exit_code': 2})
+
+
+# Serves one request at a time, the state kept warm by the handlers is not thread-safe
+class GenerationServer(socketserver.UnixStreamServer):
+    def __init__(self, path, handlers):
+        self.handlers = handlers
+        self.stopping = False
+        super().__init__(path, RequestHandler)
+
+
+def request(message, path=SOCKET_FILE):
+    # Sends a request and prints its log as it arrives, None when no server is listening
+    if not os.path.exists(path):
+        return None
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+    except OSError:
+        client.close()
+        return None
+
+    with client, client.makefile('rb') as replies:
+        client.sendall((json.dumps(message) + '\n').encode())
+        for line in replies:
+            reply = json.loads(line)
+            if 'log' in reply:
+                sys.stdout.write(reply['log'])
+                sys.stdout.flush()
+            if 'exit_code' in reply:
+                return reply
+    # the server went away in the middle of the request
+    return {'exit_code': 1}
+
+
+def serve(handlers, path=SOCKET_FILE):
+    # handlers maps a command to a function taking the request and returning an exit code
+    if os.path.exists(path):
+        if request({'command': 'ping'}, path) is not None:
+            ut.print_info('A server is already listening on "{}".'.format(path))
+            return False
+        # left behind by a server that did not shut down
+        os.remove(path)
+
+    server = GenerationServer(path, handlers)
+    # SIGTERM stops the server like Ctrl+C, between or in the middle of requests
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    ut.print_info('Listening on "{}" (pid {}).'.format(path, os.getpid()))
+    try:
+        while not server.stopping:
+            server.handle_request()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+    ut.print_info('Server stopped.')
+    return True
+
+
+def stop(path=SOCKET_FILE):
+    return request({'command': 'stop'}, path) is not None
@@ -0,0 +1,330 @@
+import os
+import sys
+import time
+import signal
+import resource
+import importlib
+import threading
+import subprocess
+import multiprocessing.connection
+
+# Budget of a single oracle call, in seconds
+CALL_TIMEOUT = 5.0
+# Input tuples sent to a worker in one round trip
+BATCH_SIZE = 64
+# A worker whose peak resident memory goes above this (in MB) is replaced
+MAX_MEMORY_MB = 1024
+# Extra time granted to a batch before its worker is considered hung
+GRACE_PERIOD = 2.0
+# Time a new worker gets to come up
+STARTUP_TIMEOUT = 30.0
+
+
+class CallTimeout(Exception):
+    pass
+
+
+def raise_timeout(signum, frame):
+    raise CallTimeout()
+
+
+def call(function, inputs, timeout=None):
+    # Outcome of function(*inputs): ('ok', output), ('raises', (module, name, message)),
+    # ('timeout', None) or ('unsupported', repr of an output that is not a literal)
+    if timeout:
+        signal.signal(signal.SIGALRM, raise_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        output = function(*inputs)
+    except CallTimeout:
+        return ('timeout', None)
+    except Exception as e:
+        return ('raises', (type(e).__module__, type(e).__qualname__, str(e)))
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+    if not is_literal(output):
+        return ('unsupported', repr(output))
+    return ('ok', output)
+
+
+def traced_call(function, inputs, timeout=None):
+    # Outcome of the call together with the arcs (line, next line) it executed in the file that
+    # defines the function, entering and leaving a code object are arcs from and to -first line
+    filename = function.__code__.co_filename
+    arcs = set()
+    last_lines = {}
+
+    def tracer(frame, event, arg):
+        if frame.f_code.co_filename != filename:
+            return None
+        if event == 'call':
+            last_lines[frame] = -frame.f_code.co_firstlineno
+        elif event == 'line':
+            arcs.add((last_lines.get(frame, -frame.f_code.co_firstlineno), frame.f_lineno))
+            last_lines[frame] = frame.f_lineno
+        elif event == 'return':
+            arcs.add((last_lines.pop(frame, -frame.f_code.co_firstlineno), -frame.f_code.co_firstlineno))
+        return tracer
+
+    sys.settrace(tracer)
+    try:
+        outcome = call(function, inputs, timeout)
+    finally:
+        sys.settrace(None)
+    return outcome, sorted(arcs)
+
+
+def is_literal(value):
+    # Only outputs that can be written back as a Python literal make an assert, and they can
+    # be sent to the generator without importing the target module there
+    if value is None or type(value) in (bool, int, float, complex, str, bytes):
+        return True
+    if type(value) in (list, tuple, set, frozenset):
+        return all(is_literal(item) for item in value)
+    if type(value) == dict:
+        return all(is_literal(key) and is_literal(item) for key, item in value.items())
+    return False
+
+
+# Source stamp of the target modules imported by this process, a long-lived process reloads
+# the modules edited since it imported them
+_stamps = {}
+
+def source_stamp(module):
+    path = getattr(module, '__file__', None)
+    if path is None or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def import_fresh(module_name):
+    module = sys.modules.get(module_name)
+    if module is None:
+        # the source folder may have new files since the last import
+        importlib.invalidate_caches()
+        module = importlib.import_module(module_name)
+    elif _stamps.get(module_name) != source_stamp(module):
+        module = importlib.reload(module)
+    _stamps[module_name] = source_stamp(module)
+    return module
+
+
+def memory_usage():
+    # peak resident memory of the current process in MB (ru_maxrss is in KB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def worker_main(requests, results, max_memory):
+    results.send('ready')
+    while True:
+        try:
+            request = requests.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+
+        src, module_name, function_name, batch, timeout, trace = request
+        if src not in sys.path:
+            sys.path.append(src)
+        try:
+            function = getattr(import_fresh(module_name), function_name)
+        except Exception as e:
+            failed = ('crashed', 'import failed: {}'.format(e))
+            results.send(([(failed, []) if trace else failed] * len(batch), False))
+            continue
+
+        if trace:
+            outcomes = [traced_call(function, inputs, timeout) for inputs in batch]
+        else:
+            outcomes = [call(function, inputs, timeout) for inputs in batch]
+        recycle = memory_usage() > max_memory
+        results.send((outcomes, recycle))
+        if recycle:
+            break
+
+
+class Worker:
+    def __init__(self, max_memory):
+        # A fresh interpreter running this file, it does not inherit the caller's heavy imports
+        # and whatever the target functions print does not end up in the generator output
+        request_read, request_write = os.pipe()
+        result_read, result_write = os.pipe()
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__), str(request_read), str(result_write), str(max_memory)],
+                                        pass_fds=(request_read, result_write), stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL)
+        os.close(request_read)
+        os.close(result_write)
+        self.requests = multiprocessing.connection.Connection(request_write, readable=False)
+        self.connection = multiprocessing.connection.Connection(result_read, writable=False)
+
+        # batch deadlines only start counting once the worker is up
+        if not self.connection.poll(STARTUP_TIMEOUT) or self.connection.recv() != 'ready':
+            self.kill()
+            raise RuntimeError('Oracle worker did not start')
+
+    @property
+    def exitcode(self):
+        return self.process.poll()
+
+    def send(self, request):
+        self.requests.send(request)
+
+    def stop(self):
+        try:
+            self.requests.send(None)
+            self.process.wait(1)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            pass
+        self.kill()
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.requests.close()
+        self.connection.close()
+
+
+# Runs the oracle calls of the generated tests in a pool of worker processes, so a slow,
+# hanging or crashing target function cannot stall or kill the generator
+class OracleExecutor:
+    def __init__(self, workers=1, timeout=CALL_TIMEOUT, batch_size=BATCH_SIZE, max_memory=MAX_MEMORY_MB):
+        self.size = max(1, workers)
+        self.timeout = timeout
+        self.batch_size = max(1, batch_size)
+        self.max_memory = max_memory
+        self.workers = []
+        self.recycled = 0
+        # the functions run at once by a pipeline share the workers: at most size of them are
+        # busy in total, whatever the number of threads calling run
+        self.slots = threading.Semaphore(self.size)
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.stop()
+
+    def acquire(self, blocking=True):
+        # An idle worker, or a new one while fewer than size are busy. None when all of them are
+        # busy and blocking is False
+        if not self.slots.acquire(blocking):
+            return None
+        with self.lock:
+            if self.workers:
+                return self.workers.pop()
+        try:
+            return Worker(self.max_memory)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, worker, recycle=False):
+        with self.lock:
+            if recycle:
+                self.recycled += 1
+            else:
+                self.workers.append(worker)
+        if recycle:
+            worker.kill()
+        self.slots.release()
+
+    def run(self, src, module_name, function_name, inputs_list, trace=False):
+        # with trace every result is (outcome, executed arcs) instead of the outcome alone
+        inputs_list = [tuple(inputs) for inputs in inputs_list]
+        results = [None] * len(inputs_list)
+        # (start index, batch) still waiting for a worker
+        pending = [(start, inputs_list[start:start + self.batch_size]) for start in range(0, len(inputs_list), self.batch_size)]
+        busy = {}
+
+        while pending or busy:
+            while pending and len(busy) < self.size:
+                # with batches of its own in flight a call does not wait for the workers of the
+                # other calls, it collects its results first
+                worker = self.acquire(blocking=not busy)
+                if worker is None:
+                    break
+                start, batch = pending.pop(0)
+                try:
+                    worker.send((src, module_name, function_name, batch, self.timeout, trace))
+                except (OSError, ValueError):
+                    # the worker exited on its own since it was last used
+                    self.release(worker, recycle=True)
+                    pending.insert(0, (start, batch))
+                    continue
+                deadline = time.monotonic() + self.timeout * len(batch) + GRACE_PERIOD
+                busy[worker.connection] = (worker, start, batch, deadline)
+
+            ready = multiprocessing.connection.wait(list(busy), timeout=max(0, min(entry[3] for entry in busy.values()) - time.monotonic()))
+            for connection in ready:
+                worker, start, batch, _ = busy.pop(connection)
+                try:
+                    batch_results, recycle = connection.recv()
+                except (EOFError, OSError):
+                    # the worker died in the middle of the batch
+                    self.release(worker, recycle=True)
+                    failed = ('crashed', worker.exitcode)
+                    self.retry(pending, results, start, batch, (failed, []) if trace else failed)
+                    continue
+                results[start:start + len(batch)] = batch_results
+                self.release(worker, recycle)
+
+            now = time.monotonic()
+            for connection, (worker, start, batch, deadline) in list(busy.items()):
+                if now > deadline:
+                    # the call did not give control back to the timeout handler
+                    del busy[connection]
+                    self.release(worker, recycle=True)
+                    self.retry(pending, results, start, batch, (('timeout', None), []) if trace else ('timeout', None))
+
+        return results
+
+    def retry(self, pending, results, start, batch, outcome):
+        # A batch that failed as a whole is retried one call at a time to isolate the culprit
+        if len(batch) == 1:
+            results[start] = outcome
+        else:
+            pending.extend((start + offset, [inputs]) for offset, inputs in enumerate(batch))
+
+
+def run_in_process(function, inputs_list, trace=False):
+    if trace:
+        return [traced_call(function, tuple(inputs)) for inputs in inputs_list]
+    return [call(function, tuple(inputs)) for inputs in inputs_list]
+
+
+# Process-wide executor shared by every module generated in this process
+_executor = None
+# the execute stage of a generation pipeline may ask for it from several threads
+_executor_lock = threading.Lock()
+
+def get_executor(workers=1, timeout=CALL_TIMEOUT, batch_size=BATCH_SIZE, max_memory=MAX_MEMORY_MB):
+    global _executor
+    with _executor_lock:
+        # a long-lived process keeps its workers until the settings of a request ask for other ones
+        if _executor is not None and (_executor.size, _executor.timeout, _executor.batch_size, _executor.max_memory) != (max(1, workers), timeout, max(1, batch_size), max_memory):
+            close_executor()
+        if _executor is None:
+            _executor = OracleExecutor(workers, timeout, batch_size, max_memory)
+        return _executor
+
+def close_executor():
+    global _executor
+    if _executor is not None:
+        _executor.close()
+        _executor = None
+
+
+if __name__ == '__main__':
+    requests = multiprocessing.connection.Connection(int(sys.argv[1]), readable=True, writable=False)
+    results = multiprocessing.connection.Connection(int(sys.argv[2]), readable=False, writable=True)
+    worker_main(requests, results, float(sys.argv[3]))
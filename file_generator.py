@@ -1,7 +1,9 @@
+import io
 import os
 import sys
+import zlib
+import random
 import inspect
-from random import randint
 
 import utils as ut
 import constants as c
@@ -10,21 +12,33 @@ import random_generator as rg
 import ast_parser as ap
 import classifier as cl
 import symbolic_executer as se
+import executor as ex
+import metrics as mt
+import manifest as mf
+import prediction_cache as pc
+import pipeline as pl
+import oracle_memo as om
 
 def file_inspector(src, module_name):
-    sys.path.append(src)
-    the_module = __import__(module_name)
+    if src not in sys.path:
+        sys.path.append(src)
+    with mt.stage('import'):
+        the_module = ex.import_fresh(module_name)
 
     # Get a list of all attributes in the module
     all_attributes = dir(the_module)
 
     # Filter out functions that are defined in the module
-    defined_functions = [attr for attr in all_attributes if inspect.isfunction(getattr(the_module, attr))]
+    defined_functions = [attr for attr in all_attributes if inspect.isfunction(getattr(the_module, attr))
+                         and getattr(the_module, attr).__module__ == the_module.__name__]
 
     functions = {}
     for function_name, function in the_module.__dict__.items():
         if function_name != '__builtins__' and not function_name.startswith('__'):
-            if function_name in defined_functions:
+            # coroutines are skipped, as by the static discovery
+            if inspect.iscoroutinefunction(function) or inspect.isasyncgenfunction(function):
+                ut.print_info('Function: "{}" is a coroutine. Ignoring it.'.format(function_name))
+            elif function_name in defined_functions:
                 functions[function_name] = function
             else:
                 ut.print_info('Function: "{}" has been imported from another module. Ignoring it.'.format(function_name))
@@ -36,90 +50,474 @@ def file_inspector(src, module_name):
     return functions
 
 
-def test_generator(f, typed_parameters, idx, result, function_name, function):
-    RG = rg.RandomGenerator()
-
-    # iterate over parameters to generate random inputs constrained by the result of the symbolic execution
-    for i in range(len(typed_parameters)):
-        # ut.print_info('Generating random {} parameter: {}'.format(typed_parameters[i][1], typed_parameters[i][0])) 
-        constraints = se.build_constraints_from_dict(typed_parameters[i][1], result)
-        # delete all repeated constraints
-        constraints = list(set(constraints))
-
-        # fulfill constraints
-        if constraints:
-            for c_idx, c in enumerate(constraints):
-                # ut.print_info('Constraint: {} for parameter: {}'.format(c, typed_parameters[i][0]))
-
-                random_inputs = []
-                # accumulate random inputs
-                for j in range(len(typed_parameters)):
-                    if typed_parameters[j][0] == typed_parameters[i][0]:
-                        random_inputs.append(RG.generate(typed_parameters[i][1], c, kind='meet'))
-                    else:
-                        random_inputs.append(RG.generate(typed_parameters[j][1], [], kind='meet'))
-
-                output = function(*random_inputs)
-
-                var_idx = 0
-                temp = str(c).replace('\n', ' ')
-                f.write('# Test case for constraint: {}\n'.format(temp))
-                test_name = 'test_{}_idx{}_{}{}_constr{}'.format(function_name, idx, typed_parameters[i][0], i, c_idx)
-                f.write('def {}():\n'.format(test_name))
-                for var_name, var_type in typed_parameters:
-                    if var_type == str:
-                        f.write('    var_{} = \'{}\'\n'.format(var_idx, random_inputs[var_idx]))
-                    else:
-                        f.write('    var_{} = {}\n'.format(var_idx, random_inputs[var_idx]))
-                    var_idx += 1
-                f.write('    result = module_0.{}({})\n'.format(function_name, ', '.join(['var_{}'.format(i) for i in range(len(typed_parameters))])))
-                f.write('    assert result == {}\n\n'.format(output))
-
-
-def file_generator(src, dst, module_name):
-    functions = file_inspector(src, module_name)
-    settings = sett.get_settings(src)
-    number_of_tests_per_function = settings['number_of_tests_per_function']
-    filename = os.path.join(dst, 'test_{}.py'.format(module_name))
-    # n_functions = len(functions)
-    
-    with open(filename, 'w') as f:
-        f.write(c.HeaderText)
-        f.write('import os\n')
-        f.write('import sys\n')
-        f.write('import pytest\n')
-        f.write('sys.path.append(\'../\')\n')
-        f.write("sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))\n")
+def case_generator(typed_parameters, idx, result, RG=None, count=1):
+    if RG is None:
+        RG = rg.RandomGenerator()
 
+    # for every constraint of every parameter, count input tuples where that parameter meets the
+    # constraint and the other parameters take any value of their type, drawn in one call
+    batches = []
+    for i, (name, data_type) in enumerate(typed_parameters):
+        with mt.stage('constraints'):
+            constraints = se.cached_constraints(data_type, result)
 
+        for c_idx, c in enumerate(constraints or []):
+            try:
+                with mt.stage('generate'):
+                    inputs = RG.generate_many(typed_parameters, {name: c}, count, kind='meet')
+            except rg.GenerationError as e:
+                ut.print_info('Skipping constraint for parameter "{}": {}'.format(name, e))
+                continue
+            batches.append((i, name, c_idx, str(c).replace('\n', ' '), inputs))
 
-        f.write('import {} as module_0\n\n'.format(module_name))
+    # cases idx .. idx + count - 1, each of them with one case per constraint
+    cases = []
+    for offset in range(count):
+        for i, name, c_idx, constraint, inputs in batches:
+            cases.append({
+                'constraint': constraint,
+                'name': 'idx{}_{}{}_constr{}'.format(idx + offset, name, i, c_idx),
+                'inputs': inputs[offset]
+            })
 
-        idx=0
-        for function_name, function in functions.items():
-            # Header for each function
-            f.write('\n# Tests for: {}\n\n'.format(function_name))
+    return cases
+
+
+def exception_reference(module_name, exception):
+    exception_module, exception_name, _ = exception
+    if exception_module == 'builtins':
+        return exception_name
+    elif exception_module == module_name:
+        return 'module_0.{}'.format(exception_name)
+    return 'Exception'
+
+
+def case_writer(f, typed_parameters, module_name, function_name, case, outcome):
+    status, output = outcome
+    if status not in ('ok', 'raises'):
+        ut.print_info('Skipping test case {} of "{}": {} {}'.format(case['name'], function_name, status, output if output is not None else ''))
+        return 0
+
+    var_idx = 0
+    f.write('# Test case for constraint: {}\n'.format(case['constraint']))
+    test_name = 'test_{}_{}'.format(function_name, case['name'])
+    f.write('def {}():\n'.format(test_name))
+    for var_name, var_type in typed_parameters:
+        if var_type == str or var_type == 'str':
+            f.write('    var_{} = \'{}\'\n'.format(var_idx, case['inputs'][var_idx]))
+        else:
+            f.write('    var_{} = {}\n'.format(var_idx, case['inputs'][var_idx]))
+        var_idx += 1
+    call = 'module_0.{}({})'.format(function_name, ', '.join(['var_{}'.format(i) for i in range(len(typed_parameters))]))
+    if status == 'raises':
+        f.write('    with pytest.raises({}):\n'.format(exception_reference(module_name, output)))
+        f.write('        {}\n\n'.format(call))
+    else:
+        f.write('    result = {}\n'.format(call))
+        f.write('    assert result == {}\n\n'.format(output))
+    return 1
+
+
+def table_writer(f, module_name, function_name, cases, outcomes):
+    # All the cases of a function as two literal tables, one per outcome, each driving a single
+    # parametrized test, so the file stays small and quick to compile and collect
+    returns, raises = [], []
+    for case, outcome in zip(cases, outcomes):
+        status, output = outcome
+        if status == 'ok':
+            returns.append('    ({!r}, {!r}, {!r}),  # {}\n'.format(case['name'], tuple(case['inputs']), output, case['constraint']))
+        elif status == 'raises':
+            raises.append('    ({!r}, {!r}, {}),  # {}\n'.format(case['name'], tuple(case['inputs']), exception_reference(module_name, output), case['constraint']))
+        else:
+            ut.print_info('Skipping test case {} of "{}": {} {}'.format(case['name'], function_name, status, output if output is not None else ''))
+
+    if returns:
+        f.write('RETURNS_{} = [\n'.format(function_name))
+        f.writelines(returns)
+        f.write(']\n\n')
+        f.write("@pytest.mark.parametrize('inputs, expected', [row[1:] for row in RETURNS_{0}], ids=[row[0] for row in RETURNS_{0}])\n".format(function_name))
+        f.write('def test_{}_returns(inputs, expected):\n'.format(function_name))
+        f.write('    assert module_0.{}(*inputs) == expected\n\n'.format(function_name))
+    if raises:
+        f.write('RAISES_{} = [\n'.format(function_name))
+        f.writelines(raises)
+        f.write(']\n\n')
+        f.write("@pytest.mark.parametrize('inputs, exception', [row[1:] for row in RAISES_{0}], ids=[row[0] for row in RAISES_{0}])\n".format(function_name))
+        f.write('def test_{}_raises(inputs, exception):\n'.format(function_name))
+        f.write('    with pytest.raises(exception):\n')
+        f.write('        module_0.{}(*inputs)\n\n'.format(function_name))
+    return len(returns) + len(raises)
+
+
+def unique_cases(cases, seen=None):
+    # Drops the cases whose inputs an earlier case of the function already has, the small
+    # domains give the same tuple for different constraints and repetitions
+    if seen is None:
+        seen = set()
+    unique = []
+    for case in cases:
+        key = om.inputs_key(case['inputs'])
+        if key not in seen:
+            seen.add(key)
+            unique.append(case)
+    mt.count('duplicate_cases', len(cases) - len(unique))
+    return unique
+
+
+def oracle(src, module_name, plan, cases, settings, trace=False, memo=None):
+    inputs_list = [case['inputs'] for case in cases]
+    if not inputs_list:
+        return []
+    if memo is not None and plan.get('memoizable') and plan['digest'] is not None and not trace:
+        return memoized_oracle(src, module_name, plan, inputs_list, settings, memo)
+    mt.count('oracle_calls', len(inputs_list))
+    with mt.stage('oracle'):
+        return run_oracle(src, module_name, plan, inputs_list, settings, trace)
+
+
+def memoized_oracle(src, module_name, plan, inputs_list, settings, memo):
+    # Outcomes of a pure function stored by this or an earlier run are not computed again
+    function = om.function_key(module_name, plan['function_name'], plan['digest'])
+    keys = [om.inputs_key(inputs) for inputs in inputs_list]
+    with mt.stage('memo'):
+        known = memo.get_many(function, keys)
+    missing = [idx for idx, key in enumerate(keys) if key not in known]
+    mt.count('memo_hits', len(keys) - len(missing))
+    mt.count('memo_misses', len(missing))
+
+    if missing:
+        mt.count('oracle_calls', len(missing))
+        with mt.stage('oracle'):
+            outcomes = run_oracle(src, module_name, plan, [inputs_list[idx] for idx in missing], settings)
+        computed = {keys[idx]: outcome for idx, outcome in zip(missing, outcomes)}
+        with mt.stage('memo'):
+            memo.put_many(function, computed)
+        known.update(computed)
+    return [known[key] for key in keys]
+
+
+def run_oracle(src, module_name, plan, inputs_list, settings, trace=False):
+    if not settings.get('sandbox', True):
+        # statically inspected modules are only imported once an output is needed
+        if plan['function'] is None:
+            plan['function'] = load_function(src, module_name, plan['function_name'])
+        return ex.run_in_process(plan['function'], inputs_list, trace)
+
+    executor = ex.get_executor(workers=settings.get('oracle_workers', 1),
+                               timeout=settings.get('oracle_timeout', ex.CALL_TIMEOUT),
+                               batch_size=settings.get('oracle_batch_size', ex.BATCH_SIZE),
+                               max_memory=settings.get('oracle_max_memory', ex.MAX_MEMORY_MB))
+    return executor.run(src, module_name, plan['function_name'], inputs_list, trace)
 
-            signature = inspect.signature(function)
-            # Extract the parameter names and their types
-            parameter_info = [(param.name, param.annotation) for param in signature.parameters.values()]
-            typed_parameters = []
 
+def module_path(src, module_name):
+    base = os.path.join(src, *module_name.split('.'))
+    for path in (base + '.py', os.path.join(base, '__init__.py')):
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def static_inspector(src, module_name):
+    # Functions, signatures and annotations straight from the source file, the module is not imported
+    path = module_path(src, module_name)
+    if path is None:
+        return None
+    functions = ap.inspect_file(path)
+
+    ut.print_info('Number of functions in module: {}'.format(len(functions)))
+    for function_name in functions:
+        ut.print_info('Processing function: {}'.format(function_name))
+
+    return functions
+
+
+def load_function(src, module_name, function_name):
+    if src not in sys.path:
+        sys.path.append(src)
+    with mt.stage('import'):
+        return getattr(ex.import_fresh(module_name), function_name)
+
+
+def memoizable(settings, module_name, function_name, detected):
+    # Functions listed in 'pure_functions' (as name or module.name) or found pure by the static
+    # analysis have their oracle outcomes memoized
+    marked = settings.get('pure_functions', [])
+    if function_name in marked or '{}.{}'.format(module_name, function_name) in marked:
+        return True
+    return bool(detected) and settings.get('detect_pure_functions', True)
+
+
+def module_analyzer(src, module_name):
+    settings = sett.get_settings(src)
+
+    plans = []
+    # 'static' reads the source file, 'import' executes the module to find its functions
+    functions = None
+    if settings.get('inspection', 'static') == 'static':
+        with mt.stage('analyze'):
+            functions = static_inspector(src, module_name)
+        if functions is None:
+            ut.print_info('Source file of module "{}" not found, importing it instead.'.format(module_name))
+    if functions is not None:
+        for function_name, info in functions.items():
+            plans.append({
+                'function_name': function_name,
+                'function': None,
+                'parameter_info': info.parameters,
+                'result': info.usages,
+                'result_dict': ap.process_result(info.usages),
+                'typed_parameters': None,
+                'digest': info.digest,
+                'memoizable': memoizable(settings, module_name, function_name, info.pure)
+            })
+        return plans
+
+    functions = file_inspector(src, module_name)
+    path = module_path(src, module_name)
+    infos = ap.inspect_file(path) if path is not None else {}
+    for function_name, function in functions.items():
+        signature = inspect.signature(function)
+        # Extract the parameter names and their types
+        parameter_info = [(param.name, param.annotation) for param in signature.parameters.values()]
+
+        with mt.stage('analyze'):
             result = ap.analyze(function)
             result_dict = ap.process_result(result)
-            for name, annotation in parameter_info:
+
+        plans.append({
+            'function_name': function_name,
+            'function': function,
+            'parameter_info': parameter_info,
+            'result': result,
+            'result_dict': result_dict,
+            'typed_parameters': None,
+            'digest': infos[function_name].digest if function_name in infos else None,
+            'memoizable': memoizable(settings, module_name, function_name, function_name in infos and infos[function_name].pure)
+        })
+
+    return plans
+
+
+def function_seed(seed, module_name, function_name):
+    # the inputs of a function do not depend on the other functions, so its tests can be reused
+    # on their own, nor on which worker or in which order it is generated
+    return (seed + zlib.crc32('{}.{}'.format(module_name, function_name).encode())) % 2**32
+
+
+def reuse_blocks(src, module_name, plans, seed, entries=None):
+    # Keys every plan and attaches the stored tests of the functions whose key did not change,
+    # those are not predicted, generated nor executed again
+    settings = sett.get_settings(src)
+    artifacts = cl.make_backend(settings.get('classifier_backend', 'lstm')).artifacts
+    reused = 0
+    for plan in plans:
+        plan['key'] = None
+        plan['reused'] = None
+        if seed is None or plan['digest'] is None:
+            continue
+        predicted = any(annotation == inspect.Parameter.empty for _, annotation in plan['parameter_info'])
+        plan['key'] = mf.function_key(plan['digest'], plan['parameter_info'], settings, seed,
+                                      pc.artifacts_hash(artifacts) if predicted else None)
+
+        entry = (entries or {}).get(plan['function_name'])
+        if entry is not None and entry.get('key') == plan['key']:
+            ut.print_info('Function "{}" has not changed, reusing its tests.'.format(plan['function_name']))
+            plan['reused'] = entry
+            reused += 1
+    return reused
+
+
+def datatype_predictor(module_plans, batch_size=cl.BATCH_SIZE, backend='lstm'):
+    # First phase: collect the op sequences of every unannotated parameter
+    pending = []
+    for plans in module_plans:
+        for plan in plans:
+            if plan.get('reused'):
+                continue
+            for name, annotation in plan['parameter_info']:
                 if annotation == inspect.Parameter.empty:
                     ut.print_info('Parameter "{}" has no type annotation. Predicting datatype...'.format(name))
-                    # predict datatype
-                    if name in result_dict.keys():
-                        annotation = cl.predict_datatype([str(result_dict[name])])[0][1]
+                    if name in plan['result_dict'].keys():
+                        pending.append((plan, name, str(plan['result_dict'][name])))
+
+    # Second phase: classify all of them in a single batched call
+    mt.count('predicted_parameters', len(pending))
+    with mt.stage('predict'):
+        predictions = cl.predict_datatype([ops_funcs for _, _, ops_funcs in pending], batch_size=batch_size, backend=backend)
+    predicted = {}
+    for (plan, name, _), (_, prediction) in zip(pending, predictions):
+        predicted[(id(plan), name)] = prediction
+
+    # send the labels back to each function
+    for plans in module_plans:
+        for plan in plans:
+            if plan.get('reused'):
+                continue
+            typed_parameters = []
+            for name, annotation in plan['parameter_info']:
+                if annotation == inspect.Parameter.empty:
+                    annotation = predicted.get((id(plan), name), annotation)
                     ut.print_info('Predicted Datatype for {}: {}'.format(name, annotation))
                 typed_parameters.append((name, annotation))
+            plan['typed_parameters'] = typed_parameters
+
+
+def coverage_guided_cases(src, module_name, plan, RG, settings):
+    # Repetitions stop once 'coverage_patience' of them in a row execute no new arc of the target
+    # file, and only the cases executing a new arc are kept
+    patience = settings.get('coverage_patience', 5)
+    covered = set()
+    seen = set()
+    cases, outcomes = [], []
+    stale = 0
+    batches = 0
+    generated = 0
+    for i in range(settings['number_of_tests_per_function']):
+        batch = case_generator(plan['typed_parameters'], i, plan['result'], RG)
+        batches += 1
+        generated += len(batch)
+        if settings.get('deduplicate_inputs', True):
+            # a tuple already executed cannot reach a new arc
+            batch = unique_cases(batch, seen)
+
+        new_coverage = False
+        for case, (outcome, arcs) in zip(batch, oracle(src, module_name, plan, batch, settings, trace=True)):
+            # cases that end up without a test do not count towards the coverage of the suite
+            if outcome[0] not in ('ok', 'raises'):
+                continue
+            new_arcs = set(map(tuple, arcs)) - covered
+            if new_arcs:
+                covered |= new_arcs
+                cases.append(case)
+                outcomes.append(outcome)
+                new_coverage = True
+
+        stale = 0 if new_coverage else stale + 1
+        if stale >= patience:
+            break
+
+    ut.print_info('Coverage of "{}": {} arcs after {} repetitions, {} of {} cases kept'.format(
+        plan['function_name'], len(covered), batches, len(cases), generated))
+    return cases, outcomes
+
+
+def function_cases(src, module_name, plan, RG, settings):
+    # Inputs of one function, with their outcomes when the coverage-guided loop already ran them
+    if settings.get('coverage_guided', False):
+        return coverage_guided_cases(src, module_name, plan, RG, settings)
+
+    cases = case_generator(plan['typed_parameters'], 0, plan['result'], RG, settings['number_of_tests_per_function'])
+    if settings.get('deduplicate_inputs', True):
+        cases = unique_cases(cases)
+    return cases, None
+
+
+def function_block(module_name, plan, cases, outcomes, settings):
+    # Tests of one function as a block of the test file, with the number of tests in it
+    block = io.StringIO()
+    block.write('\n# Tests for: {}\n\n'.format(plan['function_name']))
+
+    with mt.stage('write'):
+        # 'parametrize' writes a table of cases per function, 'functions' a test function per case
+        if settings.get('output_format', 'functions') == 'parametrize':
+            tests = table_writer(block, module_name, plan['function_name'], cases, outcomes)
+        else:
+            tests = 0
+            for case, outcome in zip(cases, outcomes):
+                tests += case_writer(block, plan['typed_parameters'], module_name, plan['function_name'], case, outcome)
+    mt.count('tests', tests)
+    return block.getvalue(), tests
 
-            idx+=1
 
-            for i in range(number_of_tests_per_function):
-                test_generator(f, typed_parameters, i, result, function_name, function)
+def header_writer(f, module_name):
+    f.write(c.HeaderText)
+    f.write('import os\n')
+    f.write('import sys\n')
+    f.write('import pytest\n')
+    f.write('sys.path.append(\'../\')\n')
+    f.write("sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))\n")
+
+
+
+    f.write('import {} as module_0\n\n'.format(module_name))
+
+
+def is_pipelined(settings):
+    # In-process oracle calls rely on SIGALRM, only delivered to the main thread, and may draw
+    # from the random module the inputs are generated with
+    return settings.get('pipeline', True) and settings.get('sandbox', True)
+
+
+def module_writer(src, dst, module_name, plans, seed=None):
+    settings = sett.get_settings(src)
+    filename = os.path.join(dst, 'test_{}.py'.format(module_name.replace('.', '_')))
+
+    def generate(plan):
+        # A single thread in the order of the functions: the inputs come from the random module
+        # reseeded for every function, and z3 is not used from several threads
+        if plan.get('reused'):
+            return plan, None, None
+        if seed is not None:
+            random.seed(function_seed(seed, module_name, plan['function_name']))
+        # 'solver' asks z3 for values, 'sample' draws random values until one fits
+        RG = rg.RandomGenerator(mode=settings.get('generation_mode', 'solver'))
+        cases, outcomes = function_cases(src, module_name, plan, RG, settings)
+        return plan, cases, outcomes
+
+    # outcomes of the pure functions are kept in the destination folder across runs
+    memo = None
+    if any(plan.get('memoizable') and not plan.get('reused') for plan in plans):
+        memo = om.OracleMemo(om.memo_path(dst))
+
+    def execute(work):
+        plan, cases, outcomes = work
+        if cases is not None and outcomes is None:
+            # expected outputs of all the cases of the function are captured in one go
+            outcomes = oracle(src, module_name, plan, cases, settings, memo=memo)
+        return plan, cases, outcomes
+
+    with open(filename, 'w') as f:
+        header_writer(f, module_name)
+
+        def write(work):
+            plan, cases, outcomes = work
+            if cases is None:
+                block, block_tests = plan['reused']['block'], plan['reused']['tests']
+            else:
+                block, block_tests = function_block(module_name, plan, cases, outcomes, settings)
+            f.write(block)
+            return plan, block, block_tests
+
+        # the oracle of a function runs in the sandbox while the inputs of the next ones are
+        # generated, and its tests are written while the next oracle runs
+        stages = [pl.Stage('generate', generate, ordered=True),
+                  pl.Stage('execute', execute, workers=settings.get('pipeline_execute_workers', 1)),
+                  pl.Stage('write', write, ordered=True)]
+        try:
+            if is_pipelined(settings):
+                written = pl.Pipeline(stages, settings.get('pipeline_queue_size', 4)).run(plans)
+            else:
+                written = pl.run_sequential(stages, plans)
+        finally:
+            if memo is not None:
+                memo.close()
 
         ut.print_info('File generated: {}'.format(filename))
-    
+
+    entries = {}
+    for plan, block, block_tests in written:
+        if plan.get('key') is not None:
+            entries[plan['function_name']] = {'key': plan['key'], 'block': block, 'tests': block_tests}
+    return {'functions': len(plans), 'tests': sum(block_tests for _, _, block_tests in written),
+            'reused': sum(1 for plan in plans if plan.get('reused')), 'manifest': entries}
+
+
+def file_generator(src, dst, module_name, seed=None, entries=None):
+    settings = sett.get_settings(src)
+    batch_size = settings.get('prediction_batch_size', cl.BATCH_SIZE)
+
+    plans = module_analyzer(src, module_name)
+    reuse_blocks(src, module_name, plans, seed, entries)
+    datatype_predictor([plans], batch_size, settings.get('classifier_backend', 'lstm'))
+    return module_writer(src, dst, module_name, plans, seed)
@@ -1,68 +1,306 @@
+import io
 import os
 import sys 
 import json
 import time
+import random
+import cProfile
 import argparse
+import contextlib
+import multiprocessing
+import concurrent.futures
 
 import constants as c
 import utils as ut
 import settings as sett
-import file_generator as fg
+import executor as ex
+import manifest as mf
+import metrics as mt
 import tester as t
 import classifier as cl
 import sampler as sm
+import daemon as dm
+import sharding as sh
+# file_generator loads z3 and numpy, it is only imported by the code paths generating tests
 
 
-def generate_tests(src, dst):
+def collect_modules(src, settings):
+    modules = list(settings['files'])
+    for folder in settings['folders']:
+        for file_name in sorted(os.listdir(os.path.join(src, folder))):
+            if file_name.endswith('.py') and file_name != '__init__.py':
+                modules.append('{}.{}'.format(folder.strip(os.sep).replace(os.sep, '.'), file_name[:-3]))
+    return modules
+
+
+def init_worker(backend='lstm'):
+    # every worker loads its own classifier session once, for all the modules it generates
+    session = cl.get_session(backend=backend)
+    try:
+        session.open()
+    except (OSError, ValueError):
+        # missing artifacts are reported by the first prediction the cache cannot answer
+        pass
+
+
+def generate_module(src, dst, module_name, seed, entries=None):
+    import file_generator as fg
+
+    start = time.time()
+    # the measurements of this module are sent back to the parent with its stats
+    mt.reset()
+
+    cache = cl.get_session(backend=sett.get_settings(src).get('classifier_backend', 'lstm')).cache
+    hits, misses = (cache.hits, cache.misses) if cache is not None else (0, 0)
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log), mt.module(module_name):
+        ut.print_separator(c.LightHorizontalLine)
+        ut.print_info('Generating tests for module: {}'.format(module_name))
+        stats = fg.file_generator(src, dst, module_name, seed, entries)
+
+    if cache is not None:
+        stats['prediction_cache_hits'] = cache.hits - hits
+        stats['prediction_cache_misses'] = cache.misses - misses
+    stats['time'] = time.time() - start
+    stats['metrics'] = mt.snapshot()
+    return log.getvalue(), stats
+
+
+# Pool of generation workers, a resident server keeps it, and the sessions of its workers,
+# between requests
+_pool = None
+_pool_key = None
+
+def get_pool(jobs, backend):
+    global _pool, _pool_key
+    if _pool is not None and _pool_key != (jobs, backend):
+        close_pool()
+    if _pool is None:
+        context = multiprocessing.get_context('spawn')
+        _pool = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, mp_context=context, initializer=init_worker, initargs=(backend,))
+        _pool_key = (jobs, backend)
+    return _pool
+
+def close_pool():
+    global _pool, _pool_key
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+        _pool_key = None
+
+
+def print_metrics():
+    measurements = mt.snapshot()
+    for name, entry in sorted(measurements['stages'].items(), key=lambda item: -item[1]['time']):
+        ut.print_info('Stage {}: {:.2f} seconds, {} calls'.format(name, entry['time'], entry['calls']))
+    for name, value in sorted(measurements['counters'].items()):
+        ut.print_info('Counter {}: {}'.format(name, value))
+
+
+def generate_tests(src, dst, jobs=1, seed=None, incremental=False, metrics_report=None, resident=False, shard=None):
+    import file_generator as fg
+
     start = time.time()
+    mt.reset()
     settings = sett.get_settings(src)    
-    num_files = 0
-    num_files += len(settings['files'])
+    modules = collect_modules(src, settings)
+    ut.print_info('Number of files from source folder: {}'.format(len(modules)))
 
-    for folder in settings['folders']:
-        num_files += len(os.listdir(os.path.join(src, folder)))
-    ut.print_info('Number of files from source folder: {}'.format(num_files))
+    costs = None
+    if shard is not None:
+        # every machine computes the same partition from the source tree alone
+        costs = {module_name: sh.module_cost(fg.module_path(src, module_name)) for module_name in modules}
+        tree = sh.tree_hash({module_name: sh.module_digests(fg.module_path(src, module_name)) for module_name in modules})
+        modules = sh.shard_modules(modules, costs, shard)
+        ut.print_info('Shard {}/{}: {} modules, estimated cost {} of {}'.format(
+            shard[0], shard[1], len(modules), sum(costs[module_name] for module_name in modules), sum(costs.values())))
+    num_files = len(modules)
+
+    # in incremental mode the tests of unchanged functions are taken from the previous run, of
+    # the same shard when sharded since a shard only writes the entries of its own modules
+    previous = mf.load_manifest(dst, shard) if incremental else mf.empty_manifest()
+    if seed is None:
+        seed = settings.get('seed', previous['seed'])
+    if seed is None:
+        seed = random.randrange(2**32)
+    ut.print_info('Seed: {}'.format(seed))
+    module_entries = {module_name: previous['modules'].get(module_name) for module_name in modules}
     ut.print_separator(c.LightHorizontalLine)
     
+    backend = settings.get('classifier_backend', 'lstm')
     ut.print_header(header_text='Tests Generation')
-    for module_name in settings['files']:
+    module_stats = []
+    cache_hits, cache_misses = None, None
+    if jobs > 1:
+        # modules are independent, spread them over a pool of workers and print their logs in order
+        executor = get_pool(jobs, backend)
+        futures = [executor.submit(generate_module, src, dst, module_name, seed, module_entries[module_name]) for module_name in modules]
+        for future in futures:
+            log, stats = future.result()
+            print(log, end='')
+            mt.merge(stats.pop('metrics'))
+            module_stats.append(stats)
+            if 'prediction_cache_hits' in stats:
+                cache_hits = (cache_hits or 0) + stats['prediction_cache_hits']
+                cache_misses = (cache_misses or 0) + stats['prediction_cache_misses']
+    else:
+        # analyze every module first so all unannotated parameters of the tree are predicted together
+        module_plans = []
+        for module_name in modules:
+            ut.print_separator(c.LightHorizontalLine)
+            ut.print_info('Analyzing module: {}'.format(module_name))
+            with mt.module(module_name):
+                plans = fg.module_analyzer(src, module_name)
+                fg.reuse_blocks(src, module_name, plans, seed, module_entries[module_name])
+            module_plans.append((module_name, plans))
+
         ut.print_separator(c.LightHorizontalLine)
-        ut.print_info('Generating tests for module: {}'.format(module_name))
-        fg.file_generator(src, dst, module_name)
-    for folder in settings['folders']:
-        ut.print_separator(c.DoubleHorizontalLine)
-        for module_name in os.listdir(os.path.join(src, folder)):
+        batch_size = settings.get('prediction_batch_size', cl.BATCH_SIZE)
+        fg.datatype_predictor([plans for _, plans in module_plans], batch_size, backend)
+
+        cache = cl.get_session(backend=backend).cache
+        for module_name, plans in module_plans:
+            module_start = time.time()
             ut.print_separator(c.LightHorizontalLine)
             ut.print_info('Generating tests for module: {}'.format(module_name))
-            fg.file_generator(src, dst, module_name)
+            with mt.module(module_name):
+                stats = fg.module_writer(src, dst, module_name, plans, seed)
+            stats['time'] = time.time() - module_start
+            module_stats.append(stats)
+        if cache is not None:
+            cache_hits, cache_misses = cache.hits, cache.misses
+
+    # release the classifier loaded for the predictions and the oracle workers, unless a
+    # resident server keeps them for its next request
+    if not resident:
+        cl.close_session()
+        ex.close_executor()
+        close_pool()
+    elif cl.get_session(backend=backend).cache is not None:
+        # the cache file may be removed or replaced between requests, only the model stays loaded
+        cl.get_session(backend=backend).cache.close()
+
+    manifest = mf.empty_manifest(seed)
+    for module_name, stats in zip(modules, module_stats):
+        manifest['modules'][module_name] = stats.pop('manifest')
+    mf.store_manifest(dst, manifest, shard)
 
     end = time.time()
+    if shard is not None:
+        shard_modules = {}
+        for module_name, stats in zip(modules, module_stats):
+            shard_modules[module_name] = {'cost': costs[module_name], 'functions': stats['functions'], 'tests': stats['tests'],
+                                          'reused': stats['reused'], 'time': stats['time']}
+        shard_path = sh.store_shard_stats(dst, shard, {'seed': seed, 'tree': tree, 'modules': shard_modules,
+                                                       'total_time': end - start, 'metrics': mt.snapshot()})
+
     ut.print_header(header_text='Statistics')
     ut.print_info('Time elapsed: {:.2f} seconds'.format(end - start))
     ut.print_info('Total number of files generated: {}'.format(num_files))
+    ut.print_info('Total number of functions: {}'.format(sum(stats['functions'] for stats in module_stats)))
+    ut.print_info('Total number of tests generated: {}'.format(sum(stats['tests'] for stats in module_stats)))
+    if incremental:
+        ut.print_info('Functions reused from the previous run: {}'.format(sum(stats['reused'] for stats in module_stats)))
+    ut.print_info('Time spent in modules: {:.2f} seconds'.format(sum(stats['time'] for stats in module_stats)))
+    if cache_hits is not None:
+        ut.print_info('Prediction cache: {} hits, {} misses'.format(cache_hits, cache_misses))
+    counters = mt.snapshot()['counters']
+    if 'memo_hits' in counters or 'memo_misses' in counters:
+        ut.print_info('Oracle memo: {} hits, {} misses'.format(counters.get('memo_hits', 0), counters.get('memo_misses', 0)))
+    if metrics_report:
+        # stage times are inclusive, 'solver' and 'compile' are part of 'generate' for instance
+        print_metrics()
+        mt.write_report(metrics_report, seed=seed, jobs=jobs, total_time=end - start,
+                        module_times={module_name: stats['time'] for module_name, stats in zip(modules, module_stats)})
+        ut.print_info('Metrics report: {}'.format(metrics_report))
+    if shard is not None:
+        ut.print_info('Shard statistics: {}'.format(shard_path))
     ut.print_separator(c.DoubleHorizontalLine)
+
+
+def merge_shards(paths, report=None):
+    shards = sh.load_shards(paths)
+    merged = sh.merge_shards(shards)
+
+    ut.print_info('Shards: {} of {}'.format(len(shards), merged['shards']))
+    if merged['missing_shards']:
+        ut.print_info('Missing shards: {}'.format(', '.join(str(index) for index in merged['missing_shards'])))
+    for stats in shards:
+        ut.print_info('Shard {}: {} modules, estimated cost {}, {:.2f} seconds'.format(
+            stats['shard'], len(stats['modules']), merged['shard_costs'][stats['shard']], stats['total_time']))
+    ut.print_info('Total number of files generated: {}'.format(len(merged['modules'])))
+    ut.print_info('Total number of functions: {}'.format(merged['functions']))
+    ut.print_info('Total number of tests generated: {}'.format(merged['tests']))
+    ut.print_info('Slowest shard: {:.2f} seconds'.format(merged['makespan']))
+
+    if report:
+        # the stage times and counters of every shard, summed as for a --jobs run
+        mt.reset()
+        for stats in shards:
+            mt.merge(stats['metrics'])
+        mt.write_report(report, **merged)
+        ut.print_info('Merged report: {}'.format(report))
+    return merged
+
+
+def serve_generation(request):
+    generate_tests(resident=True, **request['arguments'])
+
+
+def serve(socket_path, backend='lstm'):
+    # Pays for the imports and the classifier load once, then generates tests for every client
+    import file_generator as fg
+
+    start = time.time()
+    # the first prediction also builds the model's predict function
+    cl.get_session(backend=backend).predict_labels(['[]'])
+    ut.print_info('Classifier "{}" and z3 loaded in {:.2f} seconds.'.format(backend, time.time() - start))
+    try:
+        dm.serve({'generate': serve_generation}, socket_path)
+    finally:
+        cl.close_session()
+        ex.close_executor()
+        close_pool()
     
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--sample', action='store_true', help='Sample the dataset')
     parser.add_argument('--train', action='store_true', help='Train the classifier')
+    parser.add_argument('--backend', choices=cl.BACKENDS, default='lstm', help='Classifier trained by --train or loaded by --serve')
     parser.add_argument('--generate-tests', nargs=2, metavar=('source_folder', 'destination_folder'), help='Generate tests')
     parser.add_argument('--run-tests', type=str, help='Run tests')
+    parser.add_argument('--samples', type=int, default=500, help='Number of samples per datatype written by --sample')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes used to sample, generate or run tests')
+    parser.add_argument('--seed', type=int, help='Base seed of the samples or of the generated inputs')
+    parser.add_argument('--incremental', action='store_true', help='Reuse the tests of the functions that did not change since the last run')
+    parser.add_argument('--metrics-report', metavar='report.json', help='Write the time and calls of every generation stage to a JSON report')
+    parser.add_argument('--profile', metavar='profile.prof', help='Write a cProfile dump of the test generation (main process only)')
+    parser.add_argument('--shard', type=sh.parse_shard, metavar='i/N', help='Only generate the tests of shard i out of N (1 <= i <= N), balanced by estimated cost, with a manifest of its own for --incremental')
+    parser.add_argument('--merge-shards', nargs='+', metavar='shard_stats', help='Combine the statistics written by the --shard runs (files or destination folders), --metrics-report writes the merged report')
+    parser.add_argument('--serve', action='store_true', help='Keep the classifier and z3 loaded and generate the tests requested by other invocations')
+    parser.add_argument('--stop-server', action='store_true', help='Stop the server started with --serve')
+    parser.add_argument('--no-server', action='store_true', help='Generate the tests in this process even if a server is running')
+    parser.add_argument('--socket', default=dm.SOCKET_FILE, help='Unix socket of the server')
 
     args = parser.parse_args()
 
     if args.sample:
         ut.print_header(header_text='AllForOne - Sampling Mode')
         ut.print_info('Sampling the dataset...')
-        sm.sample()
+        sm.sample(args.samples, args.jobs, args.seed)
         ut.print_info('Sampling complete.')        
         ut.print_separator(c.DoubleHorizontalLine)
 
     if args.train:
         ut.print_header(header_text='AllForOne - Training Mode')
-        ut.print_info('Training the classifier...')
-        cl.train()
+        ut.print_info('Training the {} classifier...'.format(args.backend))
+        if args.backend == 'bag_of_ops':
+            import bag_of_ops as bob
+            bob.train()
+        else:
+            cl.train()
         ut.print_info('Training complete.')        
         ut.print_separator(c.DoubleHorizontalLine)
 
@@ -95,22 +333,75 @@ if __name__ == '__main__':
 
         sett.store_settings(source_folder, settings)
 
-        generate_tests(source_folder, destination_folder)
+        # the shards of a run must agree on the seed, they cannot each draw their own
+        if args.shard and args.seed is None and settings.get('seed') is None:
+            print('[ERROR] --shard needs a seed, from --seed or from settings.json.')
+            sys.exit(1)
+
+        # a running server already has everything loaded, the paths must not depend on our directory
+        reply = None
+        if not args.no_server and not args.profile:
+            arguments = {
+                'src': os.path.abspath(source_folder),
+                'dst': os.path.abspath(destination_folder),
+                'jobs': args.jobs,
+                'seed': args.seed,
+                'incremental': args.incremental,
+                'metrics_report': os.path.abspath(args.metrics_report) if args.metrics_report else None,
+                'shard': args.shard
+            }
+            reply = dm.request({'command': 'generate', 'arguments': arguments}, args.socket)
+
+        if reply is not None:
+            if reply['exit_code'] != 0:
+                sys.exit(reply['exit_code'])
+        elif args.profile:
+            profiler = cProfile.Profile()
+            profiler.runcall(generate_tests, source_folder, destination_folder, args.jobs, args.seed, args.incremental, args.metrics_report, shard=args.shard)
+            profiler.dump_stats(args.profile)
+            ut.print_info('Profile written to: {}'.format(args.profile))
+        else:
+            generate_tests(source_folder, destination_folder, args.jobs, args.seed, args.incremental, args.metrics_report, shard=args.shard)
     
     if args.run_tests:
         destination_folder = args.run_tests
         ut.print_header(header_text='AllForOne - Running Tests Mode')
         ut.print_info('Running tests...')        
-        t.run_tests(destination_folder)
+        result = t.run_tests(destination_folder, args.jobs)
         ut.print_info('Tests complete.')        
+        ut.print_info('Passed: {}, failed: {}, errors: {}, skipped: {}'.format(result.passed, result.failed, result.errors, result.skipped))
+        ut.print_info('Time spent in test files: {:.2f} seconds'.format(sum(result.durations.values())))
         ut.print_separator(c.DoubleHorizontalLine)
+        if result.exit_code != 0:
+            sys.exit(result.exit_code)
 
 
-    if not args.sample and not args.train and not args.generate_tests and not args.run_tests:
+    if args.merge_shards:
+        ut.print_header(header_text='AllForOne - Shard Merge')
+        try:
+            merge_shards(args.merge_shards, args.metrics_report)
+        except (OSError, ValueError, KeyError) as e:
+            print('[ERROR] {}'.format(e))
+            sys.exit(1)
+        ut.print_separator(c.DoubleHorizontalLine)
+
+    if args.stop_server:
+        if dm.stop(args.socket):
+            ut.print_info('Server stopped.')
+        else:
+            ut.print_info('No server is listening on "{}".'.format(args.socket))
+
+    if args.serve:
+        ut.print_header(header_text='AllForOne - Server Mode')
+        serve(args.socket, args.backend)
+        ut.print_separator(c.DoubleHorizontalLine)
+
+    if not args.sample and not args.train and not args.generate_tests and not args.run_tests and not args.serve and not args.stop_server and not args.merge_shards:
         ut.print_info('Usage: python main.py <source_folder> <destination_folder>')
         ut.print_info('Example: python main.py /path/to/source /path/to/destination')
 
         ut.print_info('Optional flags:')
         ut.print_info('  --sample: Sample the dataset')
         ut.print_info('  --train: Train the classifier')
+        ut.print_info('  --serve: Keep a generation server running, --generate-tests then goes through it')
         sys.exit(1)
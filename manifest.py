@@ -0,0 +1,68 @@
+import os
+import json
+import hashlib
+import inspect
+
+MANIFEST_FILE = '.allforone_manifest.json'
+# a --shard run only generates part of the modules, it keeps their entries in a manifest of its own
+SHARD_MANIFEST_FILE = '.allforone_manifest_{}_of_{}.json'
+VERSION = 1
+# Changed whenever the same seed and settings give other inputs, the stored tests are then regenerated
+GENERATOR = 4
+# settings.json entries that change the tests generated for a function
+GENERATION_SETTINGS = ('number_of_tests_per_function', 'generation_mode', 'sandbox', 'oracle_timeout', 'output_format', 'coverage_guided', 'coverage_patience', 'deduplicate_inputs')
+
+
+def empty_manifest(seed=None):
+    return {'version': VERSION, 'seed': seed, 'modules': {}}
+
+
+def manifest_path(dst, shard=None):
+    if shard is None:
+        return os.path.join(dst, MANIFEST_FILE)
+    return os.path.join(dst, SHARD_MANIFEST_FILE.format(*shard))
+
+
+def load_manifest(dst, shard=None):
+    path = manifest_path(dst, shard)
+    if not os.path.isfile(path):
+        return empty_manifest()
+    try:
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return empty_manifest()
+    # a manifest written by another version is not trusted
+    if not isinstance(manifest, dict) or manifest.get('version') != VERSION:
+        return empty_manifest()
+    return manifest
+
+
+def store_manifest(dst, manifest, shard=None):
+    path = manifest_path(dst, shard)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def annotation_name(annotation):
+    if annotation == inspect.Parameter.empty:
+        return None
+    if isinstance(annotation, str):
+        return annotation
+    return getattr(annotation, '__name__', str(annotation))
+
+
+def function_key(digest, parameter_info, settings, seed, model_hash=None):
+    # Everything the tests of a function depend on: its source, its signature, the generation
+    # settings, the seed and, when some parameter type is predicted, the classifier artifacts
+    key = {
+        'source': digest,
+        'signature': [[name, annotation_name(annotation)] for name, annotation in parameter_info],
+        'settings': {name: settings.get(name) for name in GENERATION_SETTINGS},
+        'seed': seed,
+        'generator': GENERATOR,
+        'model': model_hash
+    }
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()
@@ -0,0 +1,89 @@
+import time
+import json
+import threading
+import contextlib
+
+# Stage and counter names used when no module is being generated, e.g. the batched predictions
+GLOBAL = '(all modules)'
+
+# Process-wide measurements: stage -> {'time', 'calls'} and counter -> value, in total and per module
+_stages = {}
+_counters = {}
+_modules = {}
+_module = GLOBAL
+# the stages of a generation pipeline measure from several threads
+_lock = threading.Lock()
+
+
+def _module_entry(module_name):
+    return _modules.setdefault(module_name, {'stages': {}, 'counters': {}})
+
+
+def add_time(name, elapsed, calls=1):
+    with _lock:
+        for stages in (_stages, _module_entry(_module)['stages']):
+            entry = stages.setdefault(name, {'time': 0.0, 'calls': 0})
+            entry['time'] += elapsed
+            entry['calls'] += calls
+
+
+def count(name, value=1):
+    with _lock:
+        for counters in (_counters, _module_entry(_module)['counters']):
+            counters[name] = counters.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def stage(name):
+    # Wall time of the block, nested stages are also counted in the enclosing one
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_time(name, time.perf_counter() - start)
+
+
+@contextlib.contextmanager
+def module(module_name):
+    # Everything measured inside the block is also attributed to module_name
+    global _module
+    previous = _module
+    _module = module_name
+    try:
+        yield
+    finally:
+        _module = previous
+
+
+def reset():
+    global _module
+    _stages.clear()
+    _counters.clear()
+    _modules.clear()
+    _module = GLOBAL
+
+
+def snapshot():
+    return json.loads(json.dumps({'stages': _stages, 'counters': _counters, 'modules': _modules}))
+
+
+def merge(measurements):
+    # Adds the snapshot of another process, such as a generation worker, to this one
+    def merge_into(stages, counters, other):
+        for name, entry in other['stages'].items():
+            target = stages.setdefault(name, {'time': 0.0, 'calls': 0})
+            target['time'] += entry['time']
+            target['calls'] += entry['calls']
+        for name, value in other['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+
+    merge_into(_stages, _counters, measurements)
+    for module_name, other in measurements['modules'].items():
+        entry = _module_entry(module_name)
+        merge_into(entry['stages'], entry['counters'], other)
+
+
+def write_report(path, **extra):
+    report = dict(snapshot(), **extra)
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=1, sort_keys=True)
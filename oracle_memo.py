@@ -0,0 +1,99 @@
+import os
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+
+# Outcomes of the pure functions of a tree, kept next to its generated tests
+MEMO_FILE = '.allforone_oracle.sqlite'
+MAX_ENTRIES = 500000
+# Only outcomes decided by the function itself are stored, timeouts, crashes and running out of
+# memory or stack depend on the run
+MEMOIZED = ('ok', 'raises')
+RESOURCE_ERRORS = (('builtins', 'MemoryError'), ('builtins', 'RecursionError'))
+
+
+def function_key(module_name, function_name, digest):
+    # The digest covers the function, the definitions it uses and its module context, any edit
+    # to them gives the function a new key
+    return hashlib.sha256('{}:{}:{}'.format(module_name, function_name, digest).encode()).hexdigest()
+
+
+def inputs_key(inputs):
+    # True, 1 and 1.0 are different inputs
+    return repr(tuple((type(value).__name__, value) for value in inputs))
+
+
+def is_memoized(outcome):
+    if outcome[0] not in MEMOIZED:
+        return False
+    return outcome[0] != 'raises' or tuple(outcome[1][:2]) not in RESOURCE_ERRORS
+
+
+# Persistent table of (function, inputs) -> oracle outcome for functions without side effects
+class OracleMemo:
+    def __init__(self, path=MEMO_FILE, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.connection = None
+        # the execute stage of a generation pipeline may use it from several threads
+        self.lock = threading.Lock()
+
+    def open(self):
+        if self.connection is None:
+            # parallel generation workers may write to the same file
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS outcomes ('
+                'function TEXT NOT NULL, inputs TEXT NOT NULL, outcome BLOB NOT NULL, last_used REAL NOT NULL, '
+                'PRIMARY KEY (function, inputs)) WITHOUT ROWID')
+            self.connection.commit()
+        return self
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def get_many(self, function, keys):
+        with self.lock:
+            self.open()
+            keys = list(dict.fromkeys(keys))
+            outcomes = {}
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self.connection.execute(
+                    'SELECT inputs, outcome FROM outcomes WHERE function = ? AND inputs IN ({})'.format(', '.join('?' * len(chunk))),
+                    [function] + chunk)
+                outcomes.update((key, pickle.loads(outcome)) for key, outcome in rows.fetchall())
+
+            if outcomes:
+                now = time.time()
+                self.connection.executemany('UPDATE outcomes SET last_used = ? WHERE function = ? AND inputs = ?',
+                                            [(now, function, key) for key in outcomes])
+                self.connection.commit()
+            return outcomes
+
+    def put_many(self, function, outcomes):
+        rows = [(function, key, pickle.dumps(outcome), time.time()) for key, outcome in outcomes.items() if is_memoized(outcome)]
+        if not rows:
+            return
+        with self.lock:
+            self.open()
+            self.connection.executemany('INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?)', rows)
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        # Keep the table bounded by dropping the least recently used outcomes
+        count = self.connection.execute('SELECT COUNT(*) FROM outcomes').fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                'DELETE FROM outcomes WHERE (function, inputs) IN '
+                '(SELECT function, inputs FROM outcomes ORDER BY last_used LIMIT ?)', (count - self.max_entries,))
+
+
+def memo_path(dst):
+    return os.path.join(dst, MEMO_FILE)
@@ -0,0 +1,129 @@
+import queue
+import threading
+
+# Marks the end of the items flowing into a stage
+_END = object()
+
+
+# One step of a pipeline: function(item) -> item for the next stage, run by a number of threads.
+# An ordered stage (one thread) receives the items in the order they were given to the pipeline
+class Stage:
+    def __init__(self, name, function, workers=1, ordered=False):
+        if ordered and workers != 1:
+            raise ValueError('Ordered stage "{}" must have a single worker'.format(name))
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.ordered = ordered
+
+
+class Pipeline:
+    def __init__(self, stages, capacity=4):
+        self.stages = stages
+        # items waiting between two stages, a full queue blocks the stage feeding it
+        self.capacity = max(1, capacity)
+        self.error = None
+        self.failed = threading.Event()
+
+    def fail(self, error):
+        if not self.failed.is_set():
+            self.error = error
+            self.failed.set()
+
+    def admit(self, window):
+        # Waits until the next ordered stage has room for one more item, False once the pipeline failed
+        while window is not None and not window.acquire(timeout=0.1):
+            if self.failed.is_set():
+                return False
+        return True
+
+    def feed(self, items, output, window):
+        for index, item in enumerate(items):
+            if self.failed.is_set() or not self.admit(window):
+                break
+            output.put((index, item))
+        output.put(_END)
+
+    def work(self, stage, input_queue, output, finished, window=None, next_window=None):
+        # (index, item) that arrived before their turn, ordered stages only
+        waiting = {}
+        next_index = 0
+        while True:
+            entry = input_queue.get()
+            if entry is _END:
+                # the other workers of the stage need to see it too
+                input_queue.put(_END)
+                break
+
+            ready = [entry]
+            if stage.ordered:
+                waiting[entry[0]] = entry[1]
+                ready = []
+                while next_index in waiting:
+                    ready.append((next_index, waiting.pop(next_index)))
+                    next_index += 1
+                    # lets one more item in behind it
+                    window.release()
+
+            for index, item in ready:
+                # after a failure the items are drained so every thread can stop
+                if self.failed.is_set():
+                    continue
+                try:
+                    result = stage.function(item)
+                except BaseException as e:
+                    self.fail(e)
+                    continue
+                if self.admit(next_window):
+                    output.put((index, result))
+
+        with finished[1]:
+            finished[0] += 1
+            if finished[0] == stage.workers:
+                output.put(_END)
+
+    def run(self, items):
+        # Results of the last stage in the order of the items, the first error is raised once
+        # every thread has stopped
+        queues = [queue.Queue(self.capacity) for _ in range(len(self.stages) + 1)]
+        # Items reach an ordered stage out of order when a stage before it has several workers.
+        # The feeder, or the ordered stage before it, only lets capacity items in ahead of it,
+        # which bounds the items it has to keep waiting for their turn
+        windows = [threading.Semaphore(self.capacity) if stage.ordered else None for stage in self.stages]
+        def next_window(position):
+            return next((window for window in windows[position:] if window is not None), None)
+
+        threads = [threading.Thread(target=self.feed, args=(items, queues[0], next_window(0)), daemon=True)]
+        for position, stage in enumerate(self.stages):
+            finished = [0, threading.Lock()]
+            for _ in range(stage.workers):
+                arguments = (stage, queues[position], queues[position + 1], finished)
+                if stage.ordered:
+                    arguments += (windows[position], next_window(position + 1))
+                threads.append(threading.Thread(target=self.work, args=arguments,
+                                                name='{}-{}'.format(stage.name, len(threads)), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        results = {}
+        while True:
+            entry = queues[-1].get()
+            if entry is _END:
+                break
+            results[entry[0]] = entry[1]
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+        return [results[index] for index in sorted(results)]
+
+
+def run_sequential(stages, items):
+    # Same results without threads, every item goes through all the stages before the next one
+    results = []
+    for item in items:
+        for stage in stages:
+            item = stage.function(item)
+        results.append(item)
+    return results
@@ -0,0 +1,122 @@
+import os
+import time
+import sqlite3
+import hashlib
+
+CACHE_FILE = 'predictions.sqlite'
+MAX_ENTRIES = 100000
+ARTIFACTS = ('classifier.h5', 'tokenizer.pkl', 'label_encoder.pkl')
+
+# Same filters the Keras Tokenizer applies before splitting the op sequence into words
+TOKENIZER_FILTERS = '!"#$%&()*+,-./:;<=>?@[\\]^_`{|}~\t\n'
+TOKENIZER_TABLE = str.maketrans(TOKENIZER_FILTERS, ' ' * len(TOKENIZER_FILTERS))
+
+
+def normalize(ops_funcs):
+    # "['Add', 'Mult']" and "['add', 'mult']" are the same input for the classifier
+    return ' '.join(str(ops_funcs).lower().translate(TOKENIZER_TABLE).split())
+
+
+# Digests already computed in this process, keyed by the size and mtime of the artifacts
+_hashes = {}
+
+
+def artifacts_hash(artifacts=ARTIFACTS):
+    stamp = tuple((path, os.path.getmtime(path), os.path.getsize(path)) if os.path.isfile(path) else (path,) for path in artifacts)
+    if stamp in _hashes:
+        return _hashes[stamp]
+
+    sha = hashlib.sha256()
+    for path in artifacts:
+        sha.update(os.path.basename(path).encode())
+        if not os.path.isfile(path):
+            continue
+        with open(path, 'rb') as artifact:
+            for chunk in iter(lambda: artifact.read(1 << 20), b''):
+                sha.update(chunk)
+    _hashes[stamp] = sha.hexdigest()
+    return _hashes[stamp]
+
+
+# Persistent table of op sequence -> predicted datatype for one set of model artifacts
+class PredictionCache:
+    def __init__(self, path=CACHE_FILE, artifacts=ARTIFACTS, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.artifacts = artifacts
+        self.max_entries = max_entries
+        self.model_hash = None
+        self.connection = None
+        self.hits = 0
+        self.misses = 0
+
+    def open(self):
+        if self.connection is None:
+            self.connection = sqlite3.connect(self.path)
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS predictions ('
+                'model_hash TEXT NOT NULL, ops TEXT NOT NULL, label TEXT NOT NULL, last_used REAL NOT NULL, '
+                'PRIMARY KEY (model_hash, ops)) WITHOUT ROWID')
+            self.connection.commit()
+            # entries of other models are never read under this hash, they are left to the LRU
+            # eviction since another backend sharing the file may still use them
+            self.model_hash = artifacts_hash(self.artifacts)
+        return self
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+            self.model_hash = None
+
+    def get_many(self, keys):
+        self.open()
+        keys = list(dict.fromkeys(keys))
+        labels = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                'SELECT ops, label FROM predictions WHERE model_hash = ? AND ops IN ({})'.format(', '.join('?' * len(chunk))),
+                [self.model_hash] + chunk)
+            labels.update(rows.fetchall())
+
+        self.hits += len(labels)
+        self.misses += len(keys) - len(labels)
+
+        if labels:
+            now = time.time()
+            self.connection.executemany('UPDATE predictions SET last_used = ? WHERE model_hash = ? AND ops = ?',
+                                        [(now, self.model_hash, key) for key in labels])
+            self.connection.commit()
+        return labels
+
+    def put_many(self, labels):
+        self.open()
+        now = time.time()
+        self.connection.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?, ?)',
+                                    [(self.model_hash, key, str(label), now) for key, label in labels.items()])
+        self.evict()
+        self.connection.commit()
+
+    def evict(self):
+        # Keep the table bounded by dropping the least recently used predictions
+        count = self.connection.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                'DELETE FROM predictions WHERE (model_hash, ops) IN '
+                '(SELECT model_hash, ops FROM predictions ORDER BY last_used LIMIT ?)', (count - self.max_entries,))
+
+    def clear(self):
+        self.open()
+        self.connection.execute('DELETE FROM predictions')
+        self.connection.commit()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+def invalidate(path=CACHE_FILE):
+    # Called after retraining, every stored prediction belongs to the previous model
+    if os.path.isfile(path):
+        cache = PredictionCache(path)
+        cache.clear()
+        cache.close()
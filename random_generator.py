@@ -1,72 +1,306 @@
+import time
+import numpy as np
+from itertools import cycle, islice
 from z3 import *
-from random import randint, uniform, choice
+from z3.z3util import get_vars
+from random import randint, uniform, choice, shuffle, getrandbits
 from string import ascii_lowercase, ascii_uppercase
 
+import constraint_compiler as cc
+import metrics as mt
+
 MIN_INT = -1000
 MAX_INT = 1000
 MIN_STR_LEN = 1
 MAX_STR_LEN = 10
+FLOAT_DECIMALS = 3
+
+# Budget of a single generate call
+MAX_ITERATIONS = 1000
+TIMEOUT = 2.0
+# Distinct values requested from each solver instance
+SOLVER_BATCH = 16
+# Candidates drawn at once when the constraints compile to a numpy predicate
+CANDIDATE_BATCH = 1024
+
+
+class GenerationError(Exception):
+    pass
+
 
 class RandomGenerator:
-    def __init__(self):
+    def __init__(self, mode='solver', max_iterations=MAX_ITERATIONS, timeout=TIMEOUT, solver_batch=SOLVER_BATCH):
         self.chars = ascii_lowercase + ascii_uppercase
+        self.mode = mode
+        self.max_iterations = max_iterations
+        self.timeout = timeout
+        self.solver_batch = solver_batch
+        self.rng = np.random.default_rng(getrandbits(64))
+        # values already produced by a solver and not handed out yet
+        self.pool = {}
+        # compiled predicate for every constraint set, None when z3 has to decide
+        self.predicates = {}
+        # long-lived solver for every constraint set, shared by all the parameters generated with this instance
+        self.solvers = {}
+        self.known_constraints = {}
+
+    def value_type(self, data_type):
+        if data_type == int or data_type == 'int':
+            return int
+        elif data_type == float or data_type == 'float':
+            return float
+        elif data_type == str or data_type == 'str':
+            return str
+        elif data_type == bool or data_type == 'bool':
+            return bool
+        else:
+            raise ValueError("Unsupported data type")
 
     def generate(self, data_type, constraints=[], kind=None):
         if kind is None:
             kind = choice(['meet', 'dont meet'])
 
-        if data_type == int or data_type == 'int':
+        if is_expr(constraints):
+            constraints = [constraints]
+
+        value_type = self.value_type(data_type)
+
+        # z3 shares structurally equal terms, so the ids identify a constraint set; keeping a
+        # reference to the terms guarantees the ids are not recycled for other terms
+        ids = tuple(constraint.get_id() for constraint in constraints)
+        self.known_constraints.setdefault(ids, constraints)
+        key = (value_type, kind, ids)
+
+        # 'solver' asks z3 for the values, 'sample' draws random candidates: the constraints over
+        # numbers and booleans that lower to numpy filter whole arrays of them, the others are
+        # checked by z3 one candidate at a time. Values without constraints are always drawn
+        if value_type != str and (self.mode == 'sample' or len(constraints) == 0):
+            predicate = self.compile_constraints(value_type, constraints, key[2])
+            if predicate is not None:
+                return self.generate_vectorized(value_type, predicate, kind, key)
+
+        if self.mode == 'solver' and len(constraints) > 0:
+            return self.generate_from_solver(value_type, constraints, kind, key)
+
+        if value_type == int:
             return self.generate_int(constraints, kind)
-        elif data_type == float or data_type == 'float':
+        elif value_type == float:
             return self.generate_float(constraints, kind)
-        elif data_type == str or data_type == 'str':
+        elif value_type == str:
             return self.generate_string(constraints, kind)
-        elif data_type == bool or data_type == 'bool':
-            return self.generate_boolean(constraints, kind)
         else:
-            raise ValueError("Unsupported data type")
+            return self.generate_boolean(constraints, kind)
+
 
+    def generate_many(self, signature, constraint_assignment, k, kind='meet'):
+        # k input tuples for the (name, data_type) signature, the parameters named in
+        # constraint_assignment get values that do (or do not) meet their constraints and the
+        # others are drawn from their whole domain without involving z3
+        columns = []
+        for name, data_type in signature:
+            value_type = self.value_type(data_type)
+            constraints = constraint_assignment.get(name, [])
+            if is_expr(constraints):
+                constraints = [constraints]
+            if constraints:
+                columns.append(self.generate_values(value_type, constraints, k, kind))
+            else:
+                columns.append(self.draw_free(value_type, k))
+        return [list(values) for values in zip(*columns)] if columns else [[] for _ in range(k)]
+
+    def generate_values(self, value_type, constraints, k, kind='meet'):
+        # k constrained values, taken from the same pools generate() refills
+        ids = tuple(constraint.get_id() for constraint in constraints)
+        self.known_constraints.setdefault(ids, constraints)
+        key = (value_type, kind, ids)
+
+        if self.mode == 'solver':
+            values = []
+            while len(values) < k:
+                values.append(self.generate_from_solver(value_type, constraints, kind, key))
+            return values
+        if value_type != str:
+            predicate = self.compile_constraints(value_type, constraints, ids)
+            if predicate is not None:
+                return self.take_vectorized(value_type, predicate, kind, key, k)
+        return [self.generate(value_type, constraints, kind) for _ in range(k)]
+
+    def take_vectorized(self, value_type, predicate, kind, key, k):
+        pool_key = ('vectorized',) + key
+        pool = self.pool.setdefault(pool_key, [])
+        deadline = time.monotonic() + self.timeout
+        iterations = 0
+        while len(pool) < k:
+            if iterations >= self.max_iterations or (iterations and time.monotonic() > deadline):
+                if not pool:
+                    raise GenerationError('No {} value that does {} the constraints was drawn within the budget'.format(value_type.__name__, kind))
+                # the few values found are repeated rather than failing the whole batch
+                pool[:] = islice(cycle(pool), k)
+                break
+            iterations += 1
+            candidates = self.draw_candidates(value_type, max(CANDIDATE_BATCH, k))
+            satisfies_constraints = predicate(candidates)
+            if kind == 'dont meet':
+                satisfies_constraints = ~satisfies_constraints
+            accepted = candidates[satisfies_constraints]
+            # candidates filtered out in bulk, not comparable to the rejected_samples checked one by one
+            mt.count('rejected_candidates', len(candidates) - len(accepted))
+            pool.extend(accepted.tolist())
+        values = pool[len(pool) - k:]
+        del pool[len(pool) - k:]
+        return values
+
+    def draw_free(self, value_type, k):
+        # Unconstrained values, the same distributions as the single draws
+        if value_type == str:
+            lengths = self.rng.integers(MIN_STR_LEN, MAX_STR_LEN, size=k, endpoint=True)
+            letters = np.array(list(self.chars))[self.rng.integers(0, len(self.chars), size=(k, MAX_STR_LEN))]
+            return [''.join(row[:length]) for row, length in zip(letters.tolist(), lengths.tolist())]
+        return self.draw_candidates(value_type, k).tolist()
 
     def generate_int(self, constraints=[], kind='meet'):
-        while True:
-            value = randint(MIN_INT, MAX_INT)
-            satisfies_constraints = self.satisfies_constraints(value, constraints, int)
-            if self.check_constraints(value, satisfies_constraints, kind) is not None:
-                return value
-                
+        return self.rejection_sample(lambda: randint(MIN_INT, MAX_INT), constraints, int, kind)
+
     def generate_float(self, constraints=[], kind='meet'):
-        while True:
-            value = round(uniform(MIN_INT, MAX_INT), 3)
-            satisfies_constraints = self.satisfies_constraints(value, constraints, float)
-            if self.check_constraints(value, satisfies_constraints, kind) is not None:
-                return value
-            
+        return self.rejection_sample(lambda: round(uniform(MIN_INT, MAX_INT), FLOAT_DECIMALS), constraints, float, kind)
+
     def generate_string(self, constraints=[], kind='meet'):
-        while True:
-            value =  ''.join(choice(self.chars) for _ in range(randint(MIN_STR_LEN, MAX_STR_LEN)))
-            satisfies_constraints = self.satisfies_constraints(value, constraints, str)
-            if self.check_constraints(value, satisfies_constraints, kind) is not None:
-                return value
+        return self.rejection_sample(lambda: ''.join(choice(self.chars) for _ in range(randint(MIN_STR_LEN, MAX_STR_LEN))), constraints, str, kind)
 
     def generate_boolean(self, constraints=[], kind='meet'):
-        while True:
-            value = choice([True, False])
-            satisfies_constraints = self.satisfies_constraints(value, constraints, bool)
+        return self.rejection_sample(lambda: choice([True, False]), constraints, bool, kind)
+
+
+    def rejection_sample(self, draw, constraints, value_type, kind='meet'):
+        deadline = time.monotonic() + self.timeout
+        for _ in range(self.max_iterations):
+            value = draw()
+            satisfies_constraints = self.satisfies_constraints(value, constraints, value_type)
             if self.check_constraints(value, satisfies_constraints, kind) is not None:
                 return value
+            mt.count('rejected_samples')
+            if time.monotonic() > deadline:
+                break
+        raise GenerationError('No {} value that does {} the constraints was drawn within the budget'.format(value_type.__name__, kind))
 
 
-    def satisfies_constraints(self, value, z3_constraints, value_type):
+    def compile_constraints(self, value_type, constraints, key):
+        if (value_type, key) not in self.predicates:
+            x = self.create_z3_variable(value_type)
+            with mt.stage('compile'):
+                self.predicates[(value_type, key)] = cc.compile_constraints(constraints, x)
+        return self.predicates[(value_type, key)]
+
+    def generate_vectorized(self, value_type, predicate, kind, key):
+        key = ('vectorized',) + key
+        if not self.pool.get(key):
+            deadline = time.monotonic() + self.timeout
+            for _ in range(self.max_iterations):
+                candidates = self.draw_candidates(value_type, CANDIDATE_BATCH)
+                satisfies_constraints = predicate(candidates)
+                if kind == 'dont meet':
+                    satisfies_constraints = ~satisfies_constraints
+                accepted = candidates[satisfies_constraints]
+                mt.count('rejected_candidates', len(candidates) - len(accepted))
+                if len(accepted) > 0:
+                    self.pool[key] = accepted.tolist()
+                    break
+                if time.monotonic() > deadline:
+                    break
+            if not self.pool.get(key):
+                raise GenerationError('No {} value that does {} the constraints was drawn within the budget'.format(value_type.__name__, kind))
+        return self.pool[key].pop()
+
+    def draw_candidates(self, value_type, size):
+        if value_type == int:
+            return self.rng.integers(MIN_INT, MAX_INT, size=size, endpoint=True)
+        elif value_type == float:
+            return np.round(self.rng.uniform(MIN_INT, MAX_INT, size=size), FLOAT_DECIMALS)
+        else:
+            return self.rng.integers(0, 1, size=size, endpoint=True).astype(bool)
+
+    def generate_from_solver(self, value_type, constraints, kind, key):
+        if not self.pool.get(key):
+            with mt.stage('solver'):
+                values = self.solve_values(value_type, constraints, kind, self.solver_batch)
+            if not values:
+                raise GenerationError('The solver found no {} value that does {} the constraints within the budget'.format(value_type.__name__, kind))
+            shuffle(values)
+            self.pool[key] = values
+        return self.pool[key].pop()
+
+    def solve_values(self, value_type, constraints, kind='meet', n=SOLVER_BATCH):
+        x = self.create_z3_variable(value_type)
+
+        formula = And(constraints)
+        if kind == 'dont meet':
+            # x must violate the constraints whatever the value of the other variables
+            others = [var for var in get_vars(formula) if not var.eq(x)]
+            formula = ForAll(others, Not(formula)) if others else Not(formula)
+
         solver = Solver()
-        solver.add(z3_constraints)
+        solver.set('random_seed', randint(0, 2**31 - 1))
+        solver.add(formula)
+        solver.add(self.create_z3_domain(x, value_type))
+
+        values = []
+        deadline = time.monotonic() + self.timeout
+        for _ in range(self.max_iterations):
+            remaining = deadline - time.monotonic()
+            if len(values) >= n or remaining <= 0:
+                break
+            solver.set('timeout', max(1, int(remaining * 1000)))
+
+            # Random pivots steer the solver away from always returning the same corner of the domain
+            model = None
+            for pivot in self.create_z3_pivots(x, value_type):
+                solver.push()
+                solver.add(pivot)
+                mt.count('solver_checks')
+                if solver.check() == sat:
+                    model = solver.model()
+                solver.pop()
+                if model is not None:
+                    break
+            if model is None:
+                mt.count('solver_checks')
+                if solver.check() != sat:
+                    break
+                model = solver.model()
+
+            value = self.from_z3_value(model.eval(x, model_completion=True), value_type)
+            values.append(value)
+            # blocking clause, the next model must be a different value
+            solver.add(x != self.to_z3_value(value, value_type))
+
+        return values
+
+
+    def constraint_solver(self, z3_constraints, value_type):
+        # The constraints are asserted once, each candidate is then checked as an assumption so
+        # the solver keeps what it learned from the previous checks
+        if is_expr(z3_constraints):
+            z3_constraints = [z3_constraints]
+        ids = tuple(constraint.get_id() for constraint in z3_constraints)
+        self.known_constraints.setdefault(ids, z3_constraints)
+        key = (value_type, ids)
+        if key not in self.solvers:
+            solver = Solver()
+            solver.add(z3_constraints)
+            self.solvers[key] = solver
+        return self.solvers[key]
+
+    def satisfies_constraints(self, value, z3_constraints, value_type):
+        with mt.stage('solver'):
+            solver = self.constraint_solver(z3_constraints, value_type)
+
+            # Create a Z3 expression for the concrete value
+            concrete_value = self.create_z3_value(value, value_type)
+
+            mt.count('solver_checks')
+            return solver.check(concrete_value) == sat
 
-        # Create a Z3 expression for the concrete value
-        concrete_value = self.create_z3_value(value, value_type)
-        solver.add(concrete_value)
 
-        return solver.check() == sat
-    
-    
     def check_constraints(self, value, satisfies_constraints, kind='meet'):
         if kind == 'meet' and satisfies_constraints:
                 return value
@@ -88,4 +322,63 @@ class RandomGenerator:
         else:
             raise ValueError("Unsupported value type")
 
+    def create_z3_variable(self, value_type):
+        if value_type == int:
+            return Int('x')
+        elif value_type == float:
+            return Real('x')
+        elif value_type == str:
+            return String('x')
+        elif value_type == bool:
+            return Bool('x')
+        else:
+            raise ValueError("Unsupported value type")
+
+    def create_z3_domain(self, x, value_type):
+        # Same domain the random draws use
+        if value_type == int:
+            return And(x >= MIN_INT, x <= MAX_INT)
+        elif value_type == float:
+            scaled = Int('x_scaled')
+            return And(x * 10**FLOAT_DECIMALS == ToReal(scaled), x >= MIN_INT, x <= MAX_INT)
+        elif value_type == str:
+            letters = Plus(Union(Range('a', 'z'), Range('A', 'Z')))
+            return And(InRe(x, letters), Length(x) >= MIN_STR_LEN, Length(x) <= MAX_STR_LEN)
+        else:
+            return BoolVal(True)
 
+    def create_z3_pivots(self, x, value_type):
+        # first the value a plain random draw would give, then a random window of the domain
+        if value_type == int or value_type == float:
+            if value_type == int:
+                value = randint(MIN_INT, MAX_INT)
+            else:
+                value = round(uniform(MIN_INT, MAX_INT), FLOAT_DECIMALS)
+            low = randint(MIN_INT, MAX_INT)
+            width = (MAX_INT - MIN_INT) // 16
+            return [x == self.to_z3_value(value, value_type), And(x >= low, x <= low + width)]
+        elif value_type == str:
+            value = ''.join(choice(self.chars) for _ in range(randint(MIN_STR_LEN, MAX_STR_LEN)))
+            return [x == StringVal(value), Length(x) == randint(MIN_STR_LEN, MAX_STR_LEN)]
+        else:
+            return [x == choice([True, False])]
+
+    def from_z3_value(self, value, value_type):
+        if value_type == int:
+            return value.as_long()
+        elif value_type == float:
+            return round(float(value.as_fraction()), FLOAT_DECIMALS)
+        elif value_type == str:
+            return value.as_string()
+        else:
+            return is_true(value)
+
+    def to_z3_value(self, value, value_type):
+        if value_type == int:
+            return IntVal(value)
+        elif value_type == float:
+            return RealVal(value)
+        elif value_type == str:
+            return StringVal(value)
+        else:
+            return BoolVal(value)
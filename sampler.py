@@ -1,21 +1,43 @@
+import os
 import json
 import random
 import csv
+import multiprocessing
+
+import utils as ut
+import classifier as cl
+import prediction_cache as pc
+# numpy is imported by the functions writing or reading the pre-tokenized dataset
+
+# Pre-tokenized dataset: tokens.npy (one padded row of word ids per sample), labels.npy and vocab.json
+DATASET_DIR = 'dataset'
+TOKENS_FILE = 'tokens.npy'
+LABELS_FILE = 'labels.npy'
+VOCAB_FILE = 'vocab.json'
+# Rows generated by each shard, the dataset does not depend on the number of processes
+SHARD_SIZE = 50000
+# Rows copied to the mapped files at once
+CHUNK_SIZE = 4096
+
+
+def iter_samples(json_data, num_samples=15, max_sample_size=10, rng=random, start=0, stop=None):
+    # Samples start..stop of the sequence num_samples per datatype, in the order of the json file
+    datatypes = list(json_data.keys())
+    if stop is None:
+        stop = len(datatypes) * num_samples
+    for row in range(start, stop):
+        datatype = datatypes[row // num_samples]
+        ops_funcs = json_data[datatype]
+        sample_size = rng.randint(1, len(ops_funcs))
+        sample_size = min(sample_size, max_sample_size)
+        yield datatype, rng.sample(ops_funcs, sample_size)
+
 
 def generate_random_samples(json_file, num_samples=15, max_sample_size=10):
     with open(json_file, 'r') as file:
         json_data = json.load(file)
 
-    samples = []
-
-    for datatype, ops_funcs in json_data.items():
-        for _ in range(num_samples):
-            sample_size = random.randint(1, len(ops_funcs))
-            sample_size = min(sample_size, max_sample_size)
-            random_sample = random.sample(ops_funcs, sample_size)
-            samples.append((datatype, random_sample))
-
-    return samples
+    return list(iter_samples(json_data, num_samples, max_sample_size))
 
 def write_to_csv(samples, output_file="random_samples.csv"):
     with open(output_file, mode='w', newline='') as file:
@@ -26,13 +48,114 @@ def write_to_csv(samples, output_file="random_samples.csv"):
             writer.writerow([sample[0], sample[1]])
 
 
+def words(ops_funcs):
+    # Same words the Keras Tokenizer finds in the string of the op list
+    return pc.normalize(ops_funcs).split()
+
+
+def build_vocabulary(json_data):
+    # Word ids start at 1, 0 is the padding, as in a fitted Keras Tokenizer
+    word_index = {}
+    for ops_funcs in json_data.values():
+        for op in ops_funcs:
+            for word in words(str([op])):
+                word_index.setdefault(word, len(word_index) + 1)
+    # LabelEncoder sorts its classes
+    return word_index, sorted(json_data.keys())
+
+
+def shard_rng(seed, shard):
+    # string seeds are hashed with sha512, the same seed gives the same shard on every run
+    return random.Random('{}:{}'.format(seed, shard))
+
+
+def write_shard(task):
+    import numpy as np
+
+    output_dir, json_data, num_samples, max_sample_size, seed, shard, start, stop, word_index, classes = task
+    tokens = np.load(os.path.join(output_dir, TOKENS_FILE), mmap_mode='r+')
+    labels = np.load(os.path.join(output_dir, LABELS_FILE), mmap_mode='r+')
+    label_index = {datatype: idx for idx, datatype in enumerate(classes)}
+    max_length = tokens.shape[1]
+
+    # rows are assembled in a small buffer and copied to the mapped files one chunk at a time
+    buffer = np.zeros((min(CHUNK_SIZE, stop - start), max_length), dtype=np.int32)
+    buffer_labels = np.zeros(len(buffer), dtype=np.int32)
+    row = start
+    filled = 0
+    for datatype, ops_funcs in iter_samples(json_data, num_samples, max_sample_size, shard_rng(seed, shard), start, stop):
+        # padded and truncated at the front, like pad_sequences
+        ids = [word_index[word] for word in words(ops_funcs)][-max_length:]
+        buffer[filled] = 0
+        buffer[filled, max_length - len(ids):] = ids
+        buffer_labels[filled] = label_index[datatype]
+        filled += 1
+        if filled == len(buffer):
+            tokens[row:row + filled] = buffer
+            labels[row:row + filled] = buffer_labels
+            row += filled
+            filled = 0
+    tokens[row:row + filled] = buffer[:filled]
+    labels[row:row + filled] = buffer_labels[:filled]
 
-def sample():
+    tokens.flush()
+    labels.flush()
+    return stop - start
+
+
+def write_dataset(json_data, num_samples=500, max_sample_size=10, jobs=1, seed=0, output_dir=DATASET_DIR, max_length=cl.MAX_SEQUENCE_LENGTH):
+    import numpy as np
+
+    os.makedirs(output_dir, exist_ok=True)
+    # a previous dataset is only complete once its vocabulary is written
+    vocab_path = os.path.join(output_dir, VOCAB_FILE)
+    if os.path.isfile(vocab_path):
+        os.remove(vocab_path)
+
+    word_index, classes = build_vocabulary(json_data)
+    rows = len(json_data) * num_samples
+    tokens = np.lib.format.open_memmap(os.path.join(output_dir, TOKENS_FILE), mode='w+', dtype=np.int32, shape=(rows, max_length))
+    labels = np.lib.format.open_memmap(os.path.join(output_dir, LABELS_FILE), mode='w+', dtype=np.int32, shape=(rows,))
+    del tokens, labels
+
+    tasks = [(output_dir, json_data, num_samples, max_sample_size, seed, shard, start, min(start + SHARD_SIZE, rows), word_index, classes)
+             for shard, start in enumerate(range(0, rows, SHARD_SIZE))]
+    if jobs > 1 and len(tasks) > 1:
+        with multiprocessing.Pool(min(jobs, len(tasks))) as pool:
+            written = sum(pool.imap_unordered(write_shard, tasks))
+    else:
+        written = sum(write_shard(task) for task in tasks)
+
+    with open(vocab_path, 'w') as vocab_file:
+        json.dump({'word_index': word_index, 'classes': classes, 'rows': written, 'max_length': max_length, 'seed': seed}, vocab_file, indent=1)
+    return written
+
+
+def load_dataset(output_dir=DATASET_DIR):
+    # Memory-mapped tokens and labels, rows are only read when they are used
+    import numpy as np
+
+    with open(os.path.join(output_dir, VOCAB_FILE)) as vocab_file:
+        vocab = json.load(vocab_file)
+    tokens = np.load(os.path.join(output_dir, TOKENS_FILE), mmap_mode='r')
+    labels = np.load(os.path.join(output_dir, LABELS_FILE), mmap_mode='r')
+    return tokens, labels, vocab
+
+
+def has_dataset(output_dir=DATASET_DIR):
+    return os.path.isfile(os.path.join(output_dir, VOCAB_FILE))
+
+
+def sample(num_samples=500, jobs=1, seed=None):
     # Specify the path to your JSON file
     json_file_path = "types.json"
+    with open(json_file_path, 'r') as file:
+        json_data = json.load(file)
 
-    # Generate random samples from the JSON file
-    random_samples = generate_random_samples(json_file_path, num_samples=500, max_sample_size=10)
+    if seed is None:
+        seed = random.randrange(2**32)
+    ut.print_info('Seed: {}'.format(seed))
 
-    # Write samples to CSV
-    write_to_csv(random_samples)
\ No newline at end of file
+    # Generate the random samples straight into the pre-tokenized dataset
+    rows = write_dataset(json_data, num_samples=num_samples, max_sample_size=10, jobs=jobs, seed=seed)
+    ut.print_info('Samples written to "{}": {}'.format(DATASET_DIR, rows))
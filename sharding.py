@@ -0,0 +1,127 @@
+import os
+import json
+import glob
+import hashlib
+import argparse
+
+import ast_parser as ap
+import tester as t
+
+# Statistics of one shard, written next to the tests it generated
+SHARD_FILE = '.allforone_shard_{}_of_{}.json'
+VERSION = 1
+
+
+def parse_shard(text):
+    # 'i/N' with 1 <= i <= N, as given to --shard
+    try:
+        index, count = (int(part) for part in text.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected i/N, got "{}"'.format(text))
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('shard {} out of range'.format(text))
+    return index, count
+
+
+def module_cost(path):
+    # Estimated generation cost of a module: one unit per function and one per parameter,
+    # read from the source without importing it
+    if path is None or not os.path.isfile(path):
+        return 1
+    try:
+        functions = ap.inspect_file(path)
+    except (SyntaxError, UnicodeDecodeError):
+        return 1
+    return max(1, sum(1 + len(info.parameters) for info in functions.values()))
+
+
+def module_digests(path):
+    # Digest of every function of a module, None when its source cannot be read
+    if path is None or not os.path.isfile(path):
+        return None
+    try:
+        functions = ap.inspect_file(path)
+    except (SyntaxError, UnicodeDecodeError):
+        return None
+    return {function_name: info.digest for function_name, info in functions.items()}
+
+
+def tree_hash(digests):
+    # Every shard of a run must have generated from the same source: the same modules holding
+    # the same functions, any edit to a function or its module context changes the hash
+    return hashlib.sha256(json.dumps(sorted(digests.items()), sort_keys=True).encode()).hexdigest()
+
+
+def shard_modules(modules, costs, shard):
+    # Modules of shard i out of N, the same on every machine given the same source tree
+    index, count = shard
+    partitions = t.partition(modules, costs, count, keep_empty=True)
+    selected = set(partitions[index - 1])
+    # generated in the order of the unsharded run
+    return [module_name for module_name in modules if module_name in selected]
+
+
+def store_shard_stats(dst, shard, stats):
+    index, count = shard
+    path = os.path.join(dst, SHARD_FILE.format(index, count))
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as shard_file:
+        json.dump(dict(stats, version=VERSION, shard=index, shards=count), shard_file, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+    return path
+
+
+def find_shard_files(paths):
+    # Shard statistics given directly or found in the given folders
+    shard_files = []
+    for path in paths:
+        if os.path.isdir(path):
+            shard_files.extend(sorted(glob.glob(os.path.join(path, SHARD_FILE.format('*', '*')))))
+        else:
+            shard_files.append(path)
+    return shard_files
+
+
+def load_shards(paths):
+    shards = []
+    for path in find_shard_files(paths):
+        with open(path) as shard_file:
+            shards.append(json.load(shard_file))
+    if not shards:
+        raise ValueError('No shard statistics found')
+
+    # all the shards of one run, each of them once
+    first = shards[0]
+    for stats in shards:
+        if stats.get('version') != VERSION:
+            raise ValueError('Shard statistics written by another version')
+        for key in ('shards', 'seed', 'tree'):
+            if stats[key] != first[key]:
+                raise ValueError('Shard {}/{} does not belong to the same run ({} differs)'.format(stats['shard'], stats['shards'], key))
+    indexes = sorted(stats['shard'] for stats in shards)
+    if len(set(indexes)) != len(indexes):
+        raise ValueError('Shard statistics given twice: {}'.format(indexes))
+    return sorted(shards, key=lambda stats: stats['shard'])
+
+
+def merge_shards(shards):
+    # One report for the whole tree, the missing shards are listed instead of failing
+    count = shards[0]['shards']
+    modules = {}
+    for stats in shards:
+        modules.update(stats['modules'])
+    times = {stats['shard']: stats['total_time'] for stats in shards}
+    return {
+        'shards': count,
+        'seed': shards[0]['seed'],
+        'tree': shards[0]['tree'],
+        'missing_shards': sorted(set(range(1, count + 1)) - set(times)),
+        'modules': modules,
+        'functions': sum(entry['functions'] for entry in modules.values()),
+        'tests': sum(entry['tests'] for entry in modules.values()),
+        'reused': sum(entry['reused'] for entry in modules.values()),
+        'shard_times': times,
+        'shard_costs': {stats['shard']: sum(entry['cost'] for entry in stats['modules'].values()) for stats in shards},
+        # wall time of the fan-out is the slowest shard
+        'makespan': max(times.values())
+    }
@@ -1,6 +1,6 @@
-import ast
 from z3 import *
 import utils as ut
+import metrics as mt
 
 MIN_INT = -1000
 MAX_INT = 1000
@@ -19,13 +19,19 @@ type_mapping = {
 }
 
 
+# Constraint sets already built, keyed by the sort of the datatype and the usage pattern, the
+# least recently used go first
+_constraint_cache = {}
+MAX_CONSTRAINT_SETS = 4096
+
+
 def build_constraints_from_dict(data_type, data):
     constraints = []
 
     for param, operations in data.items():
         # ut.print_info(f"Processing parameter: {param}")
         for operation_info in operations:
-            op_type = operation_info['type']
+            op_type = operation_info.type
             if op_type == 'Call':
                 continue
             
@@ -34,78 +40,99 @@ def build_constraints_from_dict(data_type, data):
                 left_var = type_mapping.get(data_type)('x')
                 right_var = type_mapping.get(data_type)('y')
 
-                if isinstance(operation_info['op'][1], ast.Add):
+                if operation_info.op == 'Add':
                     constraints.append(Or(left_var + right_var <= MAX_INT, left_var - right_var >= MIN_INT))
-                elif isinstance(operation_info['op'][1], ast.Sub):
+                elif operation_info.op == 'Sub':
                     constraints.append(Or(left_var - right_var <= MAX_INT, left_var + right_var >= MIN_INT))
-                elif isinstance(operation_info['op'][1], ast.Mult):
+                elif operation_info.op == 'Mult':
                     constraints.append(Or(left_var * right_var <= MAX_INT, left_var * right_var >= MIN_INT))
-                elif isinstance(operation_info['op'][1], ast.Div):
+                elif operation_info.op == 'Div':
                     constraints.append(right_var != 0)
-                elif isinstance(operation_info['op'][1], ast.Mod):
+                elif operation_info.op == 'Mod':
                     constraints.append(right_var != 0)
 
 
             elif op_type == 'BoolOp':
                 x = type_mapping.get(data_type)('x')
 
-                if isinstance(operation_info['op'][1], ast.And):
+                if operation_info.op == 'And':
                     constraints.append(x == True)
                     constraints.append(x == False)
-                elif isinstance(operation_info['op'][1], ast.Or):
+                elif operation_info.op == 'Or':
                     constraints.append(x == False)
                     constraints.append(x == True)
-                elif isinstance(operation_info['op'][1], ast.Not):
+                elif operation_info.op == 'Not':
                     constraints.append(x == True)
                     constraints.append(x == False)
 
 
             elif op_type == 'Compare':
-                for i in range(len(operation_info['comparators'])):
+                for op in operation_info.ops:
                     x = type_mapping.get(data_type)('x')
                     y = type_mapping.get(data_type)('y')
 
-                    if isinstance(operation_info['ops'][i][1], ast.Eq):
+                    if op == 'Eq':
                         constraints.append(x == y)
-                    elif isinstance(operation_info['ops'][i][1], ast.NotEq):
+                    elif op == 'NotEq':
                         constraints.append(x != y)
-                    elif isinstance(operation_info['ops'][i][1], ast.Lt):
+                    elif op == 'Lt':
                         constraints.append(x < y)
-                    elif isinstance(operation_info['ops'][i][1], ast.LtE):
+                    elif op == 'LtE':
                         constraints.append(x <= y)
-                    elif isinstance(operation_info['ops'][i][1], ast.Gt):
+                    elif op == 'Gt':
                         constraints.append(x > y)
-                    elif isinstance(operation_info['ops'][i][1], ast.GtE):
+                    elif op == 'GtE':
                         constraints.append(x >= y)
 
             elif op_type == 'UnaryOp':
                 x = type_mapping.get(data_type)('x')
-                if isinstance(operation_info['op'][1], ast.USub):
+                if operation_info.op == 'USub':
                     constraints.append(x >= 0)
                     constraints.append(x <= 0)
-                elif isinstance(operation_info['op'][1], ast.UAdd):
-                    x = type_mapping.get(data_type)('x')
+                elif operation_info.op == 'UAdd':
                     constraints.append(x <= 0)
                     constraints.append(x >= 0)
-                elif (operation_info['op'][1], ast.Not):
-                    x = type_mapping.get(data_type)('x')
+                elif operation_info.op == 'Not':
                     constraints.append(x == True)
                     constraints.append(x == False)
-                elif (operation_info['op'][1], ast.Invert):
-                    x = type_mapping.get(data_type)('x')
+                elif operation_info.op == 'Invert':
                     constraints.append(x >= 0)
                     constraints.append(x <= 0)
 
-            elif op_type == 'Assign':
-                x = type_mapping.get(data_type)('x')
-
-                if isinstance(operation_info['value'], ast.Constant):
-                    constraints.append(x == operation_info['value'].value)
-
-            elif op_type == 'Return':
-                x = type_mapping.get(data_type)('x')
+    return constraints
 
-                if isinstance(operation_info['value'], ast.Constant):
-                    constraints.append(x == operation_info['value'].value)
 
+def usage_pattern(data):
+    # The constraints only depend on the operations, not on the parameter names. The type of the
+    # constants is part of the pattern since 1, 1.0 and True are equal keys otherwise
+    return tuple(tuple(operation + (type(operation.value).__name__,) for operation in operations) for operations in data.values())
+
+
+def unique_constraints(constraints):
+    # z3 shares structurally equal terms, so two constraints are the same when their simplified
+    # forms have the same id (x < y and Not(y <= x) for instance). The first form found is kept,
+    # in order, and the simplified terms stay referenced so their ids are not recycled meanwhile
+    canonical_terms = []
+    seen = set()
+    unique = []
+    for constraint in constraints:
+        canonical = simplify(constraint)
+        canonical_terms.append(canonical)
+        if canonical.get_id() not in seen:
+            seen.add(canonical.get_id())
+            unique.append(constraint)
+    return tuple(unique)
+
+
+def cached_constraints(data_type, data):
+    # Built once for every datatype and usage pattern, then shared by all the repetitions,
+    # parameters and functions using it
+    key = (type_mapping.get(data_type), usage_pattern(data))
+    constraints = _constraint_cache.pop(key, None)
+    if constraints is None:
+        mt.count('constraint_sets_built')
+        constraints = unique_constraints(build_constraints_from_dict(data_type, data))
+    _constraint_cache[key] = constraints
+    while len(_constraint_cache) > MAX_CONSTRAINT_SETS:
+        del _constraint_cache[next(iter(_constraint_cache))]
     return constraints
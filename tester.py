@@ -1,19 +1,126 @@
 import os
+import sys
+import json
+import heapq
+import tempfile
+import subprocess
+import xml.etree.ElementTree as ET
+from collections import namedtuple
 
-def run_tests(dst):
+# Seconds each test file took in its last run, kept next to the generated tests
+DURATIONS_FILE = '.test_durations.json'
+# Coverage data file of every shard, combined into .coverage once all of them finish
+SHARD_DATA_FILE = '.coverage.shard{}'
+
+# Outcome of a whole run: test counts, seconds per test file and the exit code of the run
+TestRun = namedtuple('TestRun', ['passed', 'failed', 'errors', 'skipped', 'durations', 'exit_code'])
+
+
+def load_durations(tests_path):
+    path = os.path.join(tests_path, DURATIONS_FILE)
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path) as durations_file:
+            return json.load(durations_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def store_durations(tests_path, durations):
+    with open(os.path.join(tests_path, DURATIONS_FILE), 'w') as durations_file:
+        json.dump(durations, durations_file, indent=1, sort_keys=True)
+
+
+def partition(file_names, durations, shards, keep_empty=False):
+    # Longest processing time first: the slowest file goes to the least loaded shard. Files
+    # that never ran are assumed to take as long as an average file
+    known = [durations[name] for name in file_names if name in durations]
+    default = sum(known) / len(known) if known else 1.0
+    costs = sorted(((durations.get(name, default), name) for name in file_names), key=lambda item: (-item[0], item[1]))
+
+    loads = [(0.0, shard) for shard in range(shards)]
+    partitions = [[] for _ in range(shards)]
+    for cost, name in costs:
+        load, shard = heapq.heappop(loads)
+        partitions[shard].append(name)
+        heapq.heappush(loads, (load + cost, shard))
+    return [sorted(names) for names in partitions if names or keep_empty]
+
+
+def read_report(report_path, file_names):
+    # Test counts and per file durations from the junit report of a shard
+    counts = {'passed': 0, 'failed': 0, 'errors': 0, 'skipped': 0}
+    durations = {}
+    if not os.path.isfile(report_path):
+        return counts, durations
+
+    stems = {name[:-3]: name for name in file_names}
+    for case in ET.parse(report_path).iter('testcase'):
+        if case.find('failure') is not None:
+            counts['failed'] += 1
+        elif case.find('error') is not None:
+            counts['errors'] += 1
+        elif case.find('skipped') is not None:
+            counts['skipped'] += 1
+        else:
+            counts['passed'] += 1
+
+        name = next((stems[part] for part in case.get('classname', '').split('.') if part in stems), None)
+        if name is not None:
+            durations[name] = durations.get(name, 0.0) + float(case.get('time', 0))
+    return counts, durations
+
+
+def combined_exit_code(exit_codes):
+    # A shard whose files hold no test (pytest exit code 5) does not fail the run when other
+    # shards ran tests. Otherwise a failure in any shard fails the run, or the worst code wins
+    ran = [code for code in exit_codes if code != 5]
+    if not ran:
+        return 5
+    return 1 if 1 in ran else max(ran)
+
+
+def run_tests(dst, jobs=1):
     current_directory = os.path.dirname(os.path.realpath(__file__))
 
     tests_path = os.path.join(current_directory, dst)
 
     print(f'Running tests from {tests_path}')
 
-    file_paths = []
+    file_names = sorted(file_name for file_name in os.listdir(tests_path) if file_name.startswith('test_') and file_name.endswith('.py'))
+    if not file_names:
+        return TestRun(0, 0, 0, 0, {}, 5)
+
+    durations = load_durations(tests_path)
+    shards = partition(file_names, durations, max(1, jobs))
+
+    with tempfile.TemporaryDirectory() as reports_path:
+        # Every shard is a pytest process of its own writing its own coverage data file
+        processes = []
+        for shard, names in enumerate(shards):
+            print(f'Running coverage for shard {shard}: {", ".join(names)}')
+            report_path = os.path.join(reports_path, f'shard{shard}.xml')
+            environment = dict(os.environ, COVERAGE_FILE=SHARD_DATA_FILE.format(shard))
+            command = [sys.executable, '-m', 'coverage', 'run', '-m', 'pytest', '-q', '-p', 'no:cacheprovider',
+                       f'--junitxml={report_path}'] + [os.path.join(tests_path, name) for name in names]
+            processes.append((subprocess.Popen(command, env=environment), report_path, names))
+
+        counts = {'passed': 0, 'failed': 0, 'errors': 0, 'skipped': 0}
+        exit_codes = []
+        for process, report_path, names in processes:
+            exit_codes.append(process.wait())
+            shard_counts, shard_durations = read_report(report_path, names)
+            for key, value in shard_counts.items():
+                counts[key] += value
+            durations.update(shard_durations)
 
-    for file_name in os.listdir(tests_path):
-        if file_name.startswith('test_') and file_name.endswith('.py'):
-            test_file_path = os.path.join(tests_path, file_name)
+    store_durations(tests_path, durations)
 
-            print(f'Running coverage for {file_name}')
-            file_paths.append(test_file_path)
+    data_files = [SHARD_DATA_FILE.format(shard) for shard in range(len(shards))]
+    subprocess.run([sys.executable, '-m', 'coverage', 'combine'] + [path for path in data_files if os.path.isfile(path)],
+                   stdout=subprocess.DEVNULL)
 
-    os.system(f'coverage run -m pytest {" ".join(file_paths)}')
+    exit_code = combined_exit_code(exit_codes)
+    return TestRun(counts['passed'], counts['failed'], counts['errors'], counts['skipped'],
+                   {name: durations[name] for name in file_names if name in durations}, exit_code)
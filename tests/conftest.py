@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the tool live at the top of the repository
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
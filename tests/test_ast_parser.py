@@ -0,0 +1,156 @@
+import os
+import ast
+import textwrap
+
+import ast_parser as ap
+
+SOURCE = '''
+import math
+
+
+def f(x, y):
+    z = x + y
+    if x < y <= 3:
+        x = 5
+    return ~math.sqrt(y) - x
+
+
+def g(x):
+    return x
+'''
+
+
+def usages():
+    return ap.analyze_source(textwrap.dedent(SOURCE))
+
+
+def test_usages_of_every_parameter_in_walk_order():
+    f = usages()['f']
+    assert [(operation.type, operation.op, operation.ops, operation.func) for operation in f['x']] == [
+        ('BinOp', 'Add', (), None),
+        ('Compare', None, ('Lt', 'LtE'), None),
+        ('Assign', None, (), None),
+        ('BinOp', 'Sub', (), None)]
+    assert ap.process_result(f) == {'x': ['Add', 'Lt', 'LtE', 'Sub'], 'y': ['Add', 'Lt', 'LtE', 'sqrt']}
+
+
+def test_assigned_constant_is_recorded():
+    assign, = [operation for operation in usages()['f']['x'] if operation.type == 'Assign']
+    assert assign.value == 5
+
+
+def test_returned_parameter_is_not_a_usage():
+    assert usages()['g'] == {'x': []}
+
+
+def test_deep_nesting_does_not_hit_the_recursion_limit():
+    # a chain of additions deeper than the recursion limit, built directly since the parser
+    # has a limit of its own
+    function = ast.parse('def deep(x):\n    return 1').body[0]
+    chain = function.body[0].value
+    for _ in range(5000):
+        chain = ast.BinOp(chain, ast.Add(), ast.Name('x', ast.Load()))
+    function.body[0].value = chain
+    assert len(ap.analyze_node(function)['x']) == 5000
+
+
+def test_edited_file_replaces_its_cached_analysis(tmp_path, monkeypatch):
+    monkeypatch.setattr(ap, '_file_cache', {})
+    path = tmp_path / 'edited.py'
+    path.write_text('def f(x):\n    return x + 1\n')
+    first = ap.inspect_file(str(path))
+    assert ap.inspect_file(str(path)) is first
+
+    path.write_text('def f(x):\n    return x - 1\n\ndef g(y):\n    return y\n')
+    os.utime(path, (os.path.getatime(path), os.path.getmtime(path) + 10))
+    assert sorted(ap.inspect_file(str(path))) == ['f', 'g']
+    # the analysis of the previous version is gone
+    assert len(ap._file_cache) == 1
+
+
+def test_file_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(ap, '_file_cache', {})
+    monkeypatch.setattr(ap, 'MAX_CACHED_FILES', 2)
+    paths = []
+    for name in 'abc':
+        paths.append(tmp_path / '{}.py'.format(name))
+        paths[-1].write_text('def {}(x):\n    return x\n'.format(name))
+        ap.inspect_file(str(paths[-1]))
+    assert list(ap._file_cache) == [str(paths[1]), str(paths[2])]
+
+
+PURITY = '''
+import math
+import random
+
+LIMIT = 10
+TABLE = (1, 2, 3)
+items = []
+counter = 0
+
+
+def scale(x):
+    return math.sqrt(abs(x)) * LIMIT + TABLE[0]
+
+
+def uses_scale(x):
+    if x < 0:
+        raise ValueError('negative')
+    return scale(x) + len(str(x))
+
+
+def local_list(x):
+    values = []
+    values.append(x)
+    return values
+
+
+def appends(x):
+    items.append(x)
+    return x
+
+
+def mutates_argument(values):
+    values[0] = 1
+    return values
+
+
+def draws(x):
+    return x + random.random()
+
+
+def counts(x):
+    global counter
+    counter += 1
+    return x
+
+
+def calls_impure(x):
+    return draws(x)
+
+
+async def waits(x):
+    return x
+
+
+class Counter:
+    n = 0
+
+    def __init__(self):
+        Counter.n += 1
+
+
+def uses_class(x):
+    return Counter().n + x
+'''
+
+
+def test_purity_detection():
+    tree = ast.parse(textwrap.dedent(PURITY))
+    # conservative: a mutating method makes a function impure even on a local list
+    assert ap.pure_functions(tree) == {'scale', 'uses_scale'}
+
+
+def test_purity_is_part_of_the_function_info():
+    functions = ap.inspect_source(textwrap.dedent(PURITY))
+    assert functions['scale'].pure and not functions['appends'].pure
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import classifier as cl
+
+tf = pytest.importorskip('tensorflow')
+
+
+def test_batches_are_padded_at_the_end():
+    # rows padded at the front, as written by the sampler
+    padded_sequences = np.array([[0, 0, 0, 1], [0, 0, 2, 3], [0, 4, 5, 6], [0, 0, 0, 7]], dtype=np.int32)
+    labels = np.array([0, 1, 2, 0], dtype=np.int32)
+    rows = []
+    for sequences, batch_labels in cl.make_dataset(padded_sequences, labels, [0, 1, 2, 3]):
+        rows += [(tuple(sequence), label) for sequence, label in zip(sequences.numpy().tolist(), batch_labels.numpy().tolist())]
+    stripped = sorted((tuple(value for value in sequence if value), label) for sequence, label in rows)
+    assert stripped == [((1,), 0), ((2, 3), 1), ((4, 5, 6), 2), ((7,), 0)]
+    for sequence, _ in rows:
+        length = sum(1 for value in sequence if value)
+        assert all(sequence[:length]) and not any(sequence[length:])
+
+
+class FakeModel:
+    def __init__(self, maxlen):
+        self.input_shape = (None, maxlen)
+        self.inputs = None
+
+    def predict(self, data, batch_size=None):
+        self.inputs = data
+        return np.eye(2)[[0] * len(data)]
+
+
+class FakeTokenizer:
+    def texts_to_sequences(self, texts):
+        return [[int(word) for word in text.split()] for text in texts]
+
+
+class FakeLabelEncoder:
+    def inverse_transform(self, labels):
+        return np.array(['int', 'str'])[labels]
+
+
+def predicted_inputs(maxlen):
+    backend = cl.KerasBackend()
+    backend.model, backend.tokenizer, backend.label_encoder = FakeModel(maxlen), FakeTokenizer(), FakeLabelEncoder()
+    assert backend.predict_labels(['1 2', '3 4 5']) == ['int', 'int']
+    return backend.model.inputs.tolist()
+
+
+def test_bucketed_models_get_inputs_padded_at_the_end():
+    assert predicted_inputs(None) == [[1, 2, 0], [3, 4, 5]]
+
+
+def test_fixed_length_models_get_inputs_padded_at_the_front():
+    assert predicted_inputs(4) == [[0, 0, 1, 2], [0, 3, 4, 5]]
+
+
+def test_rows_are_cached_to_a_file(tmp_path):
+    padded_sequences = np.array([[0, 0, 1], [0, 2, 3], [4, 5, 6]], dtype=np.int32)
+    labels = np.array([0, 1, 2], dtype=np.int32)
+    cache_file = str(tmp_path / cl.CACHE_FILE.format('train'))
+    dataset = cl.make_dataset(padded_sequences, labels, [0, 1, 2], training=True, cache_file=cache_file)
+    epochs = [sorted(label for _, batch_labels in dataset for label in batch_labels.numpy().tolist()) for _ in range(2)]
+    assert epochs == [[0, 1, 2], [0, 1, 2]]
+    assert list(tmp_path.glob(cl.CACHE_FILE.format('train') + '*'))
+
+
+def test_cache_files_of_an_earlier_training_are_removed(tmp_path, monkeypatch):
+    import sampler as sm
+
+    monkeypatch.setattr(sm, 'DATASET_DIR', str(tmp_path))
+    stale = tmp_path / (cl.CACHE_FILE.format('train') + '.index')
+    stale.write_text('')
+    assert cl.cache_path('train') == str(tmp_path / cl.CACHE_FILE.format('train'))
+    assert not stale.exists()
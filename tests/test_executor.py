@@ -0,0 +1,139 @@
+import textwrap
+import threading
+
+import pytest
+
+import executor as ex
+
+TARGET = '''
+import os
+import signal
+import time
+
+
+def double(x):
+    return x * 2
+
+
+def divide(x):
+    return 10 // x
+
+
+def sleepy(x):
+    if x == 0:
+        time.sleep(60)
+    return x
+
+
+def stuck(x):
+    # ignores the alarm of the call timeout, only killing the worker stops it
+    if x == 0:
+        signal.signal(signal.SIGALRM, signal.SIG_IGN)
+        while True:
+            pass
+    return x
+
+
+def crash(x):
+    if x == 0:
+        os._exit(3)
+    return x
+
+
+def unsupported(x):
+    return object()
+
+
+def slow(x):
+    time.sleep(0.05)
+    return x
+'''
+
+
+@pytest.fixture
+def src(tmp_path):
+    (tmp_path / 'target_module.py').write_text(textwrap.dedent(TARGET))
+    return str(tmp_path)
+
+
+@pytest.fixture
+def executor(monkeypatch):
+    monkeypatch.setattr(ex, 'GRACE_PERIOD', 0.5)
+    with ex.OracleExecutor(workers=2, timeout=0.5, batch_size=4) as executor:
+        yield executor
+
+
+def test_outcomes_in_input_order(src, executor):
+    results = executor.run(src, 'target_module', 'divide', [(value,) for value in range(-3, 6)])
+    assert results[3] == ('raises', ('builtins', 'ZeroDivisionError', 'integer division or modulo by zero'))
+    assert [outcome for outcome in results if outcome[0] == 'ok'] == [('ok', 10 // value) for value in range(-3, 6) if value != 0]
+
+
+def test_unsupported_output(src, executor):
+    assert executor.run(src, 'target_module', 'unsupported', [(1,)])[0][0] == 'unsupported'
+
+
+def test_call_timeout(src, executor):
+    assert executor.run(src, 'target_module', 'sleepy', [(1,), (0,), (2,)]) == [('ok', 1), ('timeout', None), ('ok', 2)]
+    # the worker survived the timeout
+    assert executor.recycled == 0
+
+
+def test_hung_worker_is_killed_and_the_batch_retried(src, executor):
+    results = executor.run(src, 'target_module', 'stuck', [(1,), (0,), (2,), (3,)])
+    assert results == [('ok', 1), ('timeout', None), ('ok', 2), ('ok', 3)]
+    assert executor.recycled == 2
+
+
+def test_crashed_worker_is_replaced_and_the_batch_retried(src, executor):
+    results = executor.run(src, 'target_module', 'crash', [(1,), (0,), (2,)])
+    assert results == [('ok', 1), ('crashed', 3), ('ok', 2)]
+    assert executor.recycled == 2
+    # the pool keeps working afterwards
+    assert executor.run(src, 'target_module', 'double', [(4,)]) == [('ok', 8)]
+
+
+def test_workers_above_the_memory_limit_are_recycled(src):
+    with ex.OracleExecutor(workers=1, batch_size=2, max_memory=0) as executor:
+        results = executor.run(src, 'target_module', 'double', [(value,) for value in range(5)])
+        assert results == [('ok', value * 2) for value in range(5)]
+        assert executor.recycled == 3
+        assert executor.workers == []
+
+
+def test_traced_results_carry_arcs(src, executor):
+    (outcome, arcs), = executor.run(src, 'target_module', 'divide', [(2,)], trace=True)
+    assert outcome == ('ok', 5)
+    assert arcs
+
+
+def run_in_threads(executor, src, function_name, threads=4, calls=3):
+    results = {}
+    def run(thread):
+        results[thread] = executor.run(src, 'target_module', function_name, [(thread * 10 + call,) for call in range(calls)])
+    workers = [threading.Thread(target=run, args=(thread,)) for thread in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+
+def test_concurrent_runs_share_the_workers(src, monkeypatch):
+    started = []
+    class CountedWorker(ex.Worker):
+        def __init__(self, max_memory):
+            started.append(self)
+            super().__init__(max_memory)
+    monkeypatch.setattr(ex, 'Worker', CountedWorker)
+
+    with ex.OracleExecutor(workers=2, batch_size=1) as executor:
+        results = run_in_threads(executor, src, 'slow')
+        assert results == {thread: [('ok', thread * 10 + call) for call in range(3)] for thread in range(4)}
+        assert len(started) <= 2
+
+
+def test_concurrent_recycling_is_counted_once_per_worker(src):
+    with ex.OracleExecutor(workers=2, batch_size=1, max_memory=0) as executor:
+        run_in_threads(executor, src, 'double')
+        assert executor.recycled == 12
@@ -0,0 +1,71 @@
+import textwrap
+
+import ast_parser as ap
+import file_generator as fg
+import oracle_memo as om
+import random_generator as rg
+
+MODULE = '''
+import os.path
+from os.path import join
+
+
+def add(x, y):
+    return x + y
+
+
+def _helper(x):
+    return x
+
+
+async def fetch(x):
+    return x
+
+
+async def stream(x):
+    yield x
+
+
+def __getattr__(name):
+    raise AttributeError(name)
+'''
+
+
+def test_static_and_import_discovery_find_the_same_functions(tmp_path):
+    (tmp_path / 'discovered.py').write_text(textwrap.dedent(MODULE))
+    static = fg.static_inspector(str(tmp_path), 'discovered')
+    imported = fg.file_inspector(str(tmp_path), 'discovered')
+    assert sorted(static) == sorted(imported) == ['_helper', 'add']
+
+
+def test_case_generator_gives_count_cases_per_constraint():
+    result = {'x': [ap.Operation('BinOp', 'Div', (), None, None), ap.Operation('Compare', None, ('Lt',), None, None)]}
+    cases = fg.case_generator([('x', int), ('y', int)], 3, result, rg.RandomGenerator(mode='sample'), count=10)
+    # y != 0 and x < y, for each of the two parameters
+    assert len(cases) == 10 * 2 * 2
+    assert cases[0]['name'] == 'idx3_x0_constr0' and cases[-1]['name'] == 'idx12_y1_constr1'
+    assert all(len(case['inputs']) == 2 for case in cases)
+
+
+def test_memoizable_functions():
+    settings = {'pure_functions': ['shout', 'mathy.add']}
+    assert fg.memoizable(settings, 'mathy', 'shout', False)
+    assert fg.memoizable(settings, 'mathy', 'add', False)
+    assert not fg.memoizable(settings, 'other', 'add', False)
+    assert fg.memoizable({}, 'mathy', 'sub', True)
+    assert not fg.memoizable({'detect_pure_functions': False}, 'mathy', 'sub', True)
+
+
+def test_memoized_oracle_only_calls_the_function_for_new_inputs(tmp_path):
+    calls = []
+    def add(x, y):
+        calls.append((x, y))
+        return x + y
+
+    plan = {'function_name': 'add', 'function': add, 'digest': 'digest', 'memoizable': True}
+    settings = {'sandbox': False}
+    memo = om.OracleMemo(str(tmp_path / om.MEMO_FILE))
+    assert fg.oracle(None, 'mathy', plan, [{'inputs': [1, 2]}, {'inputs': [3, 4]}], settings, memo=memo) == [('ok', 3), ('ok', 7)]
+    assert fg.oracle(None, 'mathy', plan, [{'inputs': [3, 4]}, {'inputs': [5, 6]}], settings, memo=memo) == [('ok', 7), ('ok', 11)]
+    memo.close()
+    assert calls == [(1, 2), (3, 4), (5, 6)]
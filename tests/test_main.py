@@ -0,0 +1,36 @@
+import classifier as cl
+import main
+
+
+class FakeBackend:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.is_open = False
+        self.artifacts = ()
+
+    def open(self):
+        if self.fail:
+            raise OSError('No file or directory found')
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+
+def fake_session(monkeypatch, backend):
+    session = cl.ClassifierSession(cache_path=None, backend='bag_of_ops')
+    session.backend = backend
+    monkeypatch.setattr(cl, 'get_session', lambda model_name=None, backend='lstm': session)
+    return session
+
+
+def test_init_worker_loads_the_model(monkeypatch):
+    session = fake_session(monkeypatch, FakeBackend())
+    main.init_worker('bag_of_ops')
+    assert session.is_open
+
+
+def test_init_worker_leaves_missing_artifacts_to_the_first_prediction(monkeypatch):
+    session = fake_session(monkeypatch, FakeBackend(fail=True))
+    main.init_worker('bag_of_ops')
+    assert not session.is_open
@@ -0,0 +1,52 @@
+import inspect
+
+import manifest as mf
+
+PARAMETERS = [('x', int), ('y', inspect.Parameter.empty)]
+SETTINGS = {'number_of_tests_per_function': 10, 'generation_mode': 'solver'}
+
+
+def test_store_and_load(tmp_path):
+    manifest = mf.empty_manifest(seed=5)
+    manifest['modules']['mathy'] = {'add': {'key': 'abc', 'tests': 3}}
+    mf.store_manifest(str(tmp_path), manifest)
+    assert mf.load_manifest(str(tmp_path)) == manifest
+
+
+def test_missing_corrupted_or_outdated_manifest_is_empty(tmp_path):
+    assert mf.load_manifest(str(tmp_path)) == mf.empty_manifest()
+    (tmp_path / mf.MANIFEST_FILE).write_text('{"version": ')
+    assert mf.load_manifest(str(tmp_path)) == mf.empty_manifest()
+    (tmp_path / mf.MANIFEST_FILE).write_text('{"version": 0, "modules": {"mathy": {}}}')
+    assert mf.load_manifest(str(tmp_path)) == mf.empty_manifest()
+
+
+def test_function_key_covers_what_the_tests_depend_on():
+    key = mf.function_key('digest', PARAMETERS, SETTINGS, 5)
+    assert mf.function_key('digest', PARAMETERS, SETTINGS, 5) == key
+    assert mf.function_key('other digest', PARAMETERS, SETTINGS, 5) != key
+    assert mf.function_key('digest', [('x', float), ('y', inspect.Parameter.empty)], SETTINGS, 5) != key
+    assert mf.function_key('digest', PARAMETERS, dict(SETTINGS, generation_mode='sample'), 5) != key
+    assert mf.function_key('digest', PARAMETERS, SETTINGS, 6) != key
+    assert mf.function_key('digest', PARAMETERS, SETTINGS, 5, model_hash='model') != key
+
+
+def test_function_key_ignores_other_settings():
+    key = mf.function_key('digest', PARAMETERS, SETTINGS, 5)
+    assert mf.function_key('digest', PARAMETERS, dict(SETTINGS, jobs=4, classifier_backend='bag_of_ops'), 5) == key
+
+
+def test_annotations_given_as_text_or_type_are_the_same():
+    assert mf.function_key('digest', [('x', 'int')], SETTINGS, 5) == mf.function_key('digest', [('x', int)], SETTINGS, 5)
+
+
+def test_shards_keep_manifests_of_their_own(tmp_path):
+    whole = mf.empty_manifest(seed=5)
+    whole['modules'] = {'a': {}, 'b': {}}
+    mf.store_manifest(str(tmp_path), whole)
+    shard = mf.empty_manifest(seed=5)
+    shard['modules'] = {'b': {}}
+    mf.store_manifest(str(tmp_path), shard, (2, 2))
+    assert mf.load_manifest(str(tmp_path)) == whole
+    assert mf.load_manifest(str(tmp_path), (2, 2)) == shard
+    assert mf.load_manifest(str(tmp_path), (1, 2)) == mf.empty_manifest()
@@ -0,0 +1,51 @@
+import pytest
+from z3 import Int
+
+import metrics as mt
+import random_generator as rg
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    mt.reset()
+    yield
+    mt.reset()
+
+
+def test_counters_and_stages_per_module():
+    with mt.module('mathy'):
+        mt.count('solver_checks', 2)
+        with mt.stage('solver'):
+            pass
+    mt.count('solver_checks')
+    measurements = mt.snapshot()
+    assert measurements['counters'] == {'solver_checks': 3}
+    assert measurements['modules']['mathy']['counters'] == {'solver_checks': 2}
+    assert measurements['modules']['mathy']['stages']['solver']['calls'] == 1
+    assert 'solver' not in measurements['modules'][mt.GLOBAL]['stages']
+
+
+def test_merge_adds_the_measurements_of_a_worker():
+    with mt.module('mathy'):
+        mt.count('solver_checks')
+    measurements = mt.snapshot()
+    mt.merge(measurements)
+    assert mt.snapshot()['counters'] == {'solver_checks': 2}
+    assert mt.snapshot()['modules']['mathy']['counters'] == {'solver_checks': 2}
+
+
+def test_rejections_of_filtered_batches_and_single_candidates_are_counted_apart():
+    x = Int('x')
+    rg.RandomGenerator(mode='sample').generate(int, [x > 900], kind='meet')
+    counters = mt.snapshot()['counters']
+    assert counters['rejected_candidates'] > 0
+    assert 'rejected_samples' not in counters
+
+    mt.reset()
+    generator = rg.RandomGenerator(mode='sample')
+    # x % 7 does not compile, every candidate is checked by z3
+    for _ in range(20):
+        generator.generate(int, [x % 7 == 0], kind='meet')
+    counters = mt.snapshot()['counters']
+    assert counters['rejected_samples'] == counters['solver_checks'] - 20
+    assert 'rejected_candidates' not in counters
@@ -0,0 +1,44 @@
+import oracle_memo as om
+
+
+def test_hits_and_misses(tmp_path):
+    memo = om.OracleMemo(str(tmp_path / om.MEMO_FILE))
+    function = om.function_key('mathy', 'add', 'digest')
+    memo.put_many(function, {om.inputs_key((1, 2)): ('ok', 3)})
+    assert memo.get_many(function, [om.inputs_key((1, 2)), om.inputs_key((2, 2))]) == {om.inputs_key((1, 2)): ('ok', 3)}
+    memo.close()
+
+    # kept across runs, for the same function source only
+    memo = om.OracleMemo(str(tmp_path / om.MEMO_FILE))
+    assert memo.get_many(function, [om.inputs_key((1, 2))]) == {om.inputs_key((1, 2)): ('ok', 3)}
+    assert memo.get_many(om.function_key('mathy', 'add', 'edited'), [om.inputs_key((1, 2))]) == {}
+    memo.close()
+
+
+def test_inputs_of_different_types_are_different_keys():
+    assert len({om.inputs_key((1,)), om.inputs_key((1.0,)), om.inputs_key((True,))}) == 3
+
+
+def test_only_outcomes_decided_by_the_function_are_stored(tmp_path):
+    memo = om.OracleMemo(str(tmp_path / om.MEMO_FILE))
+    outcomes = {
+        'ok': ('ok', 1),
+        'raises': ('raises', ('builtins', 'ZeroDivisionError', 'division by zero')),
+        'timeout': ('timeout', None),
+        'crashed': ('crashed', -9),
+        'memory': ('raises', ('builtins', 'MemoryError', '')),
+        'recursion': ('raises', ('builtins', 'RecursionError', 'maximum recursion depth exceeded')),
+    }
+    memo.put_many('f', outcomes)
+    assert sorted(memo.get_many('f', list(outcomes))) == ['ok', 'raises']
+    memo.close()
+
+
+def test_least_recently_used_outcomes_are_evicted(tmp_path):
+    memo = om.OracleMemo(str(tmp_path / om.MEMO_FILE), max_entries=2)
+    memo.put_many('f', {'a': ('ok', 1)})
+    memo.put_many('f', {'b': ('ok', 2)})
+    memo.get_many('f', ['a'])
+    memo.put_many('f', {'c': ('ok', 3)})
+    assert sorted(memo.get_many('f', ['a', 'b', 'c'])) == ['a', 'c']
+    memo.close()
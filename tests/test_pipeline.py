@@ -0,0 +1,72 @@
+import time
+import random
+import threading
+
+import pytest
+
+import pipeline as pl
+
+
+def shuffled_delay(item):
+    time.sleep(random.uniform(0, 0.01))
+    return item
+
+
+def test_results_keep_the_order_of_the_items():
+    stages = [pl.Stage('square', lambda item: item * item, ordered=True),
+              pl.Stage('delay', shuffled_delay, workers=4),
+              pl.Stage('negate', lambda item: -item, ordered=True)]
+    items = list(range(50))
+    assert pl.Pipeline(stages, capacity=3).run(items) == pl.run_sequential(stages, items) == [-item * item for item in items]
+
+
+def test_ordered_stage_sees_the_items_in_order():
+    seen = []
+    stages = [pl.Stage('delay', shuffled_delay, workers=4), pl.Stage('collect', seen.append, ordered=True)]
+    pl.Pipeline(stages).run(range(30))
+    assert seen == list(range(30))
+
+
+def test_ordered_stage_must_have_one_worker():
+    with pytest.raises(ValueError):
+        pl.Stage('write', print, workers=2, ordered=True)
+
+
+def test_first_error_is_raised_after_every_thread_stopped():
+    def fail_on_seven(item):
+        if item == 7:
+            raise KeyError(item)
+        return item
+
+    before = threading.active_count()
+    stages = [pl.Stage('fail', fail_on_seven, workers=3), pl.Stage('write', lambda item: item, ordered=True)]
+    with pytest.raises(KeyError):
+        pl.Pipeline(stages, capacity=2).run(range(100))
+    assert threading.active_count() == before
+
+
+def test_items_ahead_of_an_ordered_stage_are_bounded():
+    # the first item is slow, the workers must not run through all the others meanwhile
+    lock = threading.Lock()
+    started = [0]
+    done = [0]
+    lead = []
+
+    def execute(item):
+        with lock:
+            started[0] += 1
+        if item == 0:
+            time.sleep(0.2)
+        return item
+
+    def write(item):
+        with lock:
+            lead.append(started[0] - done[0])
+            done[0] += 1
+        return item
+
+    stages = [pl.Stage('generate', lambda item: item, ordered=True),
+              pl.Stage('execute', execute, workers=4),
+              pl.Stage('write', write, ordered=True)]
+    assert pl.Pipeline(stages, capacity=3).run(range(40)) == list(range(40))
+    assert max(lead) <= 3 + 1
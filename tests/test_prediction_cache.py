@@ -0,0 +1,45 @@
+import prediction_cache as pc
+
+
+def make_cache(tmp_path, model, **kwargs):
+    artifact = tmp_path / model
+    if not artifact.exists():
+        artifact.write_text(model)
+    return pc.PredictionCache(str(tmp_path / 'predictions.sqlite'), artifacts=(str(artifact),), **kwargs)
+
+
+def test_normalize_ignores_case_and_punctuation():
+    assert pc.normalize("['Add', 'Mult']") == pc.normalize("['add','mult']")
+
+
+def test_hits_and_misses(tmp_path):
+    cache = make_cache(tmp_path, 'lstm')
+    cache.put_many({'add mult': 'int'})
+    assert cache.get_many(['add mult', 'upper']) == {'add mult': 'int'}
+    assert cache.stats() == {'hits': 1, 'misses': 1}
+    cache.close()
+
+
+def test_other_backend_entries_survive(tmp_path):
+    lstm = make_cache(tmp_path, 'lstm')
+    lstm.put_many({'add': 'int'})
+    lstm.close()
+
+    # another model sharing the file neither sees nor removes them
+    bag_of_ops = make_cache(tmp_path, 'bag_of_ops')
+    assert bag_of_ops.get_many(['add']) == {}
+    bag_of_ops.put_many({'add': 'float'})
+    bag_of_ops.close()
+
+    lstm = make_cache(tmp_path, 'lstm')
+    assert lstm.get_many(['add']) == {'add': 'int'}
+    lstm.close()
+
+
+def test_eviction_keeps_the_table_bounded(tmp_path):
+    cache = make_cache(tmp_path, 'lstm', max_entries=3)
+    for idx in range(5):
+        cache.put_many({'op{}'.format(idx): 'int'})
+    assert cache.connection.execute('SELECT COUNT(*) FROM predictions').fetchone()[0] == 3
+    assert set(cache.get_many(['op{}'.format(idx) for idx in range(5)])) == {'op2', 'op3', 'op4'}
+    cache.close()
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+from z3 import Int, Real, String, Length, Or, And, Solver, sat
+
+import constraint_compiler as cc
+import random_generator as rg
+
+
+def z3_satisfies(constraints, x, value):
+    solver = Solver()
+    solver.add(constraints)
+    solver.add(x == value)
+    return solver.check() == sat
+
+
+def test_compiled_predicate_agrees_with_z3():
+    x, y = Int('x'), Int('y')
+    constraints = [Or(x < -500, And(x > 10, x != 20)), x < y]
+    predicate = cc.compile_constraints(constraints, x)
+    candidates = np.array([-1000, -501, -500, 0, 10, 11, 20, 21, 999, 1000])
+    expected = [z3_satisfies(constraints, x, int(value)) for value in candidates]
+    assert predicate(candidates).tolist() == expected
+
+
+def test_unsupported_constraints_are_not_compiled():
+    assert cc.compile_constraints([Length(String('x')) > 3], String('x')) is None
+    assert cc.compile_constraints([Int('x') % 3 == 1], Int('x')) is None
+
+
+def test_solver_mode_does_not_sample(monkeypatch):
+    generator = rg.RandomGenerator(mode='solver')
+    monkeypatch.setattr(generator, 'generate_vectorized', None)
+    monkeypatch.setattr(generator, 'take_vectorized', None)
+    x = Int('x')
+    assert generator.generate(int, [x > 990], kind='meet') > 990
+    assert all(value > 990 for value in generator.generate_values(int, [x > 990], 5))
+
+
+def test_sample_mode_values_meet_the_constraints():
+    generator = rg.RandomGenerator(mode='sample')
+    x = Real('x')
+    values = [generator.generate(float, [x >= 0.5, x < 3], kind='meet') for _ in range(50)]
+    assert all(0.5 <= value < 3 for value in values)
+    values = [generator.generate(float, [x >= 0.5, x < 3], kind='dont meet') for _ in range(50)]
+    assert not any(0.5 <= value < 3 for value in values)
+
+
+def test_free_values_stay_in_the_domain():
+    generator = rg.RandomGenerator()
+    values = [generator.generate(int, [], kind='meet') for _ in range(50)]
+    assert all(rg.MIN_INT <= value <= rg.MAX_INT for value in values)
+
+
+@pytest.mark.parametrize('mode', ['solver', 'sample'])
+def test_generate_many_gives_k_tuples(mode):
+    x = Int('x')
+    tuples = rg.RandomGenerator(mode=mode).generate_many([('x', int), ('y', int), ('s', str)], {'x': x == 5}, 10)
+    assert len(tuples) == 10
+    assert all(values[0] == 5 and isinstance(values[1], int) and isinstance(values[2], str) for values in tuples)
+
+
+def test_generate_many_repeats_values_when_the_budget_runs_out():
+    x = Int('x')
+    # a single batch of candidates holds about 50 of the 500 values asked for
+    generator = rg.RandomGenerator(mode='sample', max_iterations=1)
+    tuples = generator.generate_many([('x', int)], {'x': x > 900}, 500)
+    assert len(tuples) == 500
+    assert all(values[0] > 900 for values in tuples)
+
+
+def test_generate_many_dont_meet():
+    x = Int('x')
+    tuples = rg.RandomGenerator(mode='sample').generate_many([('x', int)], {'x': x > -900}, 20, kind='dont meet')
+    assert len(tuples) == 20 and all(values[0] <= -900 for values in tuples)
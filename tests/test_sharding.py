@@ -0,0 +1,81 @@
+import argparse
+
+import pytest
+
+import sharding as sh
+
+
+def write_module(path, source):
+    path.write_text(source)
+    return str(path)
+
+
+def test_parse_shard():
+    assert sh.parse_shard('2/3') == (2, 3)
+    for text in ('0/3', '4/3', '1/0', 'a/b', '1'):
+        with pytest.raises(argparse.ArgumentTypeError):
+            sh.parse_shard(text)
+
+
+@pytest.mark.parametrize('count', [1, 2, 3, 7, 12])
+def test_shards_cover_every_module_once_in_order(count):
+    modules = ['pkg.module{}'.format(index) for index in range(10)]
+    costs = {module_name: 1 + index % 4 for index, module_name in enumerate(modules)}
+    shards = [sh.shard_modules(modules, costs, (index, count)) for index in range(1, count + 1)]
+    assert sorted(module_name for shard in shards for module_name in shard) == sorted(modules)
+    for shard in shards:
+        assert shard == [module_name for module_name in modules if module_name in shard]
+
+
+def test_shards_are_balanced_by_cost():
+    costs = {'a': 8, 'b': 5, 'c': 4, 'd': 3, 'e': 1}
+    loads = [sum(costs[module_name] for module_name in sh.shard_modules(sorted(costs), costs, (index, 2))) for index in (1, 2)]
+    assert sorted(loads) == [10, 11]
+
+
+def test_module_cost(tmp_path):
+    path = write_module(tmp_path / 'costly.py', 'def f(x, y):\n    return x\n\ndef g():\n    return 1\n')
+    assert sh.module_cost(path) == 4
+    assert sh.module_cost(write_module(tmp_path / 'broken.py', 'def (')) == 1
+    assert sh.module_cost(None) == 1
+
+
+def test_tree_hash_follows_the_function_sources(tmp_path):
+    path = tmp_path / 'hashed.py'
+    write_module(path, 'def f(x):\n    return x + 1\n')
+    tree = sh.tree_hash({'hashed': sh.module_digests(str(path))})
+    assert sh.tree_hash({'hashed': sh.module_digests(str(path))}) == tree
+
+    # same cost, other source
+    other = tmp_path / 'other' / 'hashed.py'
+    other.parent.mkdir()
+    write_module(other, 'def f(x):\n    return x - 1\n')
+    assert sh.module_cost(str(other)) == sh.module_cost(str(path))
+    assert sh.tree_hash({'hashed': sh.module_digests(str(other))}) != tree
+
+
+def shard_stats(index, seed=5, tree='t'):
+    return {'seed': seed, 'tree': tree, 'total_time': float(index),
+            'modules': {'m{}'.format(index): {'cost': index, 'functions': 1, 'tests': 10, 'reused': 0, 'time': 0.5}}}
+
+
+def test_load_and_merge_shards(tmp_path):
+    for index in (1, 3):
+        sh.store_shard_stats(str(tmp_path), (index, 3), shard_stats(index))
+    shards = sh.load_shards([str(tmp_path)])
+    merged = sh.merge_shards(shards)
+    assert merged['missing_shards'] == [2]
+    assert sorted(merged['modules']) == ['m1', 'm3']
+    assert merged['tests'] == 20
+    assert merged['makespan'] == 3.0
+
+
+def test_shards_of_another_run_are_refused(tmp_path):
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    first = sh.store_shard_stats(str(tmp_path / 'a'), (1, 2), shard_stats(1))
+    second = sh.store_shard_stats(str(tmp_path / 'b'), (2, 2), shard_stats(2, tree='u'))
+    with pytest.raises(ValueError):
+        sh.load_shards([first, second])
+    with pytest.raises(ValueError):
+        sh.load_shards([first, first])
@@ -0,0 +1,37 @@
+from z3 import Int, Real
+
+import ast_parser as ap
+import symbolic_executer as se
+
+
+def operation(type, op=None, ops=(), func=None, value=None):
+    return ap.Operation(type, op, ops, func, value)
+
+
+def test_constraints_of_the_operations():
+    x, y = Int('x'), Int('y')
+    constraints = se.build_constraints_from_dict(int, {'a': [operation('BinOp', 'Div'), operation('Compare', ops=('Lt',))]})
+    assert [str(constraint) for constraint in constraints] == [str(y != 0), str(x < y)]
+
+
+def test_assigned_constants_are_not_constraints():
+    assert se.build_constraints_from_dict(int, {'a': [operation('Assign', value=5)]}) == []
+
+
+def test_constraint_sets_are_shared_by_equal_usage_patterns():
+    first = se.cached_constraints(float, {'a': [operation('BinOp', 'Mod'), operation('BinOp', 'Mod')]})
+    second = se.cached_constraints('float', {'b': [operation('BinOp', 'Mod'), operation('BinOp', 'Mod')]})
+    assert first is second
+    assert [str(constraint) for constraint in first] == [str(Real('y') != 0)]
+
+
+def test_constraint_cache_keeps_the_recently_used_sets(monkeypatch):
+    monkeypatch.setattr(se, '_constraint_cache', {})
+    monkeypatch.setattr(se, 'MAX_CONSTRAINT_SETS', 2)
+    div = se.cached_constraints(int, {'a': [operation('BinOp', 'Div')]})
+    se.cached_constraints(int, {'a': [operation('Compare', ops=('Lt',))]})
+    # used again, so the next new set evicts the comparison instead
+    assert se.cached_constraints(int, {'a': [operation('BinOp', 'Div')]}) is div
+    se.cached_constraints(int, {'a': [operation('Compare', ops=('Gt',))]})
+    assert len(se._constraint_cache) == 2
+    assert se.cached_constraints(int, {'a': [operation('BinOp', 'Div')]}) is div
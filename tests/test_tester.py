@@ -0,0 +1,43 @@
+import tester as t
+
+
+def test_partition_covers_every_file_once():
+    names = ['test_{}.py'.format(index) for index in range(10)]
+    durations = {name: float(index) for index, name in enumerate(names)}
+    partitions = t.partition(names, durations, 3)
+    assert sorted(name for partition in partitions for name in partition) == names
+
+
+def test_partition_balances_the_slowest_files():
+    durations = {'test_a.py': 5.0, 'test_b.py': 3.0, 'test_c.py': 2.0, 'test_d.py': 1.0}
+    partitions = t.partition(sorted(durations), durations, 2)
+    assert partitions == [['test_a.py', 'test_d.py'], ['test_b.py', 'test_c.py']]
+
+
+def test_partition_assumes_the_average_for_new_files():
+    partitions = t.partition(['test_new.py', 'test_old.py', 'test_slow.py'], {'test_old.py': 1.0, 'test_slow.py': 3.0}, 2)
+    assert partitions == [['test_slow.py'], ['test_new.py', 'test_old.py']]
+
+
+def test_empty_partitions():
+    assert t.partition(['test_a.py'], {}, 3) == [['test_a.py']]
+    assert t.partition(['test_a.py'], {}, 3, keep_empty=True) == [['test_a.py'], [], []]
+
+
+def test_shards_without_tests_do_not_fail_the_run():
+    assert t.combined_exit_code([0, 5]) == 0
+    assert t.combined_exit_code([5, 1]) == 1
+    assert t.combined_exit_code([5, 5]) == 5
+    assert t.combined_exit_code([2, 0, 1]) == 1
+    assert t.combined_exit_code([0, 2]) == 2
+
+
+def test_run_tests_with_an_empty_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tests_path = tmp_path / 'tests'
+    tests_path.mkdir()
+    (tests_path / 'test_some.py').write_text('def test_one():\n    assert True\n\ndef test_two():\n    assert True\n')
+    (tests_path / 'test_none.py').write_text('VALUE = 1\n')
+    run = t.run_tests(str(tests_path), jobs=2)
+    assert (run.passed, run.failed, run.exit_code) == (2, 0, 0)
+    assert sorted(run.durations) == ['test_some.py']